@@ -0,0 +1,134 @@
+"""API latency under concurrent load, storage called inline on the event loop vs through the thread pool.
+
+Run with `uv run benchmarks/api_latency.py`. A few writers keep PATCHing one hot vault while probes
+GET other vaults and /api/health; with blocking storage calls every probe queues behind the writers'
+file I/O and FileLock waits. The app is driven in-process through httpx's ASGI transport.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from password_manager.app import api  # noqa: E402
+from password_manager.backend.async_storage import AsyncVaultStorage, ThreadedStorage, get_async_vault_storage  # noqa: E402
+from password_manager.backend.database import (  # noqa: E402
+    FileStorage,
+    ServerSideVault,
+    VaultStorage,
+    VaultStream,
+    VaultUpload,
+    VaultValidator,
+)
+from password_manager.util.crypto import sign_data  # noqa: E402
+
+
+class InlineStorage(AsyncVaultStorage):
+    """What the handlers did before: call the sync backend right on the event loop"""
+
+    def __init__(self, storage: VaultStorage):
+        self.sync = storage
+
+    async def aread(self, vault_id: str) -> ServerSideVault:
+        return self.sync.read(vault_id)
+
+    async def awrite(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        return self.sync.write(vault_id, data, expected_version)
+
+    async def acreate(self, vault_id: str) -> ServerSideVault:
+        return self.sync.create(vault_id)
+
+    async def aexists(self, vault_id: str) -> bool:
+        return self.sync.exists(vault_id)
+
+    async def adelete(self, vault_id: str) -> None:
+        self.sync.delete(vault_id)
+
+    async def avalidator(self, vault_id: str) -> VaultValidator:
+        return self.sync.validator(vault_id)
+
+    async def aopen_stream(self, vault_id: str) -> VaultStream:
+        return self.sync.open_stream(vault_id)
+
+    async def aopen_upload(self, vault_id: str, max_size: int) -> VaultUpload:
+        return self.sync.open_upload(vault_id, max_size)
+
+    async def afeed_upload(self, upload: VaultUpload, chunk: bytes) -> None:
+        upload.feed(chunk)
+
+    async def asave_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int:
+        return self.sync.save_upload(upload, expected_version)
+
+
+def percentiles(values: list[float]) -> str:
+    q = statistics.quantiles(values, n=100)
+    return f"p50 {q[49] * 1000:7.2f}ms  p99 {q[98] * 1000:7.2f}ms"
+
+
+async def run(storage: AsyncVaultStorage, args: argparse.Namespace) -> None:
+    app = FastAPI()
+    app.include_router(api.router)
+    app.dependency_overrides[get_async_vault_storage] = lambda: storage
+
+    hot_secret = (await storage.acreate("hot")).vault_secret.encode("utf-8")
+    hot_blob = sign_data(random.randbytes(args.payload), hot_secret)
+    for i in range(args.probes):
+        await storage.acreate(f"cold-{i}")
+
+    stop = asyncio.Event()
+    writes = 0
+    latencies: dict[str, list[float]] = {"health": [], "read": []}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def writer() -> None:
+            nonlocal writes
+            while not stop.is_set():
+                response = await client.patch("/api/vaults/hot", content=hot_blob, headers={"If-Match": "*"})
+                response.raise_for_status()
+                writes += 1
+
+        async def probe(i: int) -> None:
+            while not stop.is_set():
+                for kind, url in (("health", "/api/health"), ("read", f"/api/vaults/cold-{i}")):
+                    start = time.perf_counter()
+                    (await client.get(url)).raise_for_status()
+                    latencies[kind].append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+
+        tasks = [asyncio.create_task(writer()) for _ in range(args.writers)]
+        tasks += [asyncio.create_task(probe(i)) for i in range(args.probes)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    print(f"  writes/s {writes / args.duration:8.1f}")
+    for kind, values in latencies.items():
+        print(f"  {kind:<7} {percentiles(values)}  ({len(values)} requests)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--probes", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--payload", type=int, default=1024 * 1024, help="hot vault size in bytes")
+    args = parser.parse_args()
+
+    for name, make in (("inline", InlineStorage), ("threaded", ThreadedStorage)):
+        with tempfile.TemporaryDirectory() as tmp:
+            print(name)
+            asyncio.run(run(make(FileStorage(tmp)), args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Writes/sec and latency of FileStorage under each durability mode.
+
+Run with `uv run benchmarks/durability.py`. Each writer thread keeps saving its own vault, the way
+separate users PATCHing at the same time would, so group commit has something to batch.
+Point `--path` at the disk you actually deploy on, a tmpfs makes every mode look the same.
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from password_manager.backend.database import FileStorage  # noqa: E402
+from password_manager.backend.durability import DURABILITY_MODES  # noqa: E402
+from password_manager.util.crypto import sign_data  # noqa: E402
+
+
+def run(mode: str, base_path: str, writers: int, duration: float, payload: bytes) -> None:
+    storage = FileStorage(base_path, durability=mode)
+    blobs = {}
+    for i in range(writers):
+        secret = storage.create(f"vault-{i}").vault_secret.encode("utf-8")
+        blobs[f"vault-{i}"] = sign_data(payload, secret)
+
+    latencies: list[float] = []
+    stop = threading.Event()
+
+    def writer(vault_id: str) -> None:
+        mine = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            storage.write(vault_id, blobs[vault_id])
+            mine.append(time.perf_counter() - start)
+        latencies.extend(mine)
+
+    threads = [threading.Thread(target=writer, args=(vault_id,)) for vault_id in blobs]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    q = statistics.quantiles(latencies, n=100)
+    print(
+        f"{mode:<16} {len(latencies) / duration:10.0f} writes/s"
+        f"   p50 {q[49] * 1000:7.2f}ms   p99 {q[98] * 1000:7.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--payload", type=int, default=16 * 1024, help="vault size in bytes")
+    parser.add_argument("--path", default=None, help="dir to run in, defaults to a temp dir")
+    args = parser.parse_args()
+
+    payload = bytes(args.payload)
+    for mode in DURABILITY_MODES:
+        with tempfile.TemporaryDirectory(dir=args.path) as tmp:
+            run(mode, tmp, args.writers, args.duration, payload)
+
+
+if __name__ == "__main__":
+    main()
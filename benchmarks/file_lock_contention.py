@@ -0,0 +1,138 @@
+"""N readers and M writers hammering one FileStorage vault, old write path vs the current one.
+
+Run with `uv run benchmarks/file_lock_contention.py --readers 8 --writers 2`. FileLock is swapped for a
+timed subclass so we can report how long everyone spent waiting on the `.lock` file, next to
+throughput and latency. `LegacyFileStorage` is the original implementation (lock on every read, and
+exists + read + lock again + rewrite in place on every write) kept here as the baseline.
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from cryptography.exceptions import InvalidSignature  # noqa: E402
+from filelock import FileLock  # noqa: E402
+
+from password_manager.backend import database  # noqa: E402
+from password_manager.backend.database import FileStorage, ServerSideVault  # noqa: E402
+from password_manager.util.crypto import sign_data, validate_signature  # noqa: E402
+from password_manager.util.exceptions import VaultReadError, VaultValidationError  # noqa: E402
+
+lock_wait = threading.local()
+
+
+class TimedFileLock(FileLock):
+    """FileLock that adds the time spent acquiring to a per-thread total"""
+
+    def acquire(self, *args: object, **kwargs: object) -> object:
+        start = time.perf_counter()
+        try:
+            return super().acquire(*args, **kwargs)
+        finally:
+            lock_wait.total = getattr(lock_wait, "total", 0.0) + time.perf_counter() - start
+
+
+class LegacyFileStorage(FileStorage):
+    """The write/read path before the atomic rename change"""
+
+    def read(self, vault_id: str) -> ServerSideVault:
+        if not self.exists(vault_id):
+            raise VaultReadError("Vault does not exist")
+        with (
+            TimedFileLock(self._get_path(f"{vault_id}.lock")),
+            Path.open(self._get_path(vault_id), "rb") as f,
+            Path.open(self._get_path(f"{vault_id}.secret"), "r") as s,
+        ):
+            return ServerSideVault(vault_id=vault_id, vault_data=f.read(), vault_secret=s.read())
+
+    def write(self, vault_id: str, data: bytes) -> None:
+        if not self.exists(vault_id):
+            raise VaultReadError("Vault does not exist, cannot write")
+        try:
+            vault = self.read(vault_id)
+            validate_signature(data, vault.vault_secret.encode("utf-8"))
+            with TimedFileLock(self._get_path(f"{vault_id}.lock")), Path.open(self._get_path(vault_id), "wb") as f:
+                f.write(data)
+        except InvalidSignature as e:
+            raise VaultValidationError("Invalid siganture") from e
+
+
+def run(storage: FileStorage, readers: int, writers: int, duration: float, payload: bytes) -> dict[str, object]:
+    secret = storage.create("vault").vault_secret.encode("utf-8")
+    signed = sign_data(payload, secret)
+    storage.write("vault", signed)
+    stop = threading.Event()
+    results: dict[str, list] = {"read": [], "write": [], "read_wait": [], "write_wait": [], "torn": []}
+    results_lock = threading.Lock()
+
+    def worker(kind: str) -> None:
+        latencies = []
+        torn = 0
+        lock_wait.total = 0.0
+        while not stop.is_set():
+            start = time.perf_counter()
+            if kind == "read":
+                data = storage.read("vault").vault_data
+                try:
+                    validate_signature(data, secret)
+                except InvalidSignature:
+                    torn += 1  # saw a half written blob
+            else:
+                storage.write("vault", signed)
+            latencies.append(time.perf_counter() - start)
+        with results_lock:
+            results[kind].extend(latencies)
+            results[f"{kind}_wait"].append(lock_wait.total)
+            results["torn"].append(torn)
+
+    threads = [threading.Thread(target=worker, args=("read",)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=("write",)) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    def p99(values: list[float]) -> float:
+        return statistics.quantiles(values, n=100)[98] * 1000 if len(values) > 1 else 0.0
+
+    return {
+        "reads/s": len(results["read"]) / duration,
+        "writes/s": len(results["write"]) / duration,
+        "read p99 ms": p99(results["read"]),
+        "write p99 ms": p99(results["write"]),
+        "lock wait s": sum(results["read_wait"]) + sum(results["write_wait"]),
+        "torn reads": sum(results["torn"]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--payload", type=int, default=64 * 1024, help="vault size in bytes")
+    args = parser.parse_args()
+
+    database.FileLock = TimedFileLock  # so FileStorage's own locking gets timed too
+    payload = random.randbytes(args.payload)
+    print(f"{args.readers} readers, {args.writers} writers, {args.payload} byte vault, {args.duration}s each")
+    for name, cls in (("legacy", LegacyFileStorage), ("current", FileStorage)):
+        with tempfile.TemporaryDirectory() as tmp:
+            stats = run(cls(tmp), args.readers, args.writers, args.duration, payload)
+        print(
+            f"{name:<8}"
+            + "  ".join(f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}" for k, v in stats.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Import time of the entry points, from `python -X importtime`, to keep startup from creeping up.
+
+Run with `uv run benchmarks/import_time.py`. Each entry point is imported in a fresh interpreter a few
+times (the fastest run counts, the rest is disk cache noise), then we report the total and what the
+time went on, grouped by top level package. It exits non-zero if an entry point goes over its
+`--budget-ms` or imports something it mustn't: `api_main` may never load NiceGUI or our UI components.
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+# what each entry point must never import, by module name prefix
+FORBIDDEN = {
+    "api_main": ("nicegui", "password_manager.components", "password_manager.app.frontend"),
+    "main": (),
+}
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """(module, self us, cumulative us) for everything importing `module` imported, in import order"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return [
+        (match[4], int(match[1]), int(match[2])) for line in result.stderr.splitlines() if (match := _LINE.match(line))
+    ]
+
+
+def report(module: str, runs: int, top: int) -> dict:
+    fastest = min((import_times(module) for _ in range(runs)), key=lambda times: times[-1][2])
+    by_package: dict[str, int] = defaultdict(int)
+    for name, self_us, _ in fastest:
+        by_package[name.partition(".")[0]] += self_us
+    heaviest = sorted(by_package.items(), key=lambda item: -item[1])[:top]
+    imported = [name for name, _, _ in fastest]
+    return {
+        "total_ms": fastest[-1][2] / 1000,
+        "modules": len(imported),
+        "packages_ms": {package: us / 1000 for package, us in heaviest},
+        "forbidden": sorted(
+            {name for name in imported for prefix in FORBIDDEN.get(module, ()) if name.startswith(prefix)}
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=list(FORBIDDEN))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="packages to list per entry point")
+    parser.add_argument("--budget-ms", type=float, help="fail if an entry point takes longer than this")
+    parser.add_argument("--output", type=Path, help="write the results here as json")
+    args = parser.parse_args()
+
+    results = {module: report(module, args.runs, args.top) for module in args.modules}
+    failed = False
+    for module, stats in results.items():
+        print(f"{module}: {stats['total_ms']:.1f}ms, {stats['modules']} modules")
+        for package, ms in stats["packages_ms"].items():
+            print(f"  {package:<24} {ms:8.1f}ms")
+        if stats["forbidden"]:
+            failed = True
+            print(f"  imports what it mustn't: {', '.join(stats['forbidden'])}")
+        if args.budget_ms is not None and stats["total_ms"] > args.budget_ms:
+            failed = True
+            print(f"  over the {args.budget_ms}ms budget")
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Load generator for the vault API, how many unlock/save cycles a second a deployment sustains.
+
+Run with `uv run benchmarks/loadtest.py` to drive an in-process app (the API router on a temp FileStorage,
+through httpx's ASGI transport, no network needed), or point it at a running server with
+`--url http://127.0.0.1:8000`. Each virtual user picks a vault, unlocks it (GET) and `--write-ratio` of
+the time saves it back (PATCH, If-Match the ETag it loaded). The blobs are real vaults of `--entries`
+sized as given, built with `vault.encrypt_vault` and signed with the vault's secret like the pages do.
+
+`--output results.json` writes the numbers (and what produced them) out, to compare across releases.
+Against a real server the vaults it creates are left behind, named `loadtest-<run>-<n>`.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tomllib
+from collections import Counter
+from datetime import UTC, datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from password_manager.app import api  # noqa: E402
+from password_manager.backend import vault  # noqa: E402
+from password_manager.backend.async_storage import ThreadedStorage, get_async_vault_storage  # noqa: E402
+from password_manager.backend.database import FileStorage  # noqa: E402
+from password_manager.util import crypto  # noqa: E402
+
+# payloads per vault to cycle through, so consecutive saves really do change the blob
+VARIANTS = 4
+
+
+def parse_entries(spec: str) -> list[tuple[int, float]]:
+    """`10:70,100:25,1000:5` -> vaults of 10 entries 70% of the time, 100 entries 25%, ..."""
+    sizes = []
+    for part in spec.split(","):
+        entries, _, weight = part.partition(":")
+        sizes.append((int(entries), float(weight or 1)))
+    return sizes
+
+
+def make_vault(entries: int, rng: random.Random) -> vault.Vault:
+    """A vault that looks like someone's, logins with a username, password and url each"""
+    v = vault.Vault()
+    for i in range(entries):
+        entry = vault.VaultEntry(f"site-{i}.example.com")
+        entry.add_key_value(vault.VaultKeyValue("username", f"user{rng.randrange(10**6)}@example.com"))
+        entry.add_key_value(vault.VaultKeyValue("password", secrets.token_urlsafe(rng.randint(12, 32))))
+        entry.add_key_value(vault.VaultKeyValue("url", f"https://site-{i}.example.com/login"))
+        v.entries.append(entry)
+    return v
+
+
+def encrypted_variants(entries: int, rng: random.Random) -> list[bytes]:
+    """A few encryptions of one vault, each after another edit, not yet signed with any vault's secret"""
+    key = crypto.SimpleUnlockKey()
+    key.seed(secrets.token_bytes(16))
+    v = make_vault(entries, rng)
+    variants = []
+    for _ in range(VARIANTS):
+        if v.entries:
+            rng.choice(v.entries).key_values[1].value = secrets.token_urlsafe(24)
+        variants.append(vault.encrypt_vault(v, key))
+    return variants
+
+
+class Results:
+    """Latencies and status codes per operation, only counted once the warmup is over"""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {"create": [], "unlock": [], "save": []}
+        self.statuses: dict[str, Counter[int]] = {op: Counter() for op in self.latencies}
+        self.cycles = 0
+        self.recording = True
+
+    def record(self, op: str, start: float, status: int) -> None:
+        if self.recording:
+            self.latencies[op].append(time.perf_counter() - start)
+            self.statuses[op][status] += 1
+
+    def cycle(self) -> None:
+        if self.recording:
+            self.cycles += 1
+
+    def summary(self, duration: float) -> dict:
+        ops = {}
+        for op, values in self.latencies.items():
+            ops[op] = {
+                "count": len(values),
+                "statuses": {str(code): n for code, n in sorted(self.statuses[op].items())},
+            }
+            if len(values) > 1:
+                q = statistics.quantiles(values, n=100, method="inclusive")
+                ops[op].update(p50_ms=q[49] * 1000, p95_ms=q[94] * 1000, p99_ms=q[98] * 1000)
+        requests = sum(len(self.latencies[op]) for op in ("unlock", "save"))
+        return {
+            "requests_per_second": requests / duration,
+            "cycles_per_second": self.cycles / duration,
+            "operations": ops,
+        }
+
+
+async def drive(client: httpx.AsyncClient, args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    sizes = parse_entries(args.entries)
+    templates = {entries: encrypted_variants(entries, rng) for entries, _ in sizes}
+    results = Results()
+
+    # setup, through the API like a client registering would
+    run_id = secrets.token_hex(4)
+    vaults: list[tuple[str, list[bytes]]] = []
+    for n in range(args.vaults):
+        vault_id = f"loadtest-{run_id}-{n}"
+        start = time.perf_counter()
+        response = await client.post(f"/api/vaults/{vault_id}")
+        results.record("create", start, response.status_code)
+        response.raise_for_status()
+        secret = response.json()["vault_secret"].encode("utf-8")
+        (entries,) = rng.choices([entries for entries, _ in sizes], weights=[weight for _, weight in sizes])
+        blobs = [crypto.sign_data(encrypted, secret) for encrypted in templates[entries]]
+        response = await client.patch(
+            f"/api/vaults/{vault_id}", content=blobs[0], headers={"If-Match": response.headers["ETag"]}
+        )
+        response.raise_for_status()
+        vaults.append((vault_id, blobs))
+
+    async def user(seed: int, deadline: float) -> None:
+        user_rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            vault_id, blobs = user_rng.choice(vaults)
+            start = time.perf_counter()
+            response = await client.get(f"/api/vaults/{vault_id}")
+            results.record("unlock", start, response.status_code)
+            if response.status_code != 200 or user_rng.random() >= args.write_ratio:
+                if response.status_code == 200:
+                    results.cycle()
+                continue
+            start = time.perf_counter()
+            response = await client.patch(
+                f"/api/vaults/{vault_id}",
+                content=user_rng.choice(blobs),
+                headers={"If-Match": response.headers["ETag"]},
+            )
+            results.record("save", start, response.status_code)
+            # a 412 is someone else having saved first, still a cycle the server got through
+            if response.status_code in (200, 412):
+                results.cycle()
+
+    results.recording = False
+    began = time.perf_counter()
+    deadline = began + args.warmup + args.duration
+    users = [asyncio.create_task(user(rng.randrange(2**32), deadline)) for _ in range(args.concurrency)]
+    await asyncio.sleep(args.warmup)
+    results.recording = True
+    measured_from = time.perf_counter()
+    await asyncio.gather(*users)
+    return results.summary(time.perf_counter() - measured_from)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+            return await drive(client, args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = ThreadedStorage(FileStorage(tmp))
+        app = FastAPI()
+        app.include_router(api.router)
+        app.dependency_overrides[get_async_vault_storage] = lambda: storage
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+                return await drive(client, args)
+        finally:
+            storage.close()
+
+
+def describe_build() -> dict:
+    """What was measured, so results from different releases can be told apart"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "version": tomllib.loads((ROOT / "pyproject.toml").read_text())["project"]["version"],
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="a running server, instead of the in-process app")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--vaults", type=int, default=32, help="vaults the users share between them")
+    parser.add_argument("--entries", default="10:70,100:25,1000:5", help="vault sizes, entries:weight,...")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="how many unlocks are followed by a save")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds run before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the results here as json")
+    args = parser.parse_args()
+
+    started_at = datetime.now(UTC).isoformat()
+    summary = asyncio.run(run(args))
+    print(f"target {args.url or 'in-process'}, {args.concurrency} users on {args.vaults} vaults")
+    print(f"  cycles/s   {summary['cycles_per_second']:8.1f}")
+    print(f"  requests/s {summary['requests_per_second']:8.1f}")
+    for op, stats in summary["operations"].items():
+        if stats["count"] > 1:
+            print(
+                f"  {op:<7} p50 {stats['p50_ms']:7.2f}ms  p95 {stats['p95_ms']:7.2f}ms  p99 {stats['p99_ms']:7.2f}ms"
+                f"  ({stats['count']} requests, statuses {stats['statuses']})"
+            )
+    if args.output:
+        settings = {name: str(value) if isinstance(value, Path) else value for name, value in vars(args).items()}
+        report = {
+            "started_at": started_at,
+            "build": describe_build(),
+            "settings": settings,
+            **summary,
+        }
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
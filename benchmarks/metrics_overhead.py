@@ -0,0 +1,137 @@
+"""What the /api/metrics instrumentation costs on the hot path.
+
+Run with `uv run benchmarks/metrics_overhead.py`. Times a bare Counter.inc and Histogram.observe, then
+what InstrumentedStorage adds to a call (measured around a storage that does nothing, disk noise would
+swamp it otherwise) next to what that call costs on a FileStorage, and the same for encrypt/decrypt.
+The fastest of `--repeats` runs counts, the rest is scheduler noise. It exits non-zero if instrumenting
+any storage call makes it more than `--budget` percent slower.
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from password_manager.backend.database import (  # noqa: E402
+    FileStorage,
+    ServerSideVault,
+    VaultStorage,
+    VaultValidator,
+)
+from password_manager.backend.instrumented import InstrumentedStorage  # noqa: E402
+from password_manager.util import crypto  # noqa: E402
+from password_manager.util.metrics import Counter, Histogram  # noqa: E402
+
+
+def per_call_us(ops: int, repeats: int, op: Callable[[], object]) -> float:
+    """Microseconds a call of `op` takes, best of `repeats` runs of `ops` calls"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(ops):
+            op()
+        best = min(best, time.perf_counter() - start)
+    return best / ops * 1e6
+
+
+class NoStorage(VaultStorage):
+    """Answers instantly, so timing InstrumentedStorage around it leaves just what the instrumentation adds"""
+
+    def __init__(self, vault: ServerSideVault):
+        self._vault = vault
+        self._validator = VaultValidator.of(vault)
+
+    def read(self, vault_id: str) -> ServerSideVault:
+        return self._vault
+
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        return 1
+
+    def create(self, vault_id: str) -> ServerSideVault:
+        return self._vault
+
+    def exists(self, vault_id: str) -> bool:
+        return True
+
+    def delete(self, vault_id: str) -> None:
+        pass
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        return self._validator
+
+
+def storage_ops(
+    storage: VaultStorage, vault_ids: list[str], signed: dict[str, bytes]
+) -> dict[str, Callable[[], object]]:
+    rng = random.Random(0)
+    return {
+        "exists": lambda: storage.exists(rng.choice(vault_ids)),
+        "validator": lambda: storage.validator(rng.choice(vault_ids)),
+        "read": lambda: storage.read(rng.choice(vault_ids)),
+        "write": lambda: storage.write(vault_id := rng.choice(vault_ids), signed[vault_id]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2_000, help="calls timed per run")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--vaults", type=int, default=100)
+    parser.add_argument("--payload", type=int, default=4096, help="vault size in bytes")
+    parser.add_argument("--budget", type=float, default=5.0, help="most percent a storage call may get slower by")
+    args = parser.parse_args()
+
+    counter, histogram = Counter("benchmark_counter"), Histogram("benchmark_histogram")
+    print(f"{'Counter.inc':<24}{per_call_us(args.ops * 50, args.repeats, counter.inc):10.3f}us")
+    print(
+        f"{'Histogram.observe':<24}{per_call_us(args.ops * 50, args.repeats, lambda: histogram.observe(0.003)):10.3f}us"
+    )
+
+    failed = False
+    payload = random.randbytes(args.payload)
+    print(f"\n{'call':<24}{'file storage':>14}{'added':>10}{'slower':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # no fsync, so the calls are as quick as they get and the overhead as large a part of them as it gets
+        storage = FileStorage(tmp, durability="none", history=0)
+        signed = {}
+        for i in range(args.vaults):
+            secret = storage.create(f"vault-{i}").vault_secret.encode("utf-8")
+            signed[f"vault-{i}"] = crypto.sign_data(payload, secret)
+            storage.write(f"vault-{i}", signed[f"vault-{i}"])
+        vault_ids = list(signed)
+        nothing = NoStorage(storage.read(vault_ids[0]))
+        real = storage_ops(storage, vault_ids, signed)
+        bare = storage_ops(nothing, vault_ids, signed)
+        measured = storage_ops(InstrumentedStorage(nothing), vault_ids, signed)
+        for name in real:
+            cost = per_call_us(args.ops, args.repeats, real[name])
+            added = per_call_us(args.ops * 10, args.repeats, measured[name]) - per_call_us(
+                args.ops * 10, args.repeats, bare[name]
+            )
+            over = added / cost * 100 > args.budget
+            failed |= over
+            print(
+                f"{'storage.' + name:<24}{cost:12.2f}us{added:8.2f}us{added / cost * 100:8.1f}%"
+                f"{'  over budget' if over else ''}"
+            )
+
+    key = crypto.SimpleUnlockKey()
+    key.seed(b"benchmark")
+    encrypted = crypto.encrypt_data(payload, key)
+    for name, fn, arg in (
+        ("encrypt_data", crypto.encrypt_data, payload),
+        ("decrypt_data", crypto.decrypt_data, encrypted),
+    ):
+        before = per_call_us(args.ops, args.repeats, lambda fn=fn, arg=arg: fn.__wrapped__(arg, key))
+        after = per_call_us(args.ops, args.repeats, lambda fn=fn, arg=arg: fn(arg, key))
+        print(f"{'crypto.' + name:<24}{before:12.2f}us{after - before:8.2f}us{(after - before) / before * 100:8.1f}%")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
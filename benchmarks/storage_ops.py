@@ -0,0 +1,96 @@
+"""Compare ops/sec of the VaultStorage backends at different vault counts.
+
+Run with `uv run benchmarks/storage_ops.py` (add `--sizes 1000` for a quick go). Each backend is
+populated with N vaults in a temp dir, then we time random exists/read/write calls against it.
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from password_manager.backend.database import FileStorage, VaultStorage  # noqa: E402
+from password_manager.backend.fake_object_server import FakeObjectServer  # noqa: E402
+from password_manager.backend.logstore import LogStorage  # noqa: E402
+from password_manager.backend.objectstore import ObjectStorage  # noqa: E402
+from password_manager.backend.sqlite import SqliteStorage  # noqa: E402
+from password_manager.util.crypto import sign_data  # noqa: E402
+
+_object_server = None
+
+
+def object_storage(tmp: str) -> VaultStorage:
+    """ObjectStorage against the in-process fake, one bucket per run"""
+    global _object_server  # noqa: PLW0603
+    if _object_server is None:
+        _object_server = FakeObjectServer().start()
+    return ObjectStorage(_object_server.url, bucket=Path(tmp).name)
+
+
+BACKENDS: dict[str, Callable[[str], VaultStorage]] = {
+    "file": FileStorage,
+    "sqlite": SqliteStorage,
+    "log": LogStorage,
+    "object": object_storage,
+}
+
+
+def populate(storage: VaultStorage, count: int, payload: bytes) -> dict[str, bytes]:
+    """Create `count` vaults, returning the signed payload to write back to each"""
+    signed = {}
+    for i in range(count):
+        vault_id = f"vault-{i}"
+        secret = storage.create(vault_id).vault_secret.encode("utf-8")
+        signed[vault_id] = sign_data(payload, secret)
+        storage.write(vault_id, signed[vault_id])
+    return signed
+
+
+def time_ops(ops: int, op: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    for _ in range(ops):
+        op()
+    elapsed = time.perf_counter() - start
+    return ops / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--ops", type=int, default=5_000, help="operations timed per op type")
+    parser.add_argument("--payload", type=int, default=4096, help="vault size in bytes")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    args = parser.parse_args()
+
+    payload = random.randbytes(args.payload)
+    print(f"{'backend':<10}{'vaults':>10}{'populate/s':>14}{'exists/s':>12}{'read/s':>12}{'write/s':>12}")
+    for size in args.sizes:
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as tmp:
+                storage = BACKENDS[backend](tmp)
+                start = time.perf_counter()
+                signed = populate(storage, size, payload)
+                populate_rate = size / (time.perf_counter() - start)
+                ids = list(signed)
+
+                exists = time_ops(args.ops, lambda: storage.exists(random.choice(ids)))
+                read = time_ops(args.ops, lambda: storage.read(random.choice(ids)))
+
+                def write() -> None:
+                    vault_id = random.choice(ids)
+                    storage.write(vault_id, signed[vault_id])
+
+                write_rate = time_ops(args.ops, write)
+                print(f"{backend:<10}{size:>10}{populate_rate:>14.0f}{exists:>12.0f}{read:>12.0f}{write_rate:>12.0f}")
+                close = getattr(storage, "close", None)
+                if close:
+                    close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""Just the REST API, for storage nodes that serve no pages. Never imports NiceGUI or the components."""
+
+import logging
+from fastapi import FastAPI
+
+from password_manager.app import api, server
+
+logging.basicConfig(level=logging.INFO)
+
+fastapi_app = FastAPI()
+fastapi_app.include_router(api.router)
+
+if __name__ == "__main__":
+    server.main(app="api_main:fastapi_app")
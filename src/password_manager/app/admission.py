@@ -0,0 +1,134 @@
+import contextlib
+import functools
+import math
+import time
+from collections import OrderedDict
+from collections.abc import Generator, Iterator
+
+from password_manager.util import config
+from password_manager.util.exceptions import RequestRejectedError
+from password_manager.util.metrics import Counter, Gauge
+
+
+class RateLimiter:
+    """Token buckets per key: `rate` requests a second on average, bursts of up to `burst`.
+
+    Buckets are kept for the `max_keys` most recently seen keys. Forgetting one only hands its key a
+    fresh full bucket, so a flood of new keys can't grow this without bound.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # key -> (tokens, when)
+
+    def acquire(self, key: str) -> float:
+        """Take a token for `key`, returning 0 if there was one or else the seconds until there will be"""
+        now = time.monotonic()
+        tokens, when = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - when) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def refund(self, key: str) -> None:
+        """Give back the token `acquire` just took, for a request that got turned away after all"""
+        if key in self._buckets:
+            tokens, when = self._buckets[key]
+            self._buckets[key] = (min(self.burst, tokens + 1), when)
+
+
+class AdmissionControl:
+    """Decides whether a request gets to go anywhere near storage, so one hot vault can't starve the rest.
+
+    In order, a request is turned away if
+    - its vault already has `vault_queue` requests in flight, which would only queue on the vault's lock (429),
+    - there are `max_in_flight` requests in flight overall (503),
+    - its client or its vault is over their rate limit (429).
+    Rate limit tokens are only spent on requests that get through, so a client retrying against a busy
+    vault doesn't drain its own bucket. A limit of 0 turns that check off. Use from a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 512,
+        vault_queue: int = 32,
+        vault_rate: float = 0,
+        vault_burst: float = 0,
+        client_rate: float = 0,
+        client_burst: float = 0,
+    ):
+        self.max_in_flight = max_in_flight
+        self.vault_queue = vault_queue
+        self._vault_rates = RateLimiter(vault_rate, vault_burst or 2 * vault_rate) if vault_rate > 0 else None
+        self._client_rates = RateLimiter(client_rate, client_burst or 2 * client_rate) if client_rate > 0 else None
+        self._per_vault: dict[str, int] = {}
+        self.in_flight = Gauge("admission_in_flight", "requests admitted and not yet finished")
+        self.admitted = Counter("admission_admitted", "requests let through")
+        self.rejected = {
+            reason: Counter("admission_rejected", "requests turned away", labels={"reason": reason})
+            for reason in ("client_rate", "vault_rate", "vault_queue", "overloaded")
+        }
+
+    @contextlib.contextmanager
+    def admit(self, vault_id: str | None, client: str) -> Iterator[None]:
+        """Hold a slot for the duration of the block, or raise RequestRejectedError"""
+        queued = self._per_vault.get(vault_id, 0) if vault_id is not None else 0
+        if vault_id is not None and self.vault_queue and queued >= self.vault_queue:
+            self._reject("vault_queue", "Too many requests in flight for this vault", 1)
+        if self.max_in_flight and self.in_flight.value >= self.max_in_flight:
+            self._reject("overloaded", "Server is overloaded", 1, overloaded=True)
+        if self._client_rates and (wait := self._client_rates.acquire(client)):
+            self._reject("client_rate", "Too many requests from this client", wait)
+        if vault_id is not None and self._vault_rates and (wait := self._vault_rates.acquire(vault_id)):
+            if self._client_rates:
+                self._client_rates.refund(client)
+            self._reject("vault_rate", "Too many requests for this vault", wait)
+
+        self.admitted.inc()
+        self.in_flight.inc()
+        if vault_id is not None:
+            self._per_vault[vault_id] = queued + 1
+        try:
+            yield
+        finally:
+            self.in_flight.dec()
+            if vault_id is not None:
+                remaining = self._per_vault.pop(vault_id) - 1
+                if remaining:
+                    self._per_vault[vault_id] = remaining
+
+    def _reject(self, reason: str, message: str, retry_after: float, overloaded: bool = False) -> None:
+        self.rejected[reason].inc()
+        raise RequestRejectedError(message, retry_after=math.ceil(retry_after), overloaded=overloaded)
+
+
+@functools.cache
+def _admission_for(
+    max_in_flight: int,
+    vault_queue: int,
+    vault_rate: float,
+    vault_burst: float,
+    client_rate: float,
+    client_burst: float,
+) -> AdmissionControl:
+    return AdmissionControl(max_in_flight, vault_queue, vault_rate, vault_burst, client_rate, client_burst)
+
+
+def get_admission() -> Generator[AdmissionControl]:
+    """Admission control for the API, configured with `PASSWORD_JAM_ADMISSION_*` and `PASSWORD_JAM_RATE_LIMIT_*`"""
+    yield _admission_for(
+        config.get_int("ADMISSION_MAX_IN_FLIGHT", 512),
+        config.get_int("ADMISSION_VAULT_QUEUE", 32),
+        config.get_float("RATE_LIMIT_VAULT", 0),
+        config.get_float("RATE_LIMIT_VAULT_BURST", 0),
+        config.get_float("RATE_LIMIT_CLIENT", 0),
+        config.get_float("RATE_LIMIT_CLIENT_BURST", 0),
+    )
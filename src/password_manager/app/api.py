@@ -1,48 +1,624 @@
+import asyncio
+import base64
+import json
 import logging
-from fastapi import APIRouter, Depends, Request, Response, status, HTTPException
-from pydantic import BaseModel
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from email.utils import formatdate
 
-from password_manager.backend.database import ServerSideVault, get_vault_storage
-from password_manager.util.exceptions import VaultReadError, VaultSaveError, VaultValidationError
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, status, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+from password_manager.app.admission import AdmissionControl, get_admission
+from password_manager.backend.async_storage import AsyncVaultStorage, get_async_vault_storage
+from password_manager.backend.database import ServerSideVault, VaultRevision, VaultValidator
+from password_manager.backend.events import VaultEvent
+from password_manager.backend.metadata_index import VaultPage
+from password_manager.backend.uploads import UploadSession, UploadSessions, UploadStatus, get_upload_sessions
+from password_manager.util import config
+from password_manager.util.delta import DELTA_MEDIA_TYPE, apply_delta
+from password_manager.util.exceptions import (
+    InvalidVaultIdError,
+    RequestRejectedError,
+    UploadLimitError,
+    UploadOffsetError,
+    VaultConflictError,
+    VaultDeltaError,
+    VaultExistsError,
+    VaultReadError,
+    VaultSaveError,
+    VaultTooLargeError,
+    VaultValidationError,
+)
+from password_manager.util.metrics import REGISTRY
 
 router = APIRouter(prefix="/api")
 logger = logging.getLogger()
 
+DEFAULT_MAX_VAULT_BYTES = 64 * 1024 * 1024
+DEFAULT_EVENTS_HEARTBEAT = 15.0
+DEFAULT_EVENTS_MAX_SUBSCRIBERS = 10_000
+OPENMETRICS_MEDIA_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
 # after some understanding of how nicegui works, none of this is useful, but there's no real reason to remove it
 # to that point, nicegui is the wrong tool for a password manager :)
 
 
+def _etag(validator: VaultValidator) -> str:
+    """Strong etag: the version, plus some of the blob's hmac so a deleted and recreated vault never matches"""
+    return f'"{validator.version}-{validator.signature[:16].hex()}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match style (weak) comparison against a list of etags"""
+    return any(tag.strip().removeprefix("W/") in (etag, "*") for tag in header.split(","))
+
+
+def _expected_version(if_match: str | None) -> int | None:
+    """The version a save is conditional on, None for `If-Match: *`"""
+    if if_match is None:
+        raise HTTPException(
+            status_code=status.HTTP_428_PRECONDITION_REQUIRED,
+            detail="Send the ETag you loaded the vault at as If-Match",
+        )
+    if if_match.strip() == "*":
+        return None
+    try:
+        # weak etags (W/"..") don't parse, and never match for If-Match anyway
+        return int(if_match.strip().strip('"').partition("-")[0])
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED) from e
+
+
+def _byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """[start, end) for a single `bytes=a-b`, `bytes=a-` or `bytes=-n` range, None if it can't be satisfied"""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start, end = int(first), min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start < 0 or start >= end:
+        return None
+    return start, end
+
+
+async def _admit(request: Request, admission: AdmissionControl = Depends(get_admission)) -> AsyncIterator[None]:
+    """Admission control for a request, see `AdmissionControl`"""
+    client = request.client.host if request.client else "unknown"
+    try:
+        with admission.admit(request.path_params.get("vault_id"), client):
+            yield
+    except RequestRejectedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE if e.overloaded else status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        ) from e
+
+
+async def _valid_vault_id() -> AsyncIterator[None]:
+    """A vault id the backend can't store a vault under is the client's mistake, not ours"""
+    try:
+        yield
+    except InvalidVaultIdError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+
+# for everything that touches storage, health checks and the long lived event streams don't queue behind it
+ADMITTED = [Depends(_admit), Depends(_valid_vault_id)]
+
+
 @router.get("/health")
 async def get_health() -> dict[str, str]:
     return {"status": "ok"}
 
 
-@router.get("/vaults/{vault_id}", status_code=status.HTTP_200_OK)
-async def load_vault(vault_id: str, storage: get_vault_storage = Depends()) -> Response:
+@router.get("/metrics")
+async def get_metrics() -> Response:
+    """This worker's metrics, in the OpenMetrics text format for prometheus to scrape.
+
+    Not admission controlled, an overloaded server is exactly when someone wants to look at these.
+    """
+    return Response(content=REGISTRY.exposition(), media_type=OPENMETRICS_MEDIA_TYPE)
+
+
+@router.get("/vaults", status_code=status.HTTP_200_OK, dependencies=ADMITTED)
+async def list_vaults(
+    cursor: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    updated_since: float | None = None,
+    storage: AsyncVaultStorage = Depends(get_async_vault_storage),
+) -> VaultPage:
+    """Vault metadata in id order, a page at a time. Pass `next_cursor` back as `cursor` for the next page,
+    and `updated_since` (unix seconds) to only see vaults written since then"""
+    try:
+        return await storage.alist_vaults(cursor, limit, updated_since)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+    except NotImplementedError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Backend can't list vaults") from e
+
+
+@router.get("/vaults/{vault_id}", status_code=status.HTTP_200_OK, dependencies=ADMITTED)
+async def load_vault(
+    vault_id: str,
+    if_none_match: str | None = Header(default=None),
+    range_: str | None = Header(default=None, alias="Range"),
+    if_range: str | None = Header(default=None),
+    storage: AsyncVaultStorage = Depends(get_async_vault_storage),
+) -> Response:
+    """The vault blob, streamed in chunks. Clients that send the ETag they have get a 304 without us reading
+    the blob, and a single `Range` is honoured so an interrupted download can resume"""
     try:
-        server_vault: ServerSideVault = storage.read(vault_id)
-        return Response(content=server_vault.vault_data, media_type="binary/octet")
+        if if_none_match is not None:
+            etag = _etag(await storage.avalidator(vault_id))
+            if _etag_matches(if_none_match, etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        stream = await storage.aopen_stream(vault_id)
     except VaultReadError as e:
         logger.error("Failed to read vault: {%s}", e)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
 
+    etag = _etag(stream.validator)
+    headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+    start, end = 0, stream.size
+    # a resume against a vault that has changed since gets the whole new blob instead
+    if range_ is not None and (if_range is None or if_range.strip() == etag):
+        byte_range = _byte_range(range_, stream.size)
+        if byte_range is None:
+            stream.close()
+            return Response(
+                status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{stream.size}"},
+            )
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{stream.size}"
+    headers["Content-Length"] = str(end - start)
+
+    def body() -> Iterator[bytes]:
+        try:
+            yield from stream.iter_range(start, end)
+        finally:
+            stream.close()
 
-@router.patch("/vaults/{vault_id}", status_code=status.HTTP_200_OK)
-async def save_vault(request: Request, vault_id: str, storage: get_vault_storage = Depends()) -> None:
+    return StreamingResponse(
+        body(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if "Content-Range" in headers else status.HTTP_200_OK,
+        media_type="binary/octet",
+        headers=headers,
+    )
+
+
+def _sse(event: VaultEvent) -> str:
+    """One server-sent event, with the ETag as its id so a reconnecting client's Last-Event-ID says what it has"""
+    if event.validator is None:
+        return f"event: delete\ndata: {json.dumps({'vault_id': event.vault_id})}\n\n"
+    etag = _etag(event.validator)
+    data = json.dumps({"vault_id": event.vault_id, "version": event.validator.version, "etag": etag})
+    return f"id: {etag}\nevent: write\ndata: {data}\n\n"
+
+
+async def _vault_changes(
+    storage: AsyncVaultStorage, vault_id: str, last_event_id: str | None, heartbeat: float
+) -> AsyncIterator[str]:
+    """Server-sent events for the vault: where it's at now, unless that's Last-Event-ID, then every change.
+
+    Quiet stretches get a comment line every `heartbeat` seconds so proxies keep the connection open. Each
+    heartbeat also checks the vault itself, which catches changes made by other processes. That check is
+    shared by all of the vault's listeners, so it's one storage call per watched vault per heartbeat.
+    """
+
+    async def check() -> VaultValidator | None:
+        try:
+            return await storage.avalidator(vault_id)
+        except VaultReadError:
+            return None
+
+    with storage.events.subscribe(vault_id) as subscription:
+        # only looked at once subscribed, so no change can slip in between
+        current = await check()
+        if current is None or last_event_id != _etag(current):
+            yield _sse(VaultEvent(vault_id, current))
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), heartbeat)
+            except TimeoutError:
+                event = VaultEvent(vault_id, await storage.events.poll(vault_id, check, heartbeat))
+                if event.validator == current:
+                    yield ": ping\n\n"
+                    continue
+            if event.validator != current:
+                current = event.validator
+                yield _sse(event)
+
+
+@router.get("/vaults/{vault_id}/events", status_code=status.HTTP_200_OK, dependencies=[Depends(_valid_vault_id)])
+async def vault_events(
+    vault_id: str,
+    last_event_id: str | None = Header(default=None),
+    storage: AsyncVaultStorage = Depends(get_async_vault_storage),
+) -> StreamingResponse:
+    """Server-sent events with the vault's new version and ETag whenever it changes, so open clients don't
+    have to poll. See `_vault_changes` for what's sent when"""
+    if storage.events.subscribers >= config.get_int("EVENTS_MAX_SUBSCRIBERS", DEFAULT_EVENTS_MAX_SUBSCRIBERS):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many listeners", headers={"Retry-After": "30"}
+        )
+    if not await storage.aexists(vault_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return StreamingResponse(
+        _vault_changes(
+            storage, vault_id, last_event_id, config.get_float("EVENTS_HEARTBEAT", DEFAULT_EVENTS_HEARTBEAT)
+        ),
+        media_type="text/event-stream",
+        # nginx and friends would otherwise sit on events until their buffer fills
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/vaults/{vault_id}/revisions", status_code=status.HTTP_200_OK, dependencies=ADMITTED)
+async def list_revisions(
+    vault_id: str, storage: AsyncVaultStorage = Depends(get_async_vault_storage)
+) -> list[VaultRevision]:
+    """Kept revisions of the vault, oldest first. Restoring one is just PATCHing its blob back"""
+    try:
+        return await storage.arevisions(vault_id)
+    except VaultReadError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
+    except NotImplementedError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Backend keeps no history") from e
+
+
+@router.get("/vaults/{vault_id}/revisions/{revision}", status_code=status.HTTP_200_OK, dependencies=ADMITTED)
+async def load_revision(
+    vault_id: str, revision: int, storage: AsyncVaultStorage = Depends(get_async_vault_storage)
+) -> Response:
     try:
+        return Response(content=await storage.aread_revision(vault_id, revision), media_type="binary/octet")
+    except VaultReadError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
+    except NotImplementedError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Backend keeps no history") from e
+
+
+async def _save_stream(
+    storage: AsyncVaultStorage,
+    vault_id: str,
+    chunks: AsyncIterator[bytes],
+    expected_version: int | None,
+    max_size: int,
+) -> str:
+    """Feed a blob into storage as it arrives, it only replaces the stored vault once it's all been checked.
+    Returns the new ETag"""
+    upload = await storage.aopen_upload(vault_id, max_size)
+    try:
+        async for chunk in chunks:
+            if chunk:
+                await storage.afeed_upload(upload, chunk)
         # should throw if signature is invalid
-        storage.write(vault_id, await request.body())
+        version = await storage.asave_upload(upload, expected_version)
+    finally:
+        upload.close()
+    return _etag(VaultValidator(version, upload.signature))
+
+
+def _save_error(e: Exception) -> HTTPException:
+    """The response for a save that failed with one of our vault exceptions"""
+    if isinstance(e, VaultTooLargeError):
+        return HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(e))
+    if isinstance(e, VaultConflictError):
+        return HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=str(e))
+    if isinstance(e, VaultReadError):
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if isinstance(e, VaultValidationError):
+        return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    logger.error("Failed to write vault: {%s}", e)
+    return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _max_vault_bytes() -> int:
+    return config.get_int("MAX_VAULT_BYTES", DEFAULT_MAX_VAULT_BYTES)
+
+
+@router.patch("/vaults/{vault_id}", status_code=status.HTTP_200_OK, dependencies=ADMITTED)
+async def save_vault(
+    request: Request,
+    response: Response,
+    vault_id: str,
+    if_match: str | None = Header(default=None),
+    content_length: int | None = Header(default=None),
+    content_type: str | None = Header(default=None),
+    storage: AsyncVaultStorage = Depends(get_async_vault_storage),
+) -> None:
+    """Save the vault, only if it's still at the version in If-Match (or unconditionally with `*`)
+
+    The body is streamed into storage and signature checked as it arrives. With a `DELTA_MEDIA_TYPE`
+    body it's a delta against the version in If-Match instead, see `util/delta.py`.
+    """
+    expected_version = _expected_version(if_match)
+    max_size = _max_vault_bytes()
+    try:
+        if content_length is not None and content_length > max_size:
+            raise VaultTooLargeError(f"Vault is over the {max_size} byte limit")
+        if content_type is not None and content_type.partition(";")[0].strip() == DELTA_MEDIA_TYPE:
+            chunks = _apply_delta(request, storage, vault_id, if_match, max_size)
+        else:
+            chunks = request.stream()
+        response.headers["ETag"] = await _save_stream(storage, vault_id, chunks, expected_version, max_size)
+    except VaultDeltaError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+    except (VaultTooLargeError, VaultConflictError, VaultReadError, VaultValidationError, VaultSaveError) as e:
+        raise _save_error(e) from e
+
+
+async def _apply_delta(
+    request: Request, storage: AsyncVaultStorage, vault_id: str, if_match: str | None, max_size: int
+) -> AsyncIterator[bytes]:
+    """The new blob a delta body makes out of the stored vault, which has to be exactly the one in If-Match.
+
+    The delta itself is read in whole (it's small unless most of the vault changed), the base it copies
+    from is streamed.
+    """
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_size:
+            raise VaultTooLargeError(f"Delta is over the {max_size} byte limit")
+    base = await storage.aopen_stream(vault_id)
+    try:
+        # the whole etag, not just the version, a recreated vault at the same version is a different base
+        if if_match is None or if_match.strip() != _etag(base.validator):
+            raise VaultConflictError("Deltas have to be against the current version of the vault")
+        async for chunk in iterate_in_threadpool(apply_delta(bytes(body), base.size, base.iter_range)):
+            yield chunk
+    finally:
+        base.close()
+
+
+# Batch endpoints, for provisioning and audit jobs that would otherwise make thousands of requests.
+# Answers stream back as one JSON line per id, in order, each with its own status.
+
+MAX_BATCH_IDS = 10_000
+# ids handed to storage at a time, which bounds how many vault blobs a batchGet holds at once
+BATCH_SLICE = 100
+
+
+class VaultBatch(BaseModel):
+    vault_ids: list[str] = Field(max_length=MAX_BATCH_IDS)
+
+
+class BatchItem(BaseModel):
+    vault_id: str
+    status: int
+    exists: bool | None = None
+    vault_data: str | None = None  # base64
+    vault_secret: str | None = None
+    etag: str | None = None
+    error: str | None = None
+
+
+def _batch_error(vault_id: str, e: Exception) -> BatchItem:
+    if isinstance(e, VaultReadError):
+        code = status.HTTP_404_NOT_FOUND
+    elif isinstance(e, VaultSaveError):
+        code = status.HTTP_409_CONFLICT
+    elif isinstance(e, ValueError):
+        code = status.HTTP_400_BAD_REQUEST
+    else:
+        code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    return BatchItem(vault_id=vault_id, status=code, error=str(e))
+
+
+def _batch_response[T](
+    vault_ids: list[str],
+    run: Callable[[list[str]], Awaitable[list[tuple[str, T | Exception]]]],
+    item: Callable[[str, T], BatchItem],
+) -> StreamingResponse:
+    async def lines() -> AsyncIterator[str]:
+        for start in range(0, len(vault_ids), BATCH_SLICE):
+            for vault_id, result in await run(vault_ids[start : start + BATCH_SLICE]):
+                line = _batch_error(vault_id, result) if isinstance(result, Exception) else item(vault_id, result)
+                yield line.model_dump_json(exclude_none=True) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/vaults:batchExists", dependencies=ADMITTED)
+async def batch_exists(
+    batch: VaultBatch, storage: AsyncVaultStorage = Depends(get_async_vault_storage)
+) -> StreamingResponse:
+    return _batch_response(
+        batch.vault_ids,
+        storage.aexists_many,
+        lambda vault_id, exists: BatchItem(vault_id=vault_id, status=status.HTTP_200_OK, exists=exists),
+    )
+
+
+@router.post("/vaults:batchGet", dependencies=ADMITTED)
+async def batch_get(
+    batch: VaultBatch, storage: AsyncVaultStorage = Depends(get_async_vault_storage)
+) -> StreamingResponse:
+    """Blobs come back base64 encoded, with the ETag a GET would have given"""
+    return _batch_response(
+        batch.vault_ids,
+        storage.aread_many,
+        lambda vault_id, vault: BatchItem(
+            vault_id=vault_id,
+            status=status.HTTP_200_OK,
+            vault_data=base64.b64encode(vault.vault_data).decode("ascii"),
+            etag=_etag(VaultValidator.of(vault)),
+        ),
+    )
+
+
+@router.post("/vaults:batchCreate", dependencies=ADMITTED)
+async def batch_create(
+    batch: VaultBatch, storage: AsyncVaultStorage = Depends(get_async_vault_storage)
+) -> StreamingResponse:
+    """Ids that already exist come back as 409s, the rest are created"""
+    return _batch_response(
+        batch.vault_ids,
+        storage.acreate_many,
+        lambda vault_id, vault: BatchItem(
+            vault_id=vault_id,
+            status=status.HTTP_201_CREATED,
+            vault_secret=vault.vault_secret,
+            etag=_etag(VaultValidator.of_created(vault)),
+        ),
+    )
+
+
+# Resumable uploads, for big vaults over flaky links, along the lines of tus (https://tus.io):
+# POST .../uploads to start one, PUT chunks at their Upload-Offset, HEAD to find out where to resume
+# from after a drop, then POST .../finalize to save it like a PATCH would have.
+
+
+def _upload_headers(upload: UploadStatus) -> dict[str, str]:
+    return {
+        "Upload-Offset": str(upload.offset),
+        "Upload-Length": str(upload.session.length),
+        "Upload-Expires": formatdate(upload.expires_at, usegmt=True),
+        "Cache-Control": "no-store",
+    }
+
+
+@router.post("/vaults/{vault_id}/uploads", status_code=status.HTTP_201_CREATED, dependencies=ADMITTED)
+async def start_upload(
+    request: Request,
+    response: Response,
+    vault_id: str,
+    upload_length: int = Header(),
+    if_match: str | None = Header(default=None),
+    storage: AsyncVaultStorage = Depends(get_async_vault_storage),
+    sessions: UploadSessions = Depends(get_upload_sessions),
+) -> UploadSession:
+    """Start a resumable save of an `Upload-Length` byte blob, conditional on If-Match like a PATCH"""
+    expected_version = _expected_version(if_match)
+    max_size = _max_vault_bytes()
+    if upload_length > max_size:
+        raise _save_error(VaultTooLargeError(f"Vault is over the {max_size} byte limit"))
+    if not await storage.aexists(vault_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    try:
+        session = await run_in_threadpool(sessions.create, vault_id, upload_length, expected_version)
+    except UploadLimitError as e:
+        if e.out_of_space:
+            raise HTTPException(status_code=status.HTTP_507_INSUFFICIENT_STORAGE, detail=str(e)) from e
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e)) from e
+    upload = await run_in_threadpool(sessions.status, vault_id, session.upload_id)
+    response.headers.update(_upload_headers(upload))
+    response.headers["Location"] = str(
+        request.url_for("upload_status", vault_id=vault_id, upload_id=session.upload_id)
+    )
+    return session
+
+
+@router.head("/vaults/{vault_id}/uploads/{upload_id}", dependencies=ADMITTED)
+async def upload_status(
+    vault_id: str, upload_id: str, sessions: UploadSessions = Depends(get_upload_sessions)
+) -> Response:
+    """Where to resume from, in Upload-Offset"""
+    try:
+        upload = await run_in_threadpool(sessions.status, vault_id, upload_id)
+    except VaultReadError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_upload_headers(upload))
+
+
+@router.put("/vaults/{vault_id}/uploads/{upload_id}", dependencies=ADMITTED)
+async def upload_chunk(
+    request: Request,
+    vault_id: str,
+    upload_id: str,
+    upload_offset: int = Header(),
+    sessions: UploadSessions = Depends(get_upload_sessions),
+) -> Response:
+    """Append the body at Upload-Offset, which has to be where the upload is at. Answers with the new offset"""
+    try:
+        upload = await run_in_threadpool(sessions.status, vault_id, upload_id)
+        if upload.offset != upload_offset:
+            raise UploadOffsetError(f"Upload is at offset {upload.offset}, not {upload_offset}")
+        offset = upload_offset
+        try:
+            async for chunk in request.stream():
+                if chunk:
+                    offset = await run_in_threadpool(sessions.append, vault_id, upload_id, offset, chunk)
+        except ClientDisconnect:
+            # what made it is kept, that's the whole point, the client finds out where to resume with a HEAD
+            logger.info("Upload '%s' dropped at offset %d", upload_id, offset)
+        upload = await run_in_threadpool(sessions.status, vault_id, upload_id)
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e)) from e
+    except VaultTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(e)) from e
     except VaultReadError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
-    except VaultValidationError as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED) from e
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_upload_headers(upload))
+
+
+@router.post("/vaults/{vault_id}/uploads/{upload_id}/finalize", status_code=status.HTTP_200_OK, dependencies=ADMITTED)
+async def finalize_upload(
+    response: Response,
+    vault_id: str,
+    upload_id: str,
+    storage: AsyncVaultStorage = Depends(get_async_vault_storage),
+    sessions: UploadSessions = Depends(get_upload_sessions),
+) -> None:
+    """Save a fully uploaded blob, with the same checks a PATCH gets. The session is gone afterwards, unless
+    the save failed on our end and can be retried"""
+    try:
+        upload = await run_in_threadpool(sessions.status, vault_id, upload_id)
+    except VaultReadError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
+    if upload.offset != upload.session.length:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload is at offset {upload.offset} of {upload.session.length}",
+        )
+    try:
+        response.headers["ETag"] = await _save_stream(
+            storage,
+            vault_id,
+            iterate_in_threadpool(sessions.iter_data(vault_id, upload_id)),
+            upload.session.expected_version,
+            upload.session.length,
+        )
     except VaultSaveError as e:
-        logger.error("Failed to write vault: {%s}", e)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR) from e
+        raise _save_error(e) from e
+    except (VaultTooLargeError, VaultConflictError, VaultReadError, VaultValidationError) as e:
+        await run_in_threadpool(sessions.remove, vault_id, upload_id)
+        raise _save_error(e) from e
+    await run_in_threadpool(sessions.remove, vault_id, upload_id)
 
 
-@router.post("/vaults/{vault_id}", status_code=status.HTTP_201_CREATED)
-async def new_vault(vault_id: str, storage: get_vault_storage = Depends()) -> ServerSideVault:
-    if storage.exists(vault_id):
+@router.delete("/vaults/{vault_id}/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=ADMITTED)
+async def cancel_upload(
+    vault_id: str, upload_id: str, sessions: UploadSessions = Depends(get_upload_sessions)
+) -> None:
+    try:
+        await run_in_threadpool(sessions.remove, vault_id, upload_id)
+    except VaultReadError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
+
+
+@router.post("/vaults/{vault_id}", status_code=status.HTTP_201_CREATED, dependencies=ADMITTED)
+async def new_vault(
+    vault_id: str, response: Response, storage: AsyncVaultStorage = Depends(get_async_vault_storage)
+) -> ServerSideVault:
+    if await storage.aexists(vault_id):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Vault already exists")
-    return storage.create(vault_id)
+    try:
+        created = await storage.acreate(vault_id)
+    except VaultExistsError as e:
+        # another create for the same id got in since we looked
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Vault already exists") from e
+    response.headers["ETag"] = _etag(await storage.avalidator(vault_id))
+    return created
@@ -0,0 +1,108 @@
+"""The NiceGUI pages, registered on import."""
+
+import dataclasses
+import functools
+import inspect
+import logging
+import time
+from typing import Any, Callable
+
+import platformdirs
+from nicegui import Client, app, ui
+from nicegui.page_arguments import RouteMatch
+
+from password_manager.backend.async_storage import get_async_vault_storage
+from password_manager.components.pages import (
+    clear_vault_session,
+    create_vault_page,
+    home_page,
+    load_vault_page,
+    unlock_page,
+)
+from password_manager.util.metrics import REGISTRY
+
+logger = logging.getLogger()
+storage = next(get_async_vault_storage())
+
+
+def timed_builder(builder: Callable, route: str) -> Callable:
+    """`builder`, recording how long building the page took in `page_render_seconds`.
+
+    nicegui only schedules an async builder and moves on, so those are timed up to the end of the await.
+    """
+    histogram = REGISTRY.histogram("page_render_seconds", "time spent building a page", route=route)
+
+    if inspect.iscoroutinefunction(builder):
+
+        @functools.wraps(builder)
+        async def timed_async(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await builder(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return timed_async
+
+    @functools.wraps(builder)
+    def timed(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return builder(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return timed
+
+
+class SubPages(ui.sub_pages):
+    def _render_page(self, match: RouteMatch) -> bool:
+        # this if basically says "if we went to "/" and user storage [vault_secret] is None"
+        print(f"going to {match.builder}")
+        print(
+            f"self._is_route_protected(match.builder) {self._is_route_protected(match.builder)} self._is_unlocked() {self._is_unlocked()}"
+        )
+        if self._is_route_protected(match.builder) and not self._is_unlocked():
+            self._reset_match()
+            ui.navigate.to("/load")
+            return True
+        # by pattern rather than path, so there's one series per page however many vaults there are
+        return super()._render_page(dataclasses.replace(match, builder=timed_builder(match.builder, match.pattern)))
+
+    def _is_route_protected(self, handler: Callable) -> bool:
+        return getattr(handler, "_is_protected", False)
+
+    def _has_vault(self) -> bool:
+        return app.storage.user.get("vault_id", None) is not None
+
+    def _is_unlocked(self) -> bool:
+        # edit: accomodate the terrible hack
+        try:
+            with open(
+                platformdirs.user_cache_path(appname="password-jam", appauthor="password-jam") / "passcode",
+                "rb",
+            ) as f:
+                return (
+                    len(f.read(2)) > 0
+                )  # if we read a few chars from the terrible hack, and the password is there, we're unlocked
+        except FileNotFoundError:
+            return False
+
+    # def _is_registering(self) -> bool:
+    #    return app.storage.user.get("is_registering", False) == True
+
+
+@ui.page("/")
+@ui.page("/{_:path}")
+def render(client: Client) -> None:
+    # https://nicegui.io/documentation/sub_pages
+    SubPages(
+        {
+            "/": home_page,
+            "/load": load_vault_page,
+            "/unlock": unlock_page,
+            "/register": create_vault_page,
+            "/logout": clear_vault_session,
+        },
+        data={"storage": storage},
+    )
@@ -0,0 +1,112 @@
+"""Running the app: the dev server with the reloader, or the multi-process production server.
+
+`uv run src/main.py` is the dev server, as always, and `uv run src/api_main.py` the same for just the
+REST API, without NiceGUI. `uv run src/main.py --workers` (one per core) or
+`--workers 4` (or `PASSWORD_JAM_WORKERS=4`) runs the production server: that many worker processes
+sharing the one listening socket, no reloader. `kill -HUP` the parent to restart the workers one at a
+time: each is asked to finish its requests and go, and only once it has gone is its replacement started,
+so every step runs a worker short for up to `PASSWORD_JAM_GRACEFUL_TIMEOUT` plus the new one's startup.
+
+Storage is shared through the backend (FileLocks, sqlite, the object store), so any worker can serve
+any vault. NiceGUI is less obliging: a page's live connection only works with the worker that rendered
+it, and `app.storage.user` is per process unless `NICEGUI_REDIS_URL` is set. For the UI either run one
+worker, or several single worker servers on their own ports behind a proxy with sticky sessions.
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import secrets
+import time
+from pathlib import Path
+
+import platformdirs
+import uvicorn
+
+from password_manager.util import config
+
+logger = logging.getLogger()
+
+# next to the vaults (FileStorage's default dir), so dot-prefixed: the vault API refuses dotfile ids
+DEFAULT_SECRET_PATH = str(
+    Path(platformdirs.user_config_dir(appname="password-jam", appauthor="password-jam")) / ".storage_secret"
+)
+# where it used to be kept, which the vault API served to anyone as a vault called "storage_secret"
+_LEGACY_SECRET_PATH = Path(DEFAULT_SECRET_PATH).with_name("storage_secret")
+
+# backends that keep state in memory that other processes can't see
+SINGLE_PROCESS_BACKENDS = {"log"}
+
+
+def default_workers() -> int:
+    """One per core, the pages' encryption keeps a core busy on its own"""
+    return os.cpu_count() or 1
+
+
+def storage_secret() -> str:
+    """The secret NiceGUI signs its session cookies with, which has to be the same in every worker.
+
+    `PASSWORD_JAM_STORAGE_SECRET` if set, otherwise one made up on first start and kept in
+    `PASSWORD_JAM_STORAGE_SECRET_PATH`, so it also survives restarts.
+    """
+    secret = config.get_str("STORAGE_SECRET", "")
+    if secret:
+        return secret
+    path = Path(config.get_str("STORAGE_SECRET_PATH", DEFAULT_SECRET_PATH)).expanduser()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path == Path(DEFAULT_SECRET_PATH) and not path.exists():
+        # keep the sessions signed with the old one valid, it just moves out of the vault namespace
+        with contextlib.suppress(FileNotFoundError):
+            os.replace(_LEGACY_SECRET_PATH, path)
+    try:
+        # O_EXCL, so when several workers start at once exactly one of them gets to write it
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_urlsafe(32))
+    # whoever lost the race may get here before the winner wrote anything
+    for _ in range(100):
+        if secret := path.read_text().strip():
+            return secret
+        time.sleep(0.01)
+    raise RuntimeError(f"{path} is empty, delete it to have a new secret made")
+
+
+def main(argv: list[str] | None = None, app: str = "main:fastapi_app") -> None:
+    """Serve `app`, an import string like uvicorn takes"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=config.get_str("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=config.get_int("PORT", 8000))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="?",
+        const=default_workers(),
+        default=config.get_int("WORKERS", 0),
+        help="worker processes for the production server, one per core if no number is given. 0 for the dev server",
+    )
+    args = parser.parse_args(argv)
+
+    if args.workers <= 0:
+        uvicorn.run(app, host=args.host, port=args.port, log_level="info", reload=True)
+        return
+
+    backend = config.get_str("STORAGE", "file")
+    if args.workers > 1 and backend in SINGLE_PROCESS_BACKENDS:
+        raise SystemExit(f"The '{backend}' storage backend only works from a single process, run one worker")
+    if args.workers > 1 and app == "main:fastapi_app" and not os.environ.get("NICEGUI_REDIS_URL"):
+        logger.warning("NiceGUI user storage isn't shared between workers, set NICEGUI_REDIS_URL to share it")
+    # decided before the workers start, and handed down through the environment, so they all agree
+    os.environ[config.PREFIX + "STORAGE_SECRET"] = storage_secret()
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level="info",
+        proxy_headers=True,
+        timeout_graceful_shutdown=config.get_int("GRACEFUL_TIMEOUT", 30),
+    )
@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import os
+from collections.abc import Callable, Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Protocol, runtime_checkable
+
+from password_manager.backend.database import (
+    DEFAULT_BASE_PATH,
+    ServerSideVault,
+    VaultRevision,
+    VaultStorage,
+    VaultStream,
+    VaultUpload,
+    VaultValidator,
+    get_vault_storage,
+)
+from password_manager.backend.events import VaultEvents
+from password_manager.backend.metadata_index import VaultPage
+from password_manager.backend.vault_locks import VaultLocks
+from password_manager.util import config
+from password_manager.util.crypto import SIGNATURE_SIZE
+
+
+@runtime_checkable
+class AsyncVaultStorage(Protocol):
+    """The async face of a VaultStorage, what request handlers and pages should talk to.
+
+    Same semantics and exceptions as the sync methods of the same name, minus the `a`. Every change that
+    goes through it is published to `events`.
+    """
+
+    events: VaultEvents
+
+    async def aread(self, vault_id: str) -> ServerSideVault: ...
+
+    async def awrite(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int: ...
+
+    async def acreate(self, vault_id: str) -> ServerSideVault: ...
+
+    async def aexists(self, vault_id: str) -> bool: ...
+
+    async def adelete(self, vault_id: str) -> None: ...
+
+    async def avalidator(self, vault_id: str) -> VaultValidator: ...
+
+    async def aopen_stream(self, vault_id: str) -> VaultStream: ...
+
+    async def aopen_upload(self, vault_id: str, max_size: int) -> VaultUpload: ...
+
+    async def afeed_upload(self, upload: VaultUpload, chunk: bytes) -> None: ...
+
+    async def asave_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int: ...
+
+    async def aexists_many(self, vault_ids: list[str]) -> list[tuple[str, bool | Exception]]: ...
+
+    async def aread_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]: ...
+
+    async def acreate_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]: ...
+
+    async def alist_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage: ...
+
+    async def arevisions(self, vault_id: str) -> list[VaultRevision]: ...
+
+    async def aread_revision(self, vault_id: str, revision: int) -> bytes: ...
+
+
+class ThreadedStorage(AsyncVaultStorage):
+    """Run a sync VaultStorage on a bounded thread pool, so file I/O and FileLock waits stay off the event loop.
+
+    The pool size caps how many storage calls are in flight at once, everything past that queues up
+    without holding a thread. Calls that change a vault also queue per vault on `locks` first, so only
+    one of them at a time is parked in a thread polling the vault's FileLock.
+    """
+
+    def __init__(self, storage: VaultStorage, max_workers: int | None = None):
+        self.sync = storage
+        self.locks = VaultLocks()
+        self.events = VaultEvents()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or min(32, (os.cpu_count() or 1) + 4), thread_name_prefix="vault-storage"
+        )
+
+    async def aread(self, vault_id: str) -> ServerSideVault:
+        return await self._run(self.sync.read, vault_id)
+
+    async def awrite(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        async with self.locks.hold(vault_id):
+            version = await self._run(self.sync.write, vault_id, data, expected_version)
+        self.events.publish(vault_id, VaultValidator(version, data[:SIGNATURE_SIZE]))
+        return version
+
+    async def acreate(self, vault_id: str) -> ServerSideVault:
+        async with self.locks.hold(vault_id):
+            created = await self._run(self.sync.create, vault_id)
+        self.events.publish(vault_id, VaultValidator.of_created(created))
+        return created
+
+    async def aexists(self, vault_id: str) -> bool:
+        return await self._run(self.sync.exists, vault_id)
+
+    async def adelete(self, vault_id: str) -> None:
+        async with self.locks.hold(vault_id):
+            await self._run(self.sync.delete, vault_id)
+        self.events.publish(vault_id, None)
+
+    async def avalidator(self, vault_id: str) -> VaultValidator:
+        return await self._run(self.sync.validator, vault_id)
+
+    async def aopen_stream(self, vault_id: str) -> VaultStream:
+        return await self._run(self.sync.open_stream, vault_id)
+
+    async def aopen_upload(self, vault_id: str, max_size: int) -> VaultUpload:
+        return await self._run(self.sync.open_upload, vault_id, max_size)
+
+    async def afeed_upload(self, upload: VaultUpload, chunk: bytes) -> None:
+        await self._run(upload.feed, chunk)
+
+    async def asave_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int:
+        async with self.locks.hold(upload.vault_id):
+            version = await self._run(self.sync.save_upload, upload, expected_version)
+        self.events.publish(upload.vault_id, VaultValidator(version, upload.signature))
+        return version
+
+    async def aexists_many(self, vault_ids: list[str]) -> list[tuple[str, bool | Exception]]:
+        return await self._run(self.sync.exists_many, vault_ids)
+
+    async def aread_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        return await self._run(self.sync.read_many, vault_ids)
+
+    async def acreate_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        # straight to the backend's own locks, queueing on a lock per vault would serialize the batch
+        results = await self._run(self.sync.create_many, vault_ids)
+        for vault_id, created in results:
+            if not isinstance(created, Exception):
+                self.events.publish(vault_id, VaultValidator.of_created(created))
+        return results
+
+    async def alist_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage:
+        return await self._run(self.sync.list_vaults, cursor, limit, updated_since)
+
+    async def arevisions(self, vault_id: str) -> list[VaultRevision]:
+        return await self._run(self.sync.revisions, vault_id)
+
+    async def aread_revision(self, vault_id: str, revision: int) -> bytes:
+        return await self._run(self.sync.read_revision, vault_id, revision)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def _run[T](self, fn: Callable[..., T], *args: object) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+
+@functools.cache
+def _async_storage_for(kind: str, base_path: str, threads: int) -> AsyncVaultStorage:
+    """Backends with a native async implementation get that, the rest go through the thread pool"""
+    if kind == "object" and config.get_int("CACHE_BYTES", 0) <= 0:
+        from password_manager.backend.objectstore import AsyncObjectStorage, object_store_settings  # noqa: PLC0415
+
+        return AsyncObjectStorage(**object_store_settings())
+    return ThreadedStorage(next(get_vault_storage()), max_workers=threads or None)
+
+
+def get_async_vault_storage() -> Generator[AsyncVaultStorage]:
+    """Get whatever impl we usin, async flavour. Configured the same way as `get_vault_storage`
+
+    `PASSWORD_JAM_STORAGE_THREADS` sizes the thread pool sync backends run on.
+    """
+    yield _async_storage_for(
+        config.get_str("STORAGE", "file"),
+        config.get_str("STORAGE_PATH", DEFAULT_BASE_PATH),
+        config.get_int("STORAGE_THREADS", 0),
+    )
@@ -0,0 +1,203 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import NamedTuple
+
+from password_manager.backend.database import (
+    BytesVaultStream,
+    ServerSideVault,
+    VaultRevision,
+    VaultStorage,
+    VaultStream,
+    VaultUpload,
+    VaultValidator,
+)
+from password_manager.backend.metadata_index import VaultPage
+from password_manager.util.metrics import Counter
+
+# rough per-entry bookkeeping on top of the blob itself
+ENTRY_OVERHEAD = 256
+
+
+class _CacheEntry(NamedTuple):
+    vault: ServerSideVault
+    size: int
+    expires: float
+    fingerprint: Hashable | None
+
+
+class CachedStorage(VaultStorage):
+    """Read-through LRU cache in front of any VaultStorage.
+
+    Bounded by the total bytes of cached vaults rather than a count, since vault sizes vary a lot.
+    Our own writes and deletes drop the entry straight away. Changes made by other processes are
+    caught through the backend's `fingerprint` (inode/mtime for FileStorage) where it has one, and
+    otherwise by the TTL.
+    """
+
+    def __init__(self, inner: VaultStorage, max_bytes: int = 64 * 1024 * 1024, ttl: float = 30.0):
+        self.inner = inner
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._size = 0
+        self._epoch = 0  # bumped by every invalidation, so a read racing a write doesn't cache the old blob
+        self._lock = threading.Lock()
+        self.hits = Counter("vault_cache_hits", "reads answered from the vault cache")
+        self.misses = Counter("vault_cache_misses", "reads that went to the backend")
+        self.evictions = Counter("vault_cache_evictions", "vaults pushed out of the cache to stay under max bytes")
+
+    def read(self, vault_id: str) -> ServerSideVault:
+        """Return the vault, from the cache if it's still fresh"""
+        entry = self._fresh(vault_id)
+        if entry is not None:
+            self.hits.inc()
+            return entry.vault
+        self.misses.inc()
+        # fingerprint before reading, so a write landing in between makes the entry look stale, not fresh
+        epoch = self._epoch
+        fingerprint = self.inner.fingerprint(vault_id)
+        vault = self.inner.read(vault_id)
+        self._put(vault_id, vault, fingerprint, epoch)
+        return vault
+
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        try:
+            return self.inner.write(vault_id, data, expected_version)
+        finally:
+            self.invalidate(vault_id)
+
+    def create(self, vault_id: str) -> ServerSideVault:
+        self.invalidate(vault_id)
+        return self.inner.create(vault_id)
+
+    def exists(self, vault_id: str) -> bool:
+        return self._fresh(vault_id) is not None or self.inner.exists(vault_id)
+
+    def delete(self, vault_id: str) -> None:
+        try:
+            self.inner.delete(vault_id)
+        finally:
+            self.invalidate(vault_id)
+
+    def get_secret(self, vault_id: str) -> str:
+        entry = self._fresh(vault_id)
+        return entry.vault.vault_secret if entry is not None else self.inner.get_secret(vault_id)
+
+    def fingerprint(self, vault_id: str) -> Hashable | None:
+        return self.inner.fingerprint(vault_id)
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        entry = self._fresh(vault_id)
+        return VaultValidator.of(entry.vault) if entry is not None else self.inner.validator(vault_id)
+
+    def open_stream(self, vault_id: str) -> VaultStream:
+        """Served from memory if cached, otherwise streamed from the backend without filling the cache"""
+        entry = self._fresh(vault_id)
+        if entry is not None:
+            self.hits.inc()
+            return BytesVaultStream(entry.vault)
+        return self.inner.open_stream(vault_id)
+
+    def open_upload(self, vault_id: str, max_size: int) -> VaultUpload:
+        return self.inner.open_upload(vault_id, max_size)
+
+    def save_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int:
+        try:
+            return self.inner.save_upload(upload, expected_version)
+        finally:
+            self.invalidate(upload.vault_id)
+
+    def exists_many(self, vault_ids: list[str]) -> list[tuple[str, bool | Exception]]:
+        return self.inner.exists_many(vault_ids)
+
+    def read_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        """Cached vaults from memory and the rest from the backend in one batch, which doesn't fill the cache.
+        A bulk job reading everything once would only push out the vaults people are actually using"""
+        cached = {vault_id: entry.vault for vault_id in vault_ids if (entry := self._fresh(vault_id)) is not None}
+        self.hits.inc(len(cached))
+        fetched = dict(self.inner.read_many([vault_id for vault_id in vault_ids if vault_id not in cached]))
+        self.misses.inc(len(fetched))
+        return [(vault_id, cached[vault_id] if vault_id in cached else fetched[vault_id]) for vault_id in vault_ids]
+
+    def create_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        for vault_id in vault_ids:
+            self.invalidate(vault_id)
+        return self.inner.create_many(vault_ids)
+
+    def list_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage:
+        return self.inner.list_vaults(cursor, limit, updated_since)
+
+    def revisions(self, vault_id: str) -> list[VaultRevision]:
+        return self.inner.revisions(vault_id)
+
+    def read_revision(self, vault_id: str, revision: int) -> bytes:
+        return self.inner.read_revision(vault_id, revision)
+
+    def invalidate(self, vault_id: str) -> None:
+        """Drop a vault from the cache"""
+        with self._lock:
+            self._epoch += 1
+            entry = self._entries.pop(vault_id, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._size = 0
+
+    def close(self) -> None:
+        self.clear()
+        close = getattr(self.inner, "close", None)
+        if close:
+            close()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits.value + self.misses.value
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "hit_ratio": self.hits.value / lookups if lookups else 0.0,
+            "evictions": self.evictions.value,
+        }
+
+    def _fresh(self, vault_id: str) -> _CacheEntry | None:
+        """The cached entry if it hasn't expired or changed underneath us, bumping it to most recent"""
+        with self._lock:
+            entry = self._entries.get(vault_id)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic() or (
+            entry.fingerprint is not None and entry.fingerprint != self.inner.fingerprint(vault_id)
+        ):
+            self.invalidate(vault_id)
+            return None
+        with self._lock:
+            if vault_id in self._entries:
+                self._entries.move_to_end(vault_id)
+        return entry
+
+    def _put(self, vault_id: str, vault: ServerSideVault, fingerprint: Hashable | None, epoch: int) -> None:
+        size = len(vault.vault_data) + len(vault.vault_secret) + sys.getsizeof(vault_id) + ENTRY_OVERHEAD
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            old = self._entries.pop(vault_id, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[vault_id] = _CacheEntry(vault, size, time.monotonic() + self._ttl, fingerprint)
+            self._size += size
+            while self._size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                self.evictions.inc()
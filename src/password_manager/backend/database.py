@@ -1,7 +1,18 @@
+import contextlib
+import functools
+import hashlib
 import logging
+import os
 import secrets
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
 from abc import ABC, abstractmethod
-from collections.abc import Generator
+from collections.abc import Callable, Generator, Hashable, Iterator
+from typing import IO, BinaryIO, NamedTuple, Self
 from pathlib import Path
 import platformdirs
 from pydantic import BaseModel
@@ -9,16 +20,203 @@ from cryptography.exceptions import InvalidSignature
 
 from filelock import FileLock
 
-from password_manager.util.crypto import sign_data, validate_signature
-from password_manager.util.exceptions import VaultReadError, VaultSaveError, VaultValidationError
+from password_manager.backend.durability import DURABILITY_MODES, GroupCommitter, fsync_path
+from password_manager.backend.metadata_index import MetadataIndex, VaultMetadata, VaultPage, decode_cursor
+from password_manager.backend.secret_index import SECRET_INDEX
+from password_manager.backend.vault import vault_delta
+from password_manager.util import config
+from password_manager.util.crypto import SIGNATURE_SIZE, SignatureVerifier, sign_data, validate_signature
+from password_manager.util.delta import apply_delta
+from password_manager.util.exceptions import (
+    InvalidVaultIdError,
+    VaultConflictError,
+    VaultExistsError,
+    VaultReadError,
+    VaultSaveError,
+    VaultTooLargeError,
+    VaultValidationError,
+)
+from password_manager.util.metrics import REGISTRY
 
 logger = logging.getLogger()
 
+DEFAULT_BASE_PATH = platformdirs.user_config_dir(appname="password-jam", appauthor="password-jam")
+
+# stored blobs start with this so the version lands atomically with the data it belongs to. Blobs
+# from before versions existed don't have it and count as version 0
+BLOB_HEADER = struct.Struct(">8sQ")
+BLOB_MAGIC = b"PJVAULT\x01"
+
+# an older revision kept as a delta against the one after it, the header has the size of the blob it rebuilds
+REVISION_DELTA = struct.Struct(">8sQ")
+REVISION_DELTA_MAGIC = b"PJREVD\x00\x01"
+
+# what FileStorage keeps next to a vault's blob, so no vault may be called `<another vault><suffix>`
+RESERVED_SUFFIXES = (".secret", ".lock", ".revs")
+
+FILE_LOCK_WAIT = REGISTRY.histogram("vault_file_lock_wait_seconds", "time spent waiting for a vault's FileLock")
+
+
+def pack_blob(version: int, data: bytes) -> bytes:
+    return BLOB_HEADER.pack(BLOB_MAGIC, version) + data
+
+
+def unpack_blob(raw: bytes) -> tuple[int, bytes]:
+    """(version, data) of a stored blob"""
+    if len(raw) >= BLOB_HEADER.size and raw.startswith(BLOB_MAGIC):
+        return BLOB_HEADER.unpack_from(raw)[1], raw[BLOB_HEADER.size :]
+    return 0, raw
+
+
+def read_blob(f: BinaryIO) -> tuple[int, bytes]:
+    """(version, data) of a stored blob, straight from the file without copying the data around"""
+    head = f.read(BLOB_HEADER.size)
+    if len(head) == BLOB_HEADER.size and head.startswith(BLOB_MAGIC):
+        return BLOB_HEADER.unpack(head)[1], f.read()
+    return 0, head + f.read()
+
 
 class ServerSideVault(BaseModel):
     vault_id: str
     vault_data: bytes
     vault_secret: str
+    version: int = 0
+
+
+class VaultValidator(NamedTuple):
+    """Enough to tell whether a copy of the vault is current, without fetching the blob"""
+
+    version: int
+    signature: bytes  # the hmac every blob starts with
+
+    @classmethod
+    def of(cls, vault: ServerSideVault) -> Self:
+        return cls(vault.version, vault.vault_data[:SIGNATURE_SIZE])
+
+    @classmethod
+    def of_created(cls, vault: ServerSideVault) -> Self:
+        """A vault fresh out of `create`, which holds a signed 'nothing' whatever `vault_data` says"""
+        return cls(vault.version, sign_data(b"", vault.vault_secret.encode("utf-8"))[:SIGNATURE_SIZE])
+
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+class VaultStream(ABC):
+    """A stored vault blob opened for reading in pieces, so serving it doesn't mean holding it all in memory.
+
+    Reads see the blob as it was when opened, whatever writers do afterwards.
+    """
+
+    validator: VaultValidator
+    size: int
+
+    @abstractmethod
+    def iter_range(
+        self, start: int = 0, end: int | None = None, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """The bytes in [start, end), a chunk at a time"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Let go of whatever the stream holds open"""
+
+
+class BytesVaultStream(VaultStream):
+    """Chunks of a blob that's already in memory, for backends that can't do any better"""
+
+    def __init__(self, vault: ServerSideVault):
+        self.validator = VaultValidator.of(vault)
+        self.size = len(vault.vault_data)
+        self._data = memoryview(vault.vault_data)
+
+    def iter_range(
+        self, start: int = 0, end: int | None = None, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        end = self.size if end is None else min(end, self.size)
+        for pos in range(start, end, chunk_size):
+            yield bytes(self._data[pos : min(pos + chunk_size, end)])
+
+
+class FileVaultStream(VaultStream):
+    """Positioned reads straight from an open file, the data starting `offset` bytes in
+
+    Holding the fd pins the inode, so a writer renaming a new blob in doesn't change what we serve.
+    """
+
+    def __init__(self, fd: int, offset: int, size: int, validator: VaultValidator):
+        self.validator = validator
+        self.size = size
+        self._fd = fd
+        self._offset = offset
+
+    def iter_range(
+        self, start: int = 0, end: int | None = None, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        end = self.size if end is None else min(end, self.size)
+        for pos in range(start, end, chunk_size):
+            yield os.pread(self._fd, min(chunk_size, end - pos), self._offset + pos)
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class VaultUpload:
+    """A save arriving in pieces. Each piece is checked against `max_size`, fed to the signature check and
+    spooled to `file` (after `offset` bytes of room for a header), so the blob never has to sit in memory.
+
+    `path` is set when the spool is a named temp file the backend can rename into place, closing removes it.
+    """
+
+    def __init__(
+        self, vault_id: str, secret: str, max_size: int, file: IO[bytes], path: Path | None = None, offset: int = 0
+    ):
+        self.vault_id = vault_id
+        self.secret = secret
+        self.max_size = max_size
+        self.file = file
+        self.path = path
+        self.offset = offset
+        self.size = 0
+        self._verifier = SignatureVerifier(secret.encode("utf-8"))
+
+    @property
+    def signature(self) -> bytes:
+        return self._verifier.signature
+
+    def feed(self, chunk: bytes) -> None:
+        """Take the next piece of the blob, or raise VaultTooLargeError once it's grown past the limit"""
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise VaultTooLargeError(f"Vault is over the {self.max_size} byte limit")
+        self._verifier.update(chunk)
+        self.file.write(chunk)
+
+    def verify(self) -> None:
+        """Raise VaultValidationError unless the whole blob was signed with the vault's secret"""
+        try:
+            self._verifier.verify()
+        except InvalidSignature as e:
+            logger.error("Vault '%s' had an invalid signature when attempting to write", self.vault_id)
+            raise VaultValidationError("Invalid siganture") from e
+
+    def read(self) -> bytes:
+        """The whole blob, for backends that need it in one piece after all"""
+        self.file.seek(self.offset)
+        return self.file.read()
+
+    def close(self) -> None:
+        self.file.close()
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+
+class VaultRevision(BaseModel):
+    revision: int
+    size: int
+    saved_at: float
 
 
 class VaultStorage(ABC):
@@ -30,8 +228,8 @@ class VaultStorage(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def write(self, vault_id: str, data: bytes) -> None:
-        """Write"""
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        """Write, returning the new version. With `expected_version` raise VaultConflictError if the vault moved past it"""
         raise NotImplementedError
 
     @abstractmethod
@@ -49,96 +247,711 @@ class VaultStorage(ABC):
         """Delete the vault"""
         raise NotImplementedError
 
+    def get_secret(self, vault_id: str) -> str:
+        """Just the vault secret, for checking signatures. Backends should override if they can skip the blob"""
+        return self.read(vault_id).vault_secret
+
+    def fingerprint(self, vault_id: str) -> Hashable | None:
+        """Something cheap that changes whenever the stored vault does, or None if the backend can't tell"""
+        return None
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        """Version and signature of the stored vault. Backends should override if they can skip the blob"""
+        return VaultValidator.of(self.read(vault_id))
+
+    def open_stream(self, vault_id: str) -> VaultStream:
+        """The vault blob to read in pieces, caller closes it. Backends should override if they can avoid loading it"""
+        return BytesVaultStream(self.read(vault_id))
+
+    def open_upload(self, vault_id: str, max_size: int) -> VaultUpload:
+        """Start a save that arrives in pieces, caller closes it. By default spooled to an anonymous temp file"""
+        return VaultUpload(vault_id, self.get_secret(vault_id), max_size, tempfile.TemporaryFile())  # noqa: SIM115
+
+    def save_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int:
+        """Finish an upload like `write` would. By default the checked blob is read back and handed to `write`"""
+        upload.verify()
+        return self.write(upload.vault_id, upload.read(), expected_version)
+
+    def exists_many(self, vault_ids: list[str]) -> list[tuple[str, bool | Exception]]:
+        """`exists` for a batch of ids, each with its answer or what asking raised
+
+        Backends should override if they can do the batch in one go, same for the other `_many`s.
+        """
+        return _each(vault_ids, self.exists)
+
+    def read_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        """`read` for a batch of ids, each with its vault or what reading it raised"""
+        return _each(vault_ids, self.read)
+
+    def create_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        """`create` for a batch of ids, each with its new vault or what creating it raised"""
+        return _each(vault_ids, self.create)
+
+    def revisions(self, vault_id: str) -> list[VaultRevision]:
+        """Kept revisions of the vault, oldest first. Backends that don't keep history raise NotImplementedError"""
+        raise NotImplementedError
+
+    def read_revision(self, vault_id: str, revision: int) -> bytes:
+        """The blob as it was saved in `revision`"""
+        raise NotImplementedError
+
+    def list_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage:
+        """A page of vault metadata in id order, pass the page's `next_cursor` back for the next one.
+        Backends that can't enumerate vaults cheaply raise NotImplementedError"""
+        raise NotImplementedError
+
+
+def _each[T](vault_ids: list[str], fn: Callable[[str], T]) -> list[tuple[str, T | Exception]]:
+    """Call `fn` on every id, keeping going past the ones that fail"""
+    results: list[tuple[str, T | Exception]] = []
+    for vault_id in vault_ids:
+        try:
+            results.append((vault_id, fn(vault_id)))
+        except (VaultReadError, VaultSaveError, ValueError) as e:
+            results.append((vault_id, e))
+    return results
+
 
 class FileStorage(VaultStorage):
-    """Just store to filesystem"""
+    """Just store to filesystem
+
+    Each vault is three files: the blob, `<vault_id>.secret` and `<vault_id>.lock`. With the default
+    "flat" layout they all sit directly in the base dir. The "sharded" layout fans them out over
+    `.shards/ab/cd/` (from a hash of the vault id) so no directory grows past a few hundred entries.
+    A sharded store still finds vaults left in the flat layout, so `migrate_layout` can move them
+    over while we keep serving.
+
+    `durability` is one of `DURABILITY_MODES`, how hard a write tries to be on disk before it returns.
+
+    With `history` > 0 every saved blob is also hard linked into `<vault_id>.revs/<revision>`. Once the
+    next save lands, the one before is swapped for `<revision>.delta`, a `vault_delta` against its
+    successor. Vaults encrypt entry by entry, so that's about the size of the entries that changed
+    rather than a whole blob (a delta that isn't smaller just keeps the whole blob). Reading an old
+    revision replays the deltas down from the newest. A background job prunes each vault down to its
+    newest `history` revisions, and drops ones older than `history_max_age` seconds (always keeping
+    the newest), without taking any vault locks.
+
+    Sizes, versions and timestamps of every vault are kept in `.index.sqlite3` for `list_vaults`. It's
+    rebuilt from a scan if missing, and `reindex` does the same on demand, say after a crash between a
+    write and its index update.
+    """
 
     def __init__(
         self,
-        base_path: str = platformdirs.user_config_dir(appname="password-jam", appauthor="password-jam"),
+        base_path: str = DEFAULT_BASE_PATH,
+        layout: str = "flat",
+        durability: str = "fsync-per-write",
+        history: int = 0,
+        history_max_age: float = 0.0,
+        compact_interval: float = 300.0,
     ):
-        self._base = Path(base_path).expanduser()
+        if layout not in ("flat", "sharded"):
+            raise ValueError(f"Unknown FileStorage layout '{layout}'")
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{durability}'")
+        self._base = Path(base_path).expanduser().resolve()
+        self._sharded = layout == "sharded"
+        self._durability = durability
+        self._committer = GroupCommitter() if durability == "group-commit" else None
         if not Path.exists(self._base):
             Path.mkdir(self._base, parents=True)
 
+        self._index = MetadataIndex(self._base / ".index.sqlite3")
+        if self._index.created:
+            self.reindex()
+
+        self._history = history
+        self._history_max_age = history_max_age
+        self._closed = threading.Event()
+        self._compactor = None
+        if history > 0 and compact_interval > 0:
+            self._compactor = threading.Thread(target=self._compact_loop, args=(compact_interval,), daemon=True)
+            self._compactor.start()
+
     def read(self, vault_id: str) -> ServerSideVault:
-        """Return the vault, or raise"""
-        if not self.exists(vault_id):
-            raise VaultReadError("Vault does not exist")
-        try:
-            with (
-                FileLock(self._get_path(f"{vault_id}.lock")),
-                Path.open(self._get_path(vault_id), "rb") as f,
-                Path.open(self._get_path(f"{vault_id}.secret"), "r") as s,
-            ):
-                return ServerSideVault(vault_id=vault_id, vault_data=f.read(), vault_secret=s.read())
-        except FileNotFoundError as e:
-            logger.info("Vault '%s' was not found", vault_id)
-            raise VaultReadError("Unable to read vault, not found") from e
+        """Return the vault, or raise
+
+        No lock needed, writers swap whole files in with a rename so we see either the old or the new blob.
+        """
+        for directory in self._search_dirs(vault_id):
+            try:
+                with (
+                    Path.open(self._get_path(vault_id, directory=directory), "rb") as f,
+                    Path.open(self._get_path(vault_id, ".secret", directory), "r") as s,
+                ):
+                    version, data = read_blob(f)
+                    return ServerSideVault(vault_id=vault_id, vault_data=data, vault_secret=s.read(), version=version)
+            except FileNotFoundError:
+                continue
+        logger.info("Vault '%s' was not found", vault_id)
+        raise VaultReadError("Unable to read vault, not found")
 
-    def write(self, vault_id: str, data: bytes) -> None:
-        """Write the vault, or raise"""
-        if not self.exists(vault_id):
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        """Write the vault, or raise
+
+        Checking the signature and writing out the temp file happen without the vault lock, it's only
+        held to compare versions and rename the new blob in.
+        """
+        directory = self._locate(vault_id)
+        if directory is None:
             raise VaultReadError("Vault does not exist, cannot write")
+        secret = self._secret_in(vault_id, directory)
         try:
-            # read it first, so we can validate the signature...
-            vault = self.read(vault_id)
-            validate_signature(data, vault.vault_secret.encode("utf-8"))
-            with FileLock(self._get_path(f"{vault_id}.lock")), Path.open(self._get_path(vault_id), "wb") as f:
-                f.write(data)
+            validate_signature(data, secret.encode("utf-8"))
         except InvalidSignature as e:
             logger.error("Vault '%s' had an invalid signature when attempting to write", vault_id)
             raise VaultValidationError("Invalid siganture") from e
-        except Exception as e:
-            # most likely will propagate any exception from self.read(...)
-            raise e
+        target = self._get_path(vault_id, directory=directory)
+        version = (self._version_of(target) if expected_version is None else expected_version) + 1
+        tmp = self._stage(target, BLOB_HEADER.pack(BLOB_MAGIC, version), data)
+        return self._swap_in(vault_id, secret, tmp, version, expected_version)
+
+    def open_upload(self, vault_id: str, max_size: int) -> VaultUpload:
+        """Spooled straight into a temp file next to the blob, ready to be renamed in"""
+        directory = self._locate(vault_id)
+        if directory is None:
+            raise VaultReadError("Vault does not exist, cannot write")
+        secret = self._secret_in(vault_id, directory)
+        target = self._get_path(vault_id, directory=directory)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+        f = os.fdopen(fd, "w+b")
+        f.write(BLOB_HEADER.pack(BLOB_MAGIC, 0))  # stamped with the real version once we know it
+        return VaultUpload(vault_id, secret, max_size, f, path=Path(tmp), offset=BLOB_HEADER.size)
+
+    def save_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int:
+        """Check the signature, stamp the version and rename the temp file in, the blob is never read back"""
+        if upload.path is None:
+            return super().save_upload(upload, expected_version)
+        upload.verify()
+        directory = self._locate(upload.vault_id)
+        if directory is None:
+            raise VaultReadError("Vault does not exist, cannot write")
+        target = self._get_path(upload.vault_id, directory=directory)
+        version = (self._version_of(target) if expected_version is None else expected_version) + 1
+        upload.file.seek(0)
+        upload.file.write(BLOB_HEADER.pack(BLOB_MAGIC, version))
+        upload.file.flush()
+        if self._durability == "fsync-per-write":
+            os.fsync(upload.file.fileno())
+        return self._swap_in(upload.vault_id, upload.secret, upload.path, version, expected_version)
 
     def create(self, vault_id: str) -> ServerSideVault:
         """new vault, will generate a new secret"""
-        if self.exists(vault_id):
-            raise VaultSaveError("Unable to create vault, already exists") from e
-        try:
-            with (
-                FileLock(self._get_path(f"{vault_id}.lock")),
-                Path.open(self._get_path(vault_id), "wb") as f,
-                Path.open(self._get_path(f"{vault_id}.secret"), "w") as s,
-            ):
-                # generate a secret first
-                secret = secrets.token_hex(32)
-                s.write(secret)
-
-                # now we just sign 'nothing' so we can validate 'nothing'
-                f.write(sign_data(b"", secret.encode("utf-8")))
-                return ServerSideVault(vault_id=vault_id, vault_data=b"", vault_secret=secret)
-        except Exception as e:
+        with self._lock(vault_id):
+            # a stray file in the way isn't a vault, but it isn't ours to overwrite either
+            if any(self._get_path(vault_id, directory=d).exists() for d in self._layout_dirs(vault_id)):
+                raise VaultExistsError("Unable to create vault, already exists")
+            secret = secrets.token_hex(32)
+            secret_path = self._get_path(vault_id, ".secret")
+            SECRET_INDEX.invalidate(secret_path)
+            # history left behind by a vault of the same name that was removed by hand
+            shutil.rmtree(self._get_path(vault_id, ".revs"), ignore_errors=True)
             try:
-                self._get_path(vault_id).unlink()
-                self._get_path(f"{vault_id}.secret").unlink()
-            except Exception:
-                pass
-            logger.error("Unknown and uncaught error writing vault %s", e)
-            # raise VaultSaveError("Unable to create vault") from e
-            raise e
+                # the secret goes first, the blob showing up is what makes the vault exist
+                self._replace(secret_path, secret.encode("utf-8"))
+                # now we just sign 'nothing' so we can validate 'nothing'
+                self._replace(self._get_path(vault_id), pack_blob(1, sign_data(b"", secret.encode("utf-8"))))
+                self._keep_revision(vault_id, self._shard_dir(vault_id), 1)
+                self._index_blob(vault_id, self._get_path(vault_id), 1, created=True)
+            except Exception as e:
+                secret_path.unlink(missing_ok=True)
+                logger.error("Unknown and uncaught error writing vault %s", e)
+                raise VaultSaveError("Unable to create vault") from e
+        return ServerSideVault(vault_id=vault_id, vault_data=b"", vault_secret=secret, version=1)
 
     def exists(self, path: str) -> bool:
         """if path exists"""
-        return self._get_path(path).exists()
+        return self._locate(path) is not None
 
     def delete(self, vault_id: str) -> None:
         if self.exists(vault_id):
-            with FileLock(self._get_path(f"{vault_id}.lock")):
-                self._get_path(vault_id).unlink()
-                self._get_path(f"{vault_id}.secret").unlink()
-
-    def _get_path(self, path: Path) -> Path:
-        """protect against directory traversals, aka ensure we are always under our dir"""
-        new_path = (self._base / path).resolve()
-        if not new_path.is_relative_to(self._base):
-            raise ValueError("Attempted directory traversal likely")
+            with self._lock(vault_id):
+                for directory in self._layout_dirs(vault_id):
+                    # blob first, so the vault stops existing before its secret goes away
+                    self._get_path(vault_id, directory=directory).unlink(missing_ok=True)
+                    self._get_path(vault_id, ".secret", directory).unlink(missing_ok=True)
+                    SECRET_INDEX.invalidate(self._get_path(vault_id, ".secret", directory))
+                    # the compactor may be pruning in here at the same time, whatever it leaves we get
+                    shutil.rmtree(self._get_path(vault_id, ".revs", directory), ignore_errors=True)
+                self._unindex(vault_id)
+
+    def get_secret(self, vault_id: str) -> str:
+        """The vault secret, from the process-wide index so we don't touch the disk for every signature check"""
+        for directory in self._search_dirs(vault_id):
+            try:
+                return SECRET_INDEX.get(self._get_path(vault_id, ".secret", directory))
+            except FileNotFoundError:
+                continue
+        raise VaultReadError("Vault does not exist")
+
+    def fingerprint(self, vault_id: str) -> Hashable | None:
+        """inode and mtime of the blob, every write renames a new file in so the inode alone would do"""
+        directory = self._locate(vault_id)
+        if directory is None:
+            return None
+        try:
+            st = self._get_path(vault_id, directory=directory).stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        """Just the start of the blob, the version header and signature"""
+        for directory in self._search_dirs(vault_id):
+            try:
+                with Path.open(self._get_path(vault_id, directory=directory), "rb") as f:
+                    version, head = unpack_blob(f.read(BLOB_HEADER.size + SIGNATURE_SIZE))
+            except FileNotFoundError:
+                continue
+            if self._has_secret(vault_id, directory):
+                return VaultValidator(version, head[:SIGNATURE_SIZE])
+        raise VaultReadError("Vault does not exist")
+
+    def open_stream(self, vault_id: str) -> VaultStream:
+        """The blob's fd, reads come straight off the page cache with no copy of the whole thing"""
+        for directory in self._search_dirs(vault_id):
+            try:
+                fd = os.open(self._get_path(vault_id, directory=directory), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            if not self._has_secret(vault_id, directory):
+                os.close(fd)
+                continue
+            try:
+                head = os.pread(fd, BLOB_HEADER.size + SIGNATURE_SIZE, 0)
+                version, data = unpack_blob(head)
+                offset = len(head) - len(data)
+                validator = VaultValidator(version, data[:SIGNATURE_SIZE])
+                return FileVaultStream(fd, offset, os.fstat(fd).st_size - offset, validator)
+            except BaseException:
+                os.close(fd)
+                raise
+        logger.info("Vault '%s' was not found", vault_id)
+        raise VaultReadError("Unable to read vault, not found")
+
+    def revisions(self, vault_id: str) -> list[VaultRevision]:
+        directory = self._locate(vault_id)
+        if directory is None:
+            raise VaultReadError("Vault does not exist")
+        revisions = []
+        for revision, path in self._revision_paths(self._get_path(vault_id, ".revs", directory)):
+            try:
+                with Path.open(path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    if path.suffix == ".delta":
+                        size = REVISION_DELTA.unpack(f.read(REVISION_DELTA.size))[1]
+                    else:
+                        size = max(st.st_size - BLOB_HEADER.size, 0)
+            except FileNotFoundError:
+                continue  # just compacted away, or swapped for a delta
+            revisions.append(VaultRevision(revision=revision, size=size, saved_at=st.st_mtime))
+        return revisions
+
+    def read_revision(self, vault_id: str, revision: int) -> bytes:
+        directory = self._locate(vault_id)
+        if directory is None or revision < 1:
+            raise VaultReadError("Vault revision does not exist")
+        revs = self._get_path(vault_id, ".revs", directory)
+        # back from the revision to the first whole blob, then forwards again through the deltas
+        deltas = []
+        while True:
+            try:
+                with Path.open(revs / f"{revision:010d}", "rb") as f:
+                    data = read_blob(f)[1]
+                break
+            except FileNotFoundError:
+                pass
+            try:
+                # it's only ever removed after its delta is in place, so one or the other is there
+                deltas.append((revs / f"{revision:010d}.delta").read_bytes())
+            except FileNotFoundError as e:
+                raise VaultReadError("Vault revision does not exist") from e
+            revision += 1
+        for diff in reversed(deltas):
+            base = data
+            data = b"".join(apply_delta(diff[REVISION_DELTA.size :], len(base), lambda start, end: (base[start:end],)))
+        return data
+
+    def compact(self) -> int:
+        """Prune the revisions of every vault by count and age, returning how many were removed
+
+        Lock free: writers only ever add a revision numbered past the newest, and the newest is never pruned.
+        """
+        removed = 0
+        cutoff = time.time() - self._history_max_age if self._history_max_age > 0 else None
+        for revs in self._revision_dirs():
+            revisions = self._revision_paths(revs)
+            # oldest first and stopping at the first one kept, every revision's delta needs the one after it
+            for i, (revision, _) in enumerate(revisions[:-1]):
+                if i >= len(revisions) - self._history and not self._saved_before(revs, revision, cutoff):
+                    break
+                gone = False
+                for path in (revs / f"{revision:010d}", revs / f"{revision:010d}.delta"):
+                    try:
+                        path.unlink()
+                        gone = True
+                    except FileNotFoundError:
+                        continue
+                removed += gone
+        return removed
+
+    def list_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage:
+        """Straight from the metadata index, no directory scans"""
+        return self._index.page(decode_cursor(cursor) if cursor else None, limit, updated_since)
+
+    def reindex(self) -> int:
+        """Rebuild the metadata index from the vaults on disk, returning how many there are"""
+        return self._index.rebuild(self._scan())
+
+    def close(self) -> None:
+        """Stop the background compaction"""
+        self._closed.set()
+        if self._compactor:
+            self._compactor.join()
+        self._index.close()
+
+    def migrate_to_shard(self, vault_id: str) -> bool:
+        """Move one vault from the flat layout into its shard, returns whether anything moved
+
+        Safe against concurrent readers and writers: writers are held off with the vault lock, and
+        readers always find a blob with its secret next to it because the secret is hard linked into
+        the shard before the blob is renamed, and only then removed from the flat dir.
+        """
+        if not self._sharded:
+            raise ValueError("Can only migrate into a sharded FileStorage")
+        with self._lock(vault_id):
+            flat_blob = self._get_path(vault_id, directory=self._base)
+            flat_secret = self._get_path(vault_id, ".secret", self._base)
+            if not (flat_blob.exists() and flat_secret.exists()):
+                return False
+            if self._get_path(vault_id).exists():
+                raise VaultSaveError(f"Vault '{vault_id}' exists in both layouts")
+            shard_secret = self._get_path(vault_id, ".secret")
+            shard_secret.unlink(missing_ok=True)  # a leftover from an interrupted migration
+            os.link(flat_secret, shard_secret)
+            flat_revs = self._get_path(vault_id, ".revs", self._base)
+            if flat_revs.exists():
+                os.replace(flat_revs, self._get_path(vault_id, ".revs"))
+            os.replace(flat_blob, self._get_path(vault_id))
+            flat_secret.unlink()
+            SECRET_INDEX.invalidate(flat_secret)
+            self._get_path(vault_id, ".lock", self._base).unlink(missing_ok=True)
+        return True
+
+    def _shard_dir(self, vault_id: str) -> Path:
+        if not self._sharded:
+            return self._base
+        digest = hashlib.sha256(vault_id.encode("utf-8")).hexdigest()
+        return self._base / ".shards" / digest[:2] / digest[2:4]
+
+    def _layout_dirs(self, vault_id: str) -> tuple[Path, ...]:
+        """Every dir the vault could live in, its shard first"""
+        return (self._shard_dir(vault_id), self._base) if self._sharded else (self._base,)
+
+    def _search_dirs(self, vault_id: str) -> tuple[Path, ...]:
+        """Dirs to look in without holding the lock, the shard again last in case a migration just moved it"""
+        dirs = self._layout_dirs(vault_id)
+        return (*dirs, dirs[0]) if self._sharded else dirs
+
+    def _locate(self, vault_id: str) -> Path | None:
+        """The dir the vault's blob is in, if any"""
+        for directory in self._layout_dirs(vault_id):
+            if self._get_path(vault_id, directory=directory).exists() and self._has_secret(vault_id, directory):
+                return directory
+        return None
+
+    def _has_secret(self, vault_id: str, directory: Path) -> bool:
+        """Whether the blob next to it is a vault, rather than some stray file in the dir
+
+        The secret goes in before the blob and out after it, so a blob without one was never a vault.
+        """
+        return self._get_path(vault_id, ".secret", directory).exists()
+
+    def _keep_revision(self, vault_id: str, directory: Path, version: int) -> None:
+        """Hard link the blob we just saved in as revision `version`, caller holds the vault lock"""
+        if self._history <= 0:
+            return
+        revs = self._get_path(vault_id, ".revs", directory)
+        try:
+            revs.mkdir(exist_ok=True)
+            os.link(self._get_path(vault_id, directory=directory), revs / f"{version:010d}")
+        except OSError as e:
+            # the save itself went through, losing a step of history isn't worth failing it over
+            logger.error("Could not keep a revision of vault '%s': %s", vault_id, e)
+
+    def _delta_revision(self, revs: Path, revision: int) -> None:
+        """Swap a revision's whole blob for a delta against the revision after it, if that's smaller"""
+        path = revs / f"{revision:010d}"
+        try:
+            with Path.open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                old = read_blob(f)[1]
+            with Path.open(revs / f"{revision + 1:010d}", "rb") as f:
+                new = read_blob(f)[1]
+        except FileNotFoundError:
+            return  # pruned, already a delta, or history was only just turned on
+        try:
+            diff = vault_delta(new, old)
+        except ValueError:
+            return  # not a vault blob we can split up
+        if REVISION_DELTA.size + len(diff) >= len(old):
+            return
+        try:
+            tmp = self._stage(path, REVISION_DELTA.pack(REVISION_DELTA_MAGIC, len(old)), diff)
+            # keeps its saved_at, and age based pruning still sees revisions in order
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp, path.with_name(f"{path.name}.delta"))
+            path.unlink()
+        except OSError as e:
+            logger.error("Could not compact revision %d in %s: %s", revision, revs, e)
+
+    @staticmethod
+    def _saved_before(revs: Path, revision: int, cutoff: float | None) -> bool:
+        """Whether a revision is older than `cutoff`, in whichever form it's in right now"""
+        if cutoff is None:
+            return False
+        for path in (revs / f"{revision:010d}", revs / f"{revision:010d}.delta"):
+            try:
+                return path.stat().st_mtime < cutoff
+            except FileNotFoundError:
+                continue
+        return True  # pruned already
+
+    @staticmethod
+    def _revision_paths(revs: Path) -> list[tuple[int, Path]]:
+        """(revision, path) of everything in a `.revs` dir, oldest first, the whole blob if it's there too"""
+        found: dict[int, Path] = {}
+        try:
+            for entry in revs.iterdir():
+                number, _, kind = entry.name.partition(".")
+                if number.isdigit() and kind in ("", "delta") and (not kind or int(number) not in found):
+                    found[int(number)] = entry
+        except FileNotFoundError:
+            return []
+        return sorted(found.items())
+
+    def _revision_dirs(self) -> Iterator[Path]:
+        """Every `.revs` dir in the store, in both layouts"""
+        yield from self._base.glob("*.revs")
+        if self._sharded:
+            yield from self._base.glob(".shards/*/*/*.revs")
+
+    def _scan(self) -> Iterator[VaultMetadata]:
+        """Metadata for every vault on disk, in both layouts"""
+        dirs = [self._base, *self._base.glob(".shards/*/*")] if self._sharded else [self._base]
+        for directory in dirs:
+            for secret in directory.glob("*.secret"):
+                blob = secret.with_suffix("")
+                try:
+                    st = blob.stat()
+                    version = self._version_of(blob)
+                    created_at = secret.stat().st_mtime
+                except (FileNotFoundError, VaultReadError):
+                    continue
+                header = BLOB_HEADER.size if version else 0
+                yield VaultMetadata(
+                    vault_id=blob.name,
+                    size=st.st_size - header,
+                    version=version,
+                    created_at=created_at,
+                    updated_at=st.st_mtime,
+                )
+
+    def _index_blob(self, vault_id: str, blob: Path, version: int, created: bool = False) -> None:
+        """Record a blob we just put in place, under the vault lock so index updates land in write order"""
+        try:
+            st = blob.stat()
+            self._index.record(
+                vault_id,
+                st.st_size - BLOB_HEADER.size,
+                version,
+                st.st_mtime,
+                created_at=st.st_mtime if created else None,
+            )
+        except (OSError, sqlite3.Error) as e:
+            # the blob is saved either way, the index just lags until the next reindex
+            logger.error("Failed to index vault '%s': %s", vault_id, e)
+
+    def _unindex(self, vault_id: str) -> None:
+        try:
+            self._index.remove(vault_id)
+        except sqlite3.Error as e:
+            logger.error("Failed to drop vault '%s' from the index: %s", vault_id, e)
+
+    def _compact_loop(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            try:
+                removed = self.compact()
+                if removed:
+                    logger.info("Pruned %d vault revisions", removed)
+            except Exception as e:
+                logger.error("Vault revision compaction failed: %s", e)
+
+    @contextlib.contextmanager
+    def _lock(self, vault_id: str) -> Iterator[None]:
+        """Hold the cross-process lock serializing writers of a vault, readers never take it"""
+        lock_path = self._get_path(vault_id, ".lock")
+        if self._sharded:
+            lock_path.parent.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        with FileLock(lock_path):
+            FILE_LOCK_WAIT.observe(time.perf_counter() - start)
+            yield
+
+    def _secret_in(self, vault_id: str, directory: Path) -> str:
+        try:
+            return SECRET_INDEX.get(self._get_path(vault_id, ".secret", directory))
+        except FileNotFoundError as e:
+            raise VaultReadError("Vault does not exist, cannot write") from e
+
+    def _version_of(self, blob: Path) -> int:
+        """Version of a stored blob, from just its header"""
+        try:
+            with Path.open(blob, "rb") as f:
+                head = f.read(BLOB_HEADER.size)
+        except FileNotFoundError as e:
+            raise VaultReadError("Vault does not exist, cannot write") from e
+        return unpack_blob(head)[0]
+
+    def _swap_in(self, vault_id: str, secret: str, tmp: Path, version: int, expected_version: int | None) -> int:
+        """Under the vault lock, check nothing moved underneath a staged blob and rename it in"""
+        try:
+            with self._lock(vault_id):
+                # it may have been migrated, deleted or even recreated since we looked
+                directory = self._locate(vault_id)
+                if directory is None:
+                    raise VaultReadError("Vault does not exist, cannot write")
+                if self._secret_in(vault_id, directory) != secret:
+                    raise VaultConflictError("Vault was recreated while saving")
+                target = self._get_path(vault_id, directory=directory)
+                current = self._version_of(target)
+                if expected_version is not None and current != expected_version:
+                    raise VaultConflictError(f"Vault is at version {current}, not {expected_version}")
+                if current + 1 != version:
+                    # an unconditional write that raced another one, just take the next number
+                    version = current + 1
+                    self._restamp(tmp, version)
+                self._commit(tmp, target)
+                self._keep_revision(vault_id, directory, version)
+                self._index_blob(vault_id, target, version)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        if self._history > 0:
+            # outside the lock, only the revision before this one is touched and readers cope either way
+            self._delta_revision(self._get_path(vault_id, ".revs", directory), version - 1)
+        return version
+
+    def _replace(self, target: Path, data: bytes) -> None:
+        """Atomically swap in new content: write a temp file next to it, then rename over"""
+        tmp = self._stage(target, data)
+        try:
+            self._commit(tmp, target)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _stage(self, target: Path, *parts: bytes) -> Path:
+        """Write a temp file next to `target`, synced if the durability mode says so before a rename"""
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for part in parts:
+                    f.write(part)
+                if self._durability == "fsync-per-write":
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return Path(tmp)
+
+    def _restamp(self, tmp: Path, version: int) -> None:
+        """Change the version in a staged blob's header"""
+        with Path.open(tmp, "r+b") as f:
+            f.write(BLOB_HEADER.pack(BLOB_MAGIC, version))
+            if self._durability == "fsync-per-write":
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _commit(self, tmp: Path, target: Path) -> None:
+        """Rename a staged file over `target`, with the directory sync the durability mode asks for"""
+        if self._committer is not None:
+            self._committer.commit(tmp, target)
+            return
+        os.replace(tmp, target)
+        if self._durability == "fsync-per-write":
+            fsync_path(target.parent)
+
+    def _get_path(self, vault_id: str, suffix: str = "", directory: Path | None = None) -> Path:
+        """protect against directory traversals, aka ensure we are always under our dir
+
+        The file has to land directly in the dir it was asked for (the vault's shard by default), so
+        an id like `../../x` can't hop into another shard either. Ids that would name another vault's
+        secret, lock or history aren't vaults either, nor are dotfiles: the metadata index (and its
+        -wal/-shm), the shard tree and temp files.
+        """
+        if vault_id.endswith(RESERVED_SUFFIXES):
+            raise InvalidVaultIdError(f"Vault ids can't end in {', '.join(RESERVED_SUFFIXES)}")
+        if vault_id.startswith("."):
+            raise InvalidVaultIdError("Vault ids can't start with '.'")
+        directory = directory or self._shard_dir(vault_id)
+        new_path = (directory / f"{vault_id}{suffix}").resolve()
+        if not new_path.is_relative_to(self._base) or new_path.parent != directory:
+            raise InvalidVaultIdError("Attempted directory traversal likely")
         return new_path.absolute()
 
 
+@functools.cache
+def _storage_for(kind: str, base_path: str) -> VaultStorage:
+    """Build a storage backend once, so per-thread connections and such get reused across requests"""
+    if kind == "file":
+        return FileStorage(
+            base_path,
+            layout=config.get_str("STORAGE_LAYOUT", "flat"),
+            durability=config.get_str("STORAGE_DURABILITY", "fsync-per-write"),
+            history=config.get_int("HISTORY_REVISIONS", 0),
+            history_max_age=config.get_float("HISTORY_MAX_AGE", 30 * 24 * 3600),
+        )
+    if kind == "sqlite":
+        from password_manager.backend.sqlite import SqliteStorage  # noqa: PLC0415, circular
+
+        return SqliteStorage(base_path)
+    if kind == "log":
+        from password_manager.backend.logstore import LogStorage  # noqa: PLC0415, circular
+
+        return LogStorage(base_path)
+    if kind == "object":
+        from password_manager.backend.objectstore import ObjectStorage, object_store_settings  # noqa: PLC0415
+
+        return ObjectStorage(**object_store_settings())
+    raise ValueError(f"Unknown storage backend '{kind}'")
+
+
+@functools.cache
+def _cached_storage_for(kind: str, base_path: str) -> VaultStorage:
+    """The configured backend, behind a read cache if PASSWORD_JAM_CACHE_BYTES is set, timed for /api/metrics"""
+    from password_manager.backend.instrumented import InstrumentedStorage  # noqa: PLC0415, circular
+
+    storage = _storage_for(kind, base_path)
+    cache_bytes = config.get_int("CACHE_BYTES", 0)
+    if cache_bytes <= 0:
+        return InstrumentedStorage(storage)
+    from password_manager.backend.cache import CachedStorage  # noqa: PLC0415, circular
+
+    return InstrumentedStorage(CachedStorage(storage, max_bytes=cache_bytes, ttl=config.get_float("CACHE_TTL", 30.0)))
+
+
 def get_vault_storage() -> Generator[VaultStorage]:
-    """Get whatever impl we usin"""
-    storage_impl = FileStorage()
+    """Get whatever impl we usin
+
+    Picked with `PASSWORD_JAM_STORAGE` (file, sqlite, log, object) and `PASSWORD_JAM_STORAGE_PATH`.
+    """
+    storage_impl = _cached_storage_for(
+        config.get_str("STORAGE", "file"), config.get_str("STORAGE_PATH", DEFAULT_BASE_PATH)
+    )
     yield storage_impl
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+# none: leave it to the OS, a crash can lose recent saves (but never tears one, we still rename whole files in)
+# fsync-per-write: every write syncs its file and directory before returning
+# group-commit: writes landing within a short window share the syncs, each still returns only once durable
+DURABILITY_MODES = ("none", "fsync-per-write", "group-commit")
+
+
+def fsync_path(path: Path) -> None:
+    """fsync a file or directory by path"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _Pending:
+    def __init__(self, tmp: Path, target: Path):
+        self.tmp = tmp
+        self.target = target
+        self.done = threading.Event()
+        self.error: BaseException | None = None
+
+
+class GroupCommitter:
+    """Batch up "rename this temp file over that target, durably" requests from many writer threads.
+
+    The first writer to arrive becomes the leader: it waits for the previous batch to hit the disk
+    (plus up to `window` seconds more if that batch had company) while others pile in, then fsyncs
+    every temp file in the batch, renames them all into place and fsyncs each directory involved once.
+    Everyone in the batch is released together. Failures are per writer: one whose fsync or rename
+    failed (or whose directory didn't sync) gets that exception, the rest of the batch still succeeds.
+    A lone writer doesn't sit out the window. Callers keep holding their vault lock while they wait, so the rename still
+    happens under it.
+    """
+
+    def __init__(self, window: float = 0.002, max_batch: int = 256):
+        self._window = window
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._full = threading.Condition(self._lock)
+        self._flushing = threading.Lock()
+        self._pending: list[_Pending] = []
+        self._leading = False
+        self._last_batch = 0
+
+    def commit(self, tmp: Path, target: Path) -> None:
+        """Durably replace `target` with the already written `tmp`, blocking until the batch is on disk"""
+        item = _Pending(tmp, target)
+        with self._lock:
+            self._pending.append(item)
+            lead = not self._leading
+            if lead:
+                self._leading = True
+            elif len(self._pending) >= self._max_batch:
+                self._full.notify()
+        if lead:
+            self._lead()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+
+    def _lead(self) -> None:
+        # one batch syncing at a time, the next one fills up in the meantime
+        with self._flushing:
+            with self._lock:
+                if self._last_batch > 1:
+                    deadline = time.monotonic() + self._window
+                    while len(self._pending) < self._max_batch and (remaining := deadline - time.monotonic()) > 0:
+                        self._full.wait(remaining)
+                batch, self._pending = self._pending, []
+                self._leading = False
+                self._last_batch = len(batch)
+            try:
+                self._flush(batch)
+            except BaseException as e:
+                # _flush records what it can per writer, this is only for it dying part way through
+                for item in batch:
+                    item.error = item.error or e
+            finally:
+                for item in batch:
+                    item.done.set()
+
+    @staticmethod
+    def _flush(batch: list[_Pending]) -> None:
+        """Sync and rename every item of the batch, leaving each one's own failure in its `error`"""
+        for item in batch:
+            try:
+                fsync_path(item.tmp)
+            except Exception as e:
+                item.error = e
+        renamed: dict[Path, list[_Pending]] = {}
+        for item in batch:
+            if item.error is not None:
+                continue
+            try:
+                os.replace(item.tmp, item.target)
+            except Exception as e:
+                item.error = e
+            else:
+                renamed.setdefault(item.target.parent, []).append(item)
+        for directory, items in renamed.items():
+            try:
+                fsync_path(directory)
+            except Exception as e:
+                for item in items:
+                    item.error = e
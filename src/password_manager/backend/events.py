@@ -0,0 +1,111 @@
+import asyncio
+import contextlib
+from collections.abc import Awaitable, Callable, Iterator
+from typing import NamedTuple
+
+from password_manager.backend.database import VaultValidator
+from password_manager.util.metrics import Counter
+
+
+class VaultEvent(NamedTuple):
+    """A vault changed. `validator` is what it's at now, None once it's been deleted"""
+
+    vault_id: str
+    validator: VaultValidator | None
+
+
+class Subscription:
+    """One listener's mailbox, holding only the newest event.
+
+    A listener that falls behind (a slow client, a full socket) skips straight to the latest version
+    rather than anything queueing up for it, which is all a client that's going to reload anyway needs.
+    Small on purpose, there can be thousands of these sitting idle.
+    """
+
+    __slots__ = ("_latest", "_loop", "_ready", "vault_id")
+
+    def __init__(self, vault_id: str):
+        self.vault_id = vault_id
+        self._latest: VaultEvent | None = None
+        self._ready = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+    def put(self, event: VaultEvent) -> bool:
+        """Hand over an event, returning False if it replaced one the listener hadn't picked up yet"""
+        fresh = self._latest is None
+        self._latest = event
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._ready.set()
+        else:
+            # asyncio.Event isn't thread safe, wake it up from its own loop
+            self._loop.call_soon_threadsafe(self._ready.set)
+        return fresh
+
+    async def get(self) -> VaultEvent:
+        """Wait for the next event"""
+        while self._latest is None:
+            self._ready.clear()
+            await self._ready.wait()
+        event, self._latest = self._latest, None
+        return event
+
+
+class VaultEvents:
+    """In-process fan out of vault changes to whoever is listening for that vault.
+
+    Storage publishes after every successful create, write and delete, listeners `subscribe` per vault.
+    Publishing only touches the subscribers of the vault that changed and never waits on any of them.
+    Only sees changes made through this process, anyone who cares about other processes has to check
+    the vault now and then too, through `poll` so a vault's listeners share the one check.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._polls: dict[str, tuple[float, asyncio.Task[VaultValidator | None]]] = {}
+        self._count = 0
+        self.published = Counter("vault_events_published", "vault changes published")
+        self.coalesced = Counter("vault_events_coalesced", "events a slow listener skipped over")
+
+    @contextlib.contextmanager
+    def subscribe(self, vault_id: str) -> Iterator[Subscription]:
+        """Listen for changes to the vault for the duration of the block"""
+        subscription = Subscription(vault_id)
+        self._subscribers.setdefault(vault_id, set()).add(subscription)
+        self._count += 1
+        try:
+            yield subscription
+        finally:
+            self._count -= 1
+            subscribers = self._subscribers[vault_id]
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[vault_id]
+                self._polls.pop(vault_id, None)
+
+    def publish(self, vault_id: str, validator: VaultValidator | None) -> None:
+        """Tell the vault's listeners what it's at now, or that it's gone with None"""
+        self.published.inc()
+        event = VaultEvent(vault_id, validator)
+        for subscription in tuple(self._subscribers.get(vault_id, ())):
+            if not subscription.put(event):
+                self.coalesced.inc()
+
+    async def poll(
+        self, vault_id: str, check: Callable[[], Awaitable[VaultValidator | None]], max_age: float
+    ) -> VaultValidator | None:
+        """What `check` says the vault is at, asked at most once every `max_age` seconds however many of its
+        listeners want to know, the rest get the answer of the check before (or still in flight)"""
+        loop = asyncio.get_running_loop()
+        last = self._polls.get(vault_id)
+        if last is None or last[1].get_loop() is not loop or loop.time() - last[0] >= max_age:
+            last = self._polls[vault_id] = (loop.time(), loop.create_task(check()))
+        # one listener going away mustn't cancel the check the others are waiting on
+        return await asyncio.shield(last[1])
+
+    @property
+    def subscribers(self) -> int:
+        return self._count
@@ -0,0 +1,124 @@
+"""A tiny in-process stand-in for an S3 compatible object store.
+
+Good enough to test and benchmark `ObjectStorage` offline: path style `/{bucket}/{key}` objects with
+GET/HEAD/PUT/DELETE, `x-amz-meta-*` metadata, conditional PUTs via `If-Match`/`If-None-Match`, and
+single `bytes=a-b` ranges on GET.
+Everything lives in memory and is gone when the server stops.
+"""
+
+import hashlib
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Self
+
+META_PREFIX = "x-amz-meta-"
+
+
+class _Object:
+    def __init__(self, body: bytes, metadata: dict[str, str]):
+        self.body = body
+        self.metadata = metadata
+        # md5 etags, like the real thing
+        self.etag = f'"{hashlib.md5(body).hexdigest()}"'  # noqa: S324
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client side pooling actually matters
+    # send headers and body in one go, otherwise nagle + delayed acks add 40ms to every GET
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    server: "_Server"
+
+    def do_GET(self) -> None:
+        self._get(send_body=True)
+
+    def do_HEAD(self) -> None:
+        self._get(send_body=False)
+
+    def do_PUT(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        metadata = {k.lower(): v for k, v in self.headers.items() if k.lower().startswith(META_PREFIX)}
+        with self.server.lock:
+            current = self.server.objects.get(self.path)
+            if_match = self.headers.get("If-Match")
+            if_none_match = self.headers.get("If-None-Match")
+            if (if_none_match == "*" and current is not None) or (
+                if_match is not None and (current is None or current.etag != if_match)
+            ):
+                self._reply(HTTPStatus.PRECONDITION_FAILED)
+                return
+            obj = _Object(body, metadata)
+            self.server.objects[self.path] = obj
+        self._reply(HTTPStatus.OK, {"ETag": obj.etag})
+
+    def do_DELETE(self) -> None:
+        with self.server.lock:
+            self.server.objects.pop(self.path, None)
+        self._reply(HTTPStatus.NO_CONTENT)
+
+    def _get(self, send_body: bool) -> None:
+        obj = self.server.objects.get(self.path)
+        if obj is None:
+            self._reply(HTTPStatus.NOT_FOUND)
+            return
+        headers = {"ETag": obj.etag, **obj.metadata}
+        unit, _, span = self.headers.get("Range", "").partition("=")
+        if unit == "bytes" and obj.body:
+            start, _, end = span.partition("-")
+            first = int(start)
+            last = min(int(end) if end else len(obj.body) - 1, len(obj.body) - 1)
+            headers["Content-Range"] = f"bytes {first}-{last}/{len(obj.body)}"
+            self._reply(HTTPStatus.PARTIAL_CONTENT, headers, obj.body[first : last + 1], send_body=send_body)
+            return
+        self._reply(HTTPStatus.OK, headers, obj.body, send_body=send_body)
+
+    def _reply(
+        self, status: HTTPStatus, headers: dict[str, str] | None = None, body: bytes = b"", send_body: bool = True
+    ) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body and body:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        pass  # far too chatty for tests and benchmarks
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.objects: dict[str, _Object] = {}
+        self.lock = threading.Lock()
+
+
+class FakeObjectServer:
+    """Run the fake object store on a free localhost port, use as a context manager or start()/stop()"""
+
+    def __init__(self):
+        self._server = _Server()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> Self:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *exc: object) -> None:
+        self.stop()
@@ -0,0 +1,141 @@
+import time
+from collections.abc import Callable, Hashable
+
+from password_manager.backend.database import (
+    ServerSideVault,
+    VaultRevision,
+    VaultStorage,
+    VaultStream,
+    VaultUpload,
+    VaultValidator,
+)
+from password_manager.backend.metadata_index import VaultPage
+from password_manager.util.metrics import BYTE_BUCKETS, REGISTRY
+
+OPERATIONS = (
+    "read",
+    "write",
+    "create",
+    "exists",
+    "delete",
+    "get_secret",
+    "fingerprint",
+    "validator",
+    "open_stream",
+    "open_upload",
+    "save_upload",
+    "exists_many",
+    "read_many",
+    "create_many",
+    "list_vaults",
+    "revisions",
+    "read_revision",
+)
+
+# the operations that move a blob, and so get their sizes recorded
+_SIZED = ("read", "write", "open_stream", "save_upload", "read_many", "read_revision")
+
+
+class InstrumentedStorage(VaultStorage):
+    """Times every call into any VaultStorage, and records the sizes of the blobs it moved and the errors it raised.
+
+    Latencies go to `vault_storage_seconds`, blob sizes to `vault_storage_bytes` and failures to
+    `vault_storage_errors`, labelled by operation (and exception type), all shared by every instance.
+    Anything else, `close` or a backend's own extras, goes straight to `inner`.
+    """
+
+    def __init__(self, inner: VaultStorage):
+        self.inner = inner
+        # looked up once, the hot path only observes
+        self._seconds = {
+            op: REGISTRY.histogram("vault_storage_seconds", "time spent in storage calls", op=op) for op in OPERATIONS
+        }
+        self._bytes = {
+            op: REGISTRY.histogram(
+                "vault_storage_bytes", "size of the blobs storage calls moved", buckets=BYTE_BUCKETS, op=op
+            )
+            for op in _SIZED
+        }
+
+    def read(self, vault_id: str) -> ServerSideVault:
+        vault = self._timed("read", self.inner.read, vault_id)
+        self._bytes["read"].observe(len(vault.vault_data))
+        return vault
+
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        version = self._timed("write", self.inner.write, vault_id, data, expected_version)
+        self._bytes["write"].observe(len(data))
+        return version
+
+    def create(self, vault_id: str) -> ServerSideVault:
+        return self._timed("create", self.inner.create, vault_id)
+
+    def exists(self, vault_id: str) -> bool:
+        return self._timed("exists", self.inner.exists, vault_id)
+
+    def delete(self, vault_id: str) -> None:
+        self._timed("delete", self.inner.delete, vault_id)
+
+    def get_secret(self, vault_id: str) -> str:
+        return self._timed("get_secret", self.inner.get_secret, vault_id)
+
+    def fingerprint(self, vault_id: str) -> Hashable | None:
+        return self._timed("fingerprint", self.inner.fingerprint, vault_id)
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        return self._timed("validator", self.inner.validator, vault_id)
+
+    def open_stream(self, vault_id: str) -> VaultStream:
+        stream = self._timed("open_stream", self.inner.open_stream, vault_id)
+        self._bytes["open_stream"].observe(stream.size)
+        return stream
+
+    def open_upload(self, vault_id: str, max_size: int) -> VaultUpload:
+        return self._timed("open_upload", self.inner.open_upload, vault_id, max_size)
+
+    def save_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int:
+        version = self._timed("save_upload", self.inner.save_upload, upload, expected_version)
+        self._bytes["save_upload"].observe(upload.size)
+        return version
+
+    def exists_many(self, vault_ids: list[str]) -> list[tuple[str, bool | Exception]]:
+        return self._timed("exists_many", self.inner.exists_many, vault_ids)
+
+    def read_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        results = self._timed("read_many", self.inner.read_many, vault_ids)
+        for _, result in results:
+            if isinstance(result, ServerSideVault):
+                self._bytes["read_many"].observe(len(result.vault_data))
+        return results
+
+    def create_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        return self._timed("create_many", self.inner.create_many, vault_ids)
+
+    def list_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage:
+        return self._timed("list_vaults", self.inner.list_vaults, cursor, limit, updated_since)
+
+    def revisions(self, vault_id: str) -> list[VaultRevision]:
+        return self._timed("revisions", self.inner.revisions, vault_id)
+
+    def read_revision(self, vault_id: str, revision: int) -> bytes:
+        data = self._timed("read_revision", self.inner.read_revision, vault_id, revision)
+        self._bytes["read_revision"].observe(len(data))
+        return data
+
+    def __getattr__(self, name: str) -> object:
+        # only called for what isn't found here, so `inner` itself must already be set
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def _timed[T](self, op: str, fn: Callable[..., T], *args: object) -> T:
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception as e:
+            REGISTRY.counter("vault_storage_errors", "storage calls that raised", op=op, error=type(e).__name__).inc()
+            raise
+        finally:
+            self._seconds[op].observe(time.perf_counter() - start)
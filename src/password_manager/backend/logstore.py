@@ -0,0 +1,419 @@
+import logging
+import os
+import secrets
+import struct
+import threading
+import zlib
+from collections.abc import Hashable
+from pathlib import Path
+from typing import NamedTuple
+
+from cryptography.exceptions import InvalidSignature
+from filelock import FileLock
+
+from password_manager.backend.database import (
+    BLOB_HEADER,
+    DEFAULT_BASE_PATH,
+    FileVaultStream,
+    ServerSideVault,
+    VaultStorage,
+    VaultStream,
+    VaultValidator,
+    pack_blob,
+    unpack_blob,
+)
+from password_manager.util.crypto import SIGNATURE_SIZE, sign_data, validate_signature
+from password_manager.util.exceptions import (
+    VaultConflictError,
+    VaultExistsError,
+    VaultReadError,
+    VaultSaveError,
+    VaultValidationError,
+)
+
+logger = logging.getLogger()
+
+PUT = 1
+TOMBSTONE = 2
+
+# [crc32][kind][key_len][secret_len][value_len] then key, secret, value. crc covers everything after itself
+RECORD_HEADER = struct.Struct(">IBHHI")
+# [kind][key_len][secret_len][value_pos][value_len][record_len] then key, secret
+HINT_HEADER = struct.Struct(">BHHQII")
+
+type SegmentId = tuple[int, int]
+
+
+class Segment:
+    """One append-only data file. Readers hold a reference while they pread, so the fd outlives a merge."""
+
+    def __init__(self, segment_id: SegmentId, path: Path):
+        self.id = segment_id
+        self.path = path
+        self.size = path.stat().st_size
+        self.dead = 0  # bytes belonging to superseded or deleted records
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def pread(self, offset: int, length: int) -> bytes:
+        return os.pread(self._fd, length, offset)
+
+    @property
+    def fd(self) -> int:
+        return self._fd
+
+    @property
+    def hint_path(self) -> Path:
+        return self.path.with_suffix(".hint")
+
+    def __del__(self):
+        os.close(self._fd)
+
+
+class Entry(NamedTuple):
+    """A record as described by a hint file, or found while scanning a segment"""
+
+    kind: int
+    vault_id: str
+    secret: str
+    value_pos: int
+    value_len: int
+    record_len: int
+
+
+class KeyDirEntry(NamedTuple):
+    """Where the latest version of a vault lives"""
+
+    segment: Segment
+    offset: int
+    length: int
+    record_len: int
+    secret: str
+
+
+def _segment_name(segment_id: SegmentId) -> str:
+    return f"{segment_id[0]:012d}.{segment_id[1]:04d}.data"
+
+
+def _parse_segment_name(path: Path) -> SegmentId:
+    seq, sub, _ = path.name.split(".")
+    return int(seq), int(sub)
+
+
+def _encode_record(kind: int, vault_id: str, secret: str, value: bytes) -> bytes:
+    key = vault_id.encode("utf-8")
+    secret_bytes = secret.encode("utf-8")
+    body = RECORD_HEADER.pack(0, kind, len(key), len(secret_bytes), len(value))[4:] + key + secret_bytes + value
+    return struct.pack(">I", zlib.crc32(body)) + body
+
+
+class LogStorage(VaultStorage):
+    """Bitcask style storage: every write is appended to a segment file, never rewritten in place.
+
+    An in-memory keydir maps each vault to the position of its latest record, so a read is one
+    positioned read. Closed segments get a hint file (the keydir entries without the values) so
+    startup doesn't have to scan every vault blob, and a background merge rewrites the closed
+    segments with only their live records to reclaim space from old vault versions.
+
+    Only one process may open a store at a time, this is enforced with a lock file. Values are stored
+    with the same version header as FileStorage blobs.
+    """
+
+    def __init__(
+        self,
+        base_path: str = DEFAULT_BASE_PATH,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        merge_interval: float = 60.0,
+        merge_threshold: float = 0.5,
+    ):
+        self._base = Path(base_path).expanduser() / "vaults.log"
+        self._base.mkdir(parents=True, exist_ok=True)
+        self._max_segment_bytes = max_segment_bytes
+        self._merge_threshold = merge_threshold
+        self._process_lock = FileLock(self._base / "LOCK")
+        self._process_lock.acquire(timeout=0)
+
+        self._lock = threading.Lock()  # guards the keydir, segments and appends
+        self._merge_lock = threading.Lock()
+        self._keydir: dict[str, KeyDirEntry] = {}
+        self._segments: dict[SegmentId, Segment] = {}
+        self._active_hints: list[Entry] = []
+        self._load()
+
+        self._closed = threading.Event()
+        self._merger = None
+        if merge_interval > 0:
+            self._merger = threading.Thread(target=self._merge_loop, args=(merge_interval,), daemon=True)
+            self._merger.start()
+
+    def read(self, vault_id: str) -> ServerSideVault:
+        """Return the vault, or raise"""
+        with self._lock:
+            entry = self._keydir.get(vault_id)
+        if entry is None:
+            logger.info("Vault '%s' was not found", vault_id)
+            raise VaultReadError("Vault does not exist")
+        version, data = unpack_blob(entry.segment.pread(entry.offset, entry.length))
+        return ServerSideVault(vault_id=vault_id, vault_data=data, vault_secret=entry.secret, version=version)
+
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        """Append the new version of the vault, or raise. The signature is checked before taking the lock"""
+        secret = self.get_secret(vault_id)
+        try:
+            validate_signature(data, secret.encode("utf-8"))
+        except InvalidSignature as e:
+            logger.error("Vault '%s' had an invalid signature when attempting to write", vault_id)
+            raise VaultValidationError("Invalid siganture") from e
+        with self._lock:
+            entry = self._keydir.get(vault_id)
+            if entry is None:
+                raise VaultReadError("Vault does not exist, cannot write")
+            if entry.secret != secret:
+                raise VaultConflictError("Vault was recreated while saving")
+            current = unpack_blob(entry.segment.pread(entry.offset, min(entry.length, BLOB_HEADER.size)))[0]
+            if expected_version is not None and current != expected_version:
+                raise VaultConflictError(f"Vault is at version {current}, not {expected_version}")
+            self._append(PUT, vault_id, secret, pack_blob(current + 1, data))
+        return current + 1
+
+    def create(self, vault_id: str) -> ServerSideVault:
+        """new vault, will generate a new secret"""
+        secret = secrets.token_hex(32)
+        with self._lock:
+            if vault_id in self._keydir:
+                raise VaultExistsError("Unable to create vault, already exists")
+            # sign 'nothing' so we can validate 'nothing', same as FileStorage
+            self._append(PUT, vault_id, secret, pack_blob(1, sign_data(b"", secret.encode("utf-8"))))
+        return ServerSideVault(vault_id=vault_id, vault_data=b"", vault_secret=secret, version=1)
+
+    def exists(self, vault_id: str) -> bool:
+        """if the vault exists"""
+        return vault_id in self._keydir
+
+    def delete(self, vault_id: str) -> None:
+        with self._lock:
+            if vault_id in self._keydir:
+                self._append(TOMBSTONE, vault_id, "", b"")
+
+    def get_secret(self, vault_id: str) -> str:
+        """Secrets live in the keydir, no disk access at all"""
+        entry = self._keydir.get(vault_id)
+        if entry is None:
+            raise VaultReadError("Vault does not exist")
+        return entry.secret
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        """One small pread of the start of the value"""
+        entry = self._keydir.get(vault_id)
+        if entry is None:
+            raise VaultReadError("Vault does not exist")
+        version, head = unpack_blob(
+            entry.segment.pread(entry.offset, min(entry.length, BLOB_HEADER.size + SIGNATURE_SIZE))
+        )
+        return VaultValidator(version, head[:SIGNATURE_SIZE])
+
+    def open_stream(self, vault_id: str) -> VaultStream:
+        """Positioned reads of the record's value, on our own dup of the segment fd so a merge can't pull it away"""
+        with self._lock:
+            entry = self._keydir.get(vault_id)
+            if entry is None:
+                logger.info("Vault '%s' was not found", vault_id)
+                raise VaultReadError("Vault does not exist")
+            fd = os.dup(entry.segment.fd)
+        try:
+            raw = os.pread(fd, min(entry.length, BLOB_HEADER.size + SIGNATURE_SIZE), entry.offset)
+            version, head = unpack_blob(raw)
+            header = len(raw) - len(head)
+            validator = VaultValidator(version, head[:SIGNATURE_SIZE])
+            return FileVaultStream(fd, entry.offset + header, entry.length - header, validator)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    def fingerprint(self, vault_id: str) -> Hashable | None:
+        """Where the latest record is, every write appends a new one"""
+        entry = self._keydir.get(vault_id)
+        return None if entry is None else (entry.segment.id, entry.offset)
+
+    def merge(self) -> None:
+        """Rewrite all closed segments into new ones holding only live records, then drop the old ones.
+
+        Writers keep appending to the active segment the whole time, the lock is only held to take a
+        snapshot of the keydir and to swap the merged locations in.
+        """
+        with self._merge_lock:
+            with self._lock:
+                inputs = [s for s in self._segments.values() if s is not self._active]
+                if not inputs:
+                    return
+                input_ids = {s.id for s in inputs}
+                live = {k: e for k, e in self._keydir.items() if e.segment.id in input_ids}
+
+            # merged output sorts after every input but before the active segment, so replay order holds
+            last = max(input_ids)
+            out_id = (last[0], last[1] + 1)
+            out_path = self._base / _segment_name(out_id)
+            tmp_path = out_path.with_suffix(".merging")
+            moved: dict[str, tuple[KeyDirEntry, Entry]] = {}
+            if live:
+                pos = 0
+                with Path.open(tmp_path, "wb") as f:
+                    for vault_id, old in live.items():
+                        record = _encode_record(PUT, vault_id, old.secret, old.segment.pread(old.offset, old.length))
+                        f.write(record)
+                        new = Entry(PUT, vault_id, old.secret, pos + len(record) - old.length, old.length, len(record))
+                        moved[vault_id] = (old, new)
+                        pos += len(record)
+                    f.flush()
+                    os.fsync(f.fileno())
+                hints = [new for _, new in moved.values()]
+                self._write_hints(out_path.with_suffix(".hint"), hints)
+                os.replace(tmp_path, out_path)
+
+            with self._lock:
+                if moved:
+                    segment = Segment(out_id, out_path)
+                    for vault_id, (old, new) in moved.items():
+                        if self._keydir.get(vault_id) is old:
+                            self._keydir[vault_id] = self._keydir_entry(segment, new)
+                        else:
+                            # superseded while we were merging
+                            segment.dead += new.record_len
+                    self._segments[out_id] = segment
+                for segment in inputs:
+                    del self._segments[segment.id]
+                self._segments = dict(sorted(self._segments.items()))
+            for segment in inputs:
+                segment.path.unlink(missing_ok=True)
+                segment.hint_path.unlink(missing_ok=True)
+            logger.info("Merged %d log segments", len(inputs))
+
+    def close(self) -> None:
+        """Stop merging, seal the active segment's hints and release the store"""
+        self._closed.set()
+        if self._merger:
+            self._merger.join()
+        with self._lock:
+            self._write_hints(self._active.hint_path, self._active_hints)
+            self._writer.close()
+        self._process_lock.release()
+
+    def _merge_loop(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            try:
+                if self._should_merge():
+                    self.merge()
+            except Exception as e:
+                logger.error("Log segment merge failed: %s", e)
+
+    def _should_merge(self) -> bool:
+        with self._lock:
+            inputs = [s for s in self._segments.values() if s is not self._active]
+        size = sum(s.size for s in inputs)
+        return size > 0 and sum(s.dead for s in inputs) / size >= self._merge_threshold
+
+    def _append(self, kind: int, vault_id: str, secret: str, value: bytes) -> None:
+        """Append a record to the active segment and point the keydir at it, caller holds self._lock"""
+        record = _encode_record(kind, vault_id, secret, value)
+        pos = self._active.size
+        self._writer.write(record)
+        self._active.size += len(record)
+        entry = Entry(kind, vault_id, secret, pos + len(record) - len(value), len(value), len(record))
+        self._active_hints.append(entry)
+        self._apply(self._active, entry)
+        if self._active.size >= self._max_segment_bytes:
+            self._rotate()
+
+    def _apply(self, segment: Segment, entry: Entry) -> None:
+        old = self._keydir.pop(entry.vault_id, None)
+        if old is not None:
+            old.segment.dead += old.record_len
+        if entry.kind == PUT:
+            self._keydir[entry.vault_id] = self._keydir_entry(segment, entry)
+        else:
+            segment.dead += entry.record_len
+
+    def _keydir_entry(self, segment: Segment, entry: Entry) -> KeyDirEntry:
+        return KeyDirEntry(segment, entry.value_pos, entry.value_len, entry.record_len, entry.secret)
+
+    def _rotate(self) -> None:
+        """Seal the active segment with a hint file and start a new one"""
+        self._write_hints(self._active.hint_path, self._active_hints)
+        self._writer.close()
+        self._open_active((self._active.id[0] + 1, 0))
+
+    def _open_active(self, segment_id: SegmentId) -> None:
+        path = self._base / _segment_name(segment_id)
+        self._writer = Path.open(path, "ab", buffering=0)
+        self._active = Segment(segment_id, path)
+        self._active_hints = []
+        self._segments[segment_id] = self._active
+
+    def _load(self) -> None:
+        """Rebuild the keydir, from hint files where we have them and by scanning segments otherwise"""
+        for leftover in self._base.glob("*.merging"):
+            leftover.unlink()
+        paths = sorted(self._base.glob("*.data"), key=_parse_segment_name)
+        for i, path in enumerate(paths):
+            segment = Segment(_parse_segment_name(path), path)
+            self._segments[segment.id] = segment
+            is_last = i == len(paths) - 1
+            if segment.hint_path.exists() and not is_last:
+                entries = self._read_hints(segment.hint_path)
+            else:
+                entries = self._scan(segment)
+            for entry in entries:
+                self._apply(segment, entry)
+            if is_last:
+                # keep appending to the newest segment
+                self._writer = Path.open(path, "ab", buffering=0)
+                self._active = segment
+                self._active_hints = entries
+                segment.hint_path.unlink(missing_ok=True)
+        if not paths:
+            self._open_active((0, 0))
+
+    def _scan(self, segment: Segment) -> list[Entry]:
+        """Read every record in a segment, truncating a torn write at the tail"""
+        entries = []
+        with Path.open(segment.path, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(data):
+            crc, kind, key_len, secret_len, value_len = RECORD_HEADER.unpack_from(data, pos)
+            end = pos + RECORD_HEADER.size + key_len + secret_len + value_len
+            if end > len(data) or zlib.crc32(data[pos + 4 : end]) != crc:
+                break
+            key_start = pos + RECORD_HEADER.size
+            vault_id = data[key_start : key_start + key_len].decode("utf-8")
+            secret = data[key_start + key_len : key_start + key_len + secret_len].decode("utf-8")
+            entries.append(Entry(kind, vault_id, secret, end - value_len, value_len, end - pos))
+            pos = end
+        if pos != len(data):
+            logger.warning("Truncating %d corrupt bytes at the end of %s", len(data) - pos, segment.path)
+            os.truncate(segment.path, pos)
+            segment.size = pos
+        return entries
+
+    def _write_hints(self, path: Path, entries: list[Entry]) -> None:
+        tmp_path = path.with_suffix(".hint-tmp")
+        with Path.open(tmp_path, "wb") as f:
+            for e in entries:
+                key = e.vault_id.encode("utf-8")
+                secret = e.secret.encode("utf-8")
+                f.write(HINT_HEADER.pack(e.kind, len(key), len(secret), e.value_pos, e.value_len, e.record_len))
+                f.write(key + secret)
+        os.replace(tmp_path, path)
+
+    def _read_hints(self, path: Path) -> list[Entry]:
+        entries = []
+        with Path.open(path, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos < len(data):
+            kind, key_len, secret_len, value_pos, value_len, record_len = HINT_HEADER.unpack_from(data, pos)
+            pos += HINT_HEADER.size
+            vault_id = data[pos : pos + key_len].decode("utf-8")
+            secret = data[pos + key_len : pos + key_len + secret_len].decode("utf-8")
+            pos += key_len + secret_len
+            entries.append(Entry(kind, vault_id, secret, value_pos, value_len, record_len))
+        return entries
@@ -0,0 +1,135 @@
+import base64
+import sqlite3
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+from pydantic import BaseModel
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vault_metadata (
+    vault_id TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class VaultMetadata(BaseModel):
+    vault_id: str
+    size: int
+    version: int
+    created_at: float
+    updated_at: float
+
+
+class VaultPage(BaseModel):
+    vaults: list[VaultMetadata]
+    next_cursor: str | None
+
+
+def encode_cursor(vault_id: str) -> str:
+    """Cursors are opaque to clients, under the hood they're the last vault_id of the page"""
+    return base64.urlsafe_b64encode(vault_id.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> str:
+    """:raises: ValueError for anything encode_cursor didn't make"""
+    vault_id = base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode("utf-8")
+    if not vault_id:
+        raise ValueError("Empty cursor")
+    return vault_id
+
+
+def page_of(rows: list[VaultMetadata], limit: int) -> VaultPage:
+    """A page from up to limit + 1 rows, the extra one only there to tell whether there's more"""
+    rows, more = rows[:limit], len(rows) > limit
+    return VaultPage(vaults=rows, next_cursor=encode_cursor(rows[-1].vault_id) if more else None)
+
+
+class MetadataIndex:
+    """A sqlite table of every vault's size, version and timestamps, for backends that can't list cheaply.
+
+    Kept up to date by the storage on create, write and delete. It's only an index, the blobs stay the
+    truth, so a backend can always `rebuild` it from a scan.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.created = not path.exists()
+        self._conn().execute(SCHEMA)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS vault_metadata_updated ON vault_metadata (updated_at)")
+
+    def record(
+        self, vault_id: str, size: int, version: int, updated_at: float, created_at: float | None = None
+    ) -> None:
+        """Note a create (with `created_at`) or a write (without, keeping the created time we have)"""
+        self._conn().execute(
+            "INSERT INTO vault_metadata (vault_id, size, version, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (vault_id) DO UPDATE SET size = excluded.size, version = excluded.version,"
+            " updated_at = excluded.updated_at,"
+            " created_at = CASE WHEN ? IS NULL THEN created_at ELSE excluded.created_at END",
+            (vault_id, size, version, updated_at if created_at is None else created_at, updated_at, created_at),
+        )
+
+    def remove(self, vault_id: str) -> None:
+        self._conn().execute("DELETE FROM vault_metadata WHERE vault_id = ?", (vault_id,))
+
+    def rebuild(self, entries: Iterable[VaultMetadata]) -> int:
+        """Replace the whole index with `entries`, returning how many there were"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM vault_metadata")
+            count = 0
+            for entry in entries:
+                conn.execute(
+                    "INSERT OR REPLACE INTO vault_metadata VALUES (?, ?, ?, ?, ?)",
+                    (entry.vault_id, entry.size, entry.version, entry.created_at, entry.updated_at),
+                )
+                count += 1
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return count
+
+    def page(self, after: str | None = None, limit: int = 100, updated_since: float | None = None) -> VaultPage:
+        """Vaults in id order, starting after the `after` id"""
+        rows = self._conn().execute(
+            "SELECT vault_id, size, version, created_at, updated_at FROM vault_metadata"
+            " WHERE (? IS NULL OR vault_id > ?) AND (? IS NULL OR updated_at >= ?) ORDER BY vault_id LIMIT ?",
+            (after, after, updated_since, updated_since, limit + 1),
+        )
+        return page_of(
+            [
+                VaultMetadata(vault_id=row[0], size=row[1], version=row[2], created_at=row[3], updated_at=row[4])
+                for row in rows
+            ],
+            limit,
+        )
+
+    def close(self) -> None:
+        """Close every connection we have handed out"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """The connection for the current thread, same setup as SqliteStorage"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, isolation_level=None, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
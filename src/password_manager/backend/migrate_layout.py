@@ -0,0 +1,51 @@
+"""Move a flat FileStorage into the sharded layout, online.
+
+Switch the server to `PASSWORD_JAM_STORAGE_LAYOUT=sharded` first (a sharded store still serves vaults
+that are in the flat layout), then run
+
+    uv run python -m password_manager.backend.migrate_layout [base_path]
+
+Vaults are moved one at a time under their own lock, so the server keeps serving throughout. Don't run
+servers in the flat layout at the same time, they lock a different file. Safe to re-run if interrupted.
+"""
+
+import argparse
+import logging
+from collections.abc import Iterator
+
+from password_manager.backend.database import DEFAULT_BASE_PATH, FileStorage
+from password_manager.util import config
+
+logger = logging.getLogger()
+
+
+def flat_vault_ids(storage: FileStorage) -> Iterator[str]:
+    """The ids of vaults still sitting directly in the base dir"""
+    for secret in storage._base.glob("*.secret"):
+        # the blob next to its secret, any other file in there isn't a vault
+        if secret.with_suffix("").is_file():
+            yield secret.stem
+
+
+def migrate_to_sharded(base_path: str) -> int:
+    """Migrate every flat vault under `base_path`, returning how many moved"""
+    storage = FileStorage(base_path, layout="sharded")
+    moved = 0
+    for vault_id in flat_vault_ids(storage):
+        if storage.migrate_to_shard(vault_id):
+            moved += 1
+            if moved % 1000 == 0:
+                logger.info("Migrated %d vaults so far", moved)
+    return moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base_path", nargs="?", default=config.get_str("STORAGE_PATH", DEFAULT_BASE_PATH))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(f"Migrated {migrate_to_sharded(args.base_path)} vaults into the sharded layout")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+import asyncio
+import http.client
+import logging
+import queue
+import random
+import secrets
+import tempfile
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from typing import NamedTuple
+from urllib.parse import quote, urlsplit
+
+from cryptography.exceptions import InvalidSignature
+
+from password_manager.backend.async_storage import AsyncVaultStorage
+from password_manager.backend.database import (
+    BytesVaultStream,
+    ServerSideVault,
+    VaultRevision,
+    VaultStorage,
+    VaultStream,
+    VaultUpload,
+    VaultValidator,
+)
+from password_manager.backend.events import VaultEvents
+from password_manager.backend.metadata_index import VaultPage
+from password_manager.util import config
+from password_manager.util.crypto import SIGNATURE_SIZE, sign_data, validate_signature
+from password_manager.util.exceptions import (
+    VaultConflictError,
+    VaultExistsError,
+    VaultReadError,
+    VaultSaveError,
+    VaultValidationError,
+)
+
+logger = logging.getLogger()
+
+SECRET_HEADER = "x-amz-meta-vault-secret"
+VERSION_HEADER = "x-amz-meta-vault-version"
+# uploads bigger than this spill from memory to a temp file while they come in
+UPLOAD_SPOOL_BYTES = 1024 * 1024
+
+
+class ObjectResponse(NamedTuple):
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+
+
+def object_store_settings() -> dict[str, object]:
+    """ObjectStorage/AsyncObjectStorage arguments from the PASSWORD_JAM_OBJECT_STORE_* settings"""
+    return {
+        "endpoint": config.get_str("OBJECT_STORE_URL", "http://127.0.0.1:9000"),
+        "bucket": config.get_str("OBJECT_STORE_BUCKET", "vaults"),
+        "token": config.get_str("OBJECT_STORE_TOKEN", "") or None,
+    }
+
+
+def _backoff(attempt: int) -> float:
+    """Full jitter exponential backoff between conditional write retries"""
+    return random.uniform(0, min(0.5, 0.005 * 2**attempt))  # noqa: S311
+
+
+def _check(response: ObjectResponse, vault_id: str) -> None:
+    if response.status >= 300:
+        logger.error("Object store answered %d for vault '%s'", response.status, vault_id)
+        raise VaultSaveError(f"Object store error {response.status}")
+
+
+def _version(response: ObjectResponse) -> int:
+    """Objects written before vaults had versions don't carry one"""
+    return int(response.headers.get(VERSION_HEADER, 0))
+
+
+def _check_version(head: ObjectResponse, expected_version: int | None) -> int:
+    current = _version(head)
+    if expected_version is not None and current != expected_version:
+        raise VaultConflictError(f"Vault is at version {current}, not {expected_version}")
+    return current
+
+
+# just the signature at the front of the blob, the version comes back as metadata
+VALIDATOR_RANGE = {"Range": f"bytes=0-{SIGNATURE_SIZE - 1}"}
+
+
+def _validator(response: ObjectResponse, vault_id: str) -> VaultValidator:
+    if response.status == http.client.NOT_FOUND:
+        raise VaultReadError("Vault does not exist")
+    _check(response, vault_id)
+    # a store that ignores Range sends the whole thing, which is slower but still right
+    return VaultValidator(_version(response), response.body[:SIGNATURE_SIZE])
+
+
+def _validate(vault_id: str, data: bytes, secret: str) -> None:
+    try:
+        validate_signature(data, secret.encode("utf-8"))
+    except InvalidSignature as e:
+        logger.error("Vault '%s' had an invalid signature when attempting to write", vault_id)
+        raise VaultValidationError("Invalid siganture") from e
+
+
+class ObjectStorage(VaultStorage):
+    """Store each vault as one object in an S3 compatible store, so any number of API nodes can share it.
+
+    The vault secret and version ride along as object metadata. There are no locks: a write checks the
+    signature and version against what it just fetched, then only lands if the object still has the etag
+    it was fetched with (a conditional PUT), and creation uses `If-None-Match: *` so only one creator can win.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str = "vaults",
+        pool_size: int = 16,
+        timeout: float = 10.0,
+        token: str | None = None,
+        max_retries: int = 10,
+    ):
+        url = urlsplit(endpoint)
+        self._https = url.scheme == "https"
+        self._host = url.hostname
+        self._port = url.port
+        self._prefix = f"{url.path.rstrip('/')}/{quote(bucket, safe='')}/"
+        self._timeout = timeout
+        self._token = token
+        self._max_retries = max_retries
+        self._pool: queue.LifoQueue[http.client.HTTPConnection] = queue.LifoQueue(maxsize=pool_size)
+
+    def read(self, vault_id: str) -> ServerSideVault:
+        """Return the vault, or raise"""
+        response = self._request("GET", vault_id)
+        if response.status == http.client.NOT_FOUND:
+            logger.info("Vault '%s' was not found", vault_id)
+            raise VaultReadError("Vault does not exist")
+        _check(response, vault_id)
+        return ServerSideVault(
+            vault_id=vault_id,
+            vault_data=response.body,
+            vault_secret=response.headers[SECRET_HEADER],
+            version=_version(response),
+        )
+
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        """Write the vault, or raise"""
+        for attempt in range(self._max_retries):
+            if attempt:
+                time.sleep(_backoff(attempt))
+            head = self._request("HEAD", vault_id)
+            if head.status == http.client.NOT_FOUND:
+                raise VaultReadError("Vault does not exist, cannot write")
+            _check(head, vault_id)
+            version = _check_version(head, expected_version) + 1
+            secret = head.headers[SECRET_HEADER]
+            _validate(vault_id, data, secret)
+            headers = {"If-Match": head.headers["ETag"], SECRET_HEADER: secret, VERSION_HEADER: str(version)}
+            response = self._request("PUT", vault_id, data, headers)
+            if response.status != http.client.PRECONDITION_FAILED:
+                _check(response, vault_id)
+                return version
+            # someone else wrote in between, check the secret and version again and have another go
+            logger.debug("Conditional write of vault '%s' lost a race, retrying", vault_id)
+        raise VaultSaveError("Unable to write vault, too much contention")
+
+    def create(self, vault_id: str) -> ServerSideVault:
+        """new vault, will generate a new secret"""
+        secret = secrets.token_hex(32)
+        # sign 'nothing' so we can validate 'nothing', same as FileStorage
+        response = self._request(
+            "PUT",
+            vault_id,
+            sign_data(b"", secret.encode("utf-8")),
+            {"If-None-Match": "*", SECRET_HEADER: secret, VERSION_HEADER: "1"},
+        )
+        if response.status == http.client.PRECONDITION_FAILED:
+            raise VaultExistsError("Unable to create vault, already exists")
+        _check(response, vault_id)
+        return ServerSideVault(vault_id=vault_id, vault_data=b"", vault_secret=secret, version=1)
+
+    def exists(self, vault_id: str) -> bool:
+        """if the vault exists"""
+        response = self._request("HEAD", vault_id)
+        if response.status == http.client.NOT_FOUND:
+            return False
+        _check(response, vault_id)
+        return True
+
+    def delete(self, vault_id: str) -> None:
+        response = self._request("DELETE", vault_id)
+        if response.status != http.client.NOT_FOUND:
+            _check(response, vault_id)
+
+    def get_secret(self, vault_id: str) -> str:
+        """The secret is object metadata, so a HEAD is enough"""
+        response = self._request("HEAD", vault_id)
+        if response.status == http.client.NOT_FOUND:
+            raise VaultReadError("Vault does not exist")
+        _check(response, vault_id)
+        return response.headers[SECRET_HEADER]
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        """A ranged GET of the signature, rather than the whole blob"""
+        return _validator(self._request("GET", vault_id, headers=VALIDATOR_RANGE), vault_id)
+
+    def close(self) -> None:
+        """Close all pooled connections"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _request(
+        self, method: str, vault_id: str, body: bytes | None = None, headers: Mapping[str, str] | None = None
+    ) -> ObjectResponse:
+        """Do one request on a pooled keep-alive connection, reconnecting once if it went stale"""
+        headers = dict(headers or {})
+        if self._token:
+            headers["Authorization"] = f"Bearer {self._token}"
+        path = self._prefix + quote(vault_id, safe="")
+        try:
+            return self._send(self._checkout(), method, path, body, headers)
+        except (http.client.HTTPException, ConnectionError):
+            pass  # most likely a pooled connection the server already closed
+        except OSError as e:
+            raise VaultSaveError("Unable to reach the object store") from e
+        try:
+            return self._send(self._connect(), method, path, body, headers)
+        except (http.client.HTTPException, OSError) as e:
+            raise VaultSaveError("Unable to reach the object store") from e
+
+    def _send(
+        self, conn: http.client.HTTPConnection, method: str, path: str, body: bytes | None, headers: dict[str, str]
+    ) -> ObjectResponse:
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            result = ObjectResponse(response.status, response.headers, response.read())
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        return result
+
+    def _checkout(self) -> http.client.HTTPConnection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+        return cls(self._host, self._port, timeout=self._timeout)
+
+    def _checkin(self, conn: http.client.HTTPConnection) -> None:
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+class AsyncObjectStorage(AsyncVaultStorage):
+    """Native asyncio twin of ObjectStorage: same object layout and conditional writes, no threads.
+
+    Speaks just enough HTTP/1.1 over pooled keep-alive asyncio streams for the handful of requests we make.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str = "vaults",
+        pool_size: int = 16,
+        timeout: float = 10.0,
+        token: str | None = None,
+        max_retries: int = 10,
+    ):
+        url = urlsplit(endpoint)
+        self._ssl = url.scheme == "https"
+        self._host = url.hostname
+        self._port = url.port or (443 if self._ssl else 80)
+        self._prefix = f"{url.path.rstrip('/')}/{quote(bucket, safe='')}/"
+        self._timeout = timeout
+        self._token = token
+        self._max_retries = max_retries
+        self._pool_size = pool_size
+        self._pool: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._pool_loop: asyncio.AbstractEventLoop | None = None
+        self.events = VaultEvents()
+
+    async def aread(self, vault_id: str) -> ServerSideVault:
+        response = await self._request("GET", vault_id)
+        if response.status == http.client.NOT_FOUND:
+            logger.info("Vault '%s' was not found", vault_id)
+            raise VaultReadError("Vault does not exist")
+        _check(response, vault_id)
+        return ServerSideVault(
+            vault_id=vault_id,
+            vault_data=response.body,
+            vault_secret=response.headers[SECRET_HEADER],
+            version=_version(response),
+        )
+
+    async def awrite(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        for attempt in range(self._max_retries):
+            if attempt:
+                await asyncio.sleep(_backoff(attempt))
+            head = await self._request("HEAD", vault_id)
+            if head.status == http.client.NOT_FOUND:
+                raise VaultReadError("Vault does not exist, cannot write")
+            _check(head, vault_id)
+            version = _check_version(head, expected_version) + 1
+            secret = head.headers[SECRET_HEADER]
+            _validate(vault_id, data, secret)
+            headers = {"If-Match": head.headers["etag"], SECRET_HEADER: secret, VERSION_HEADER: str(version)}
+            response = await self._request("PUT", vault_id, data, headers)
+            if response.status != http.client.PRECONDITION_FAILED:
+                _check(response, vault_id)
+                self.events.publish(vault_id, VaultValidator(version, data[:SIGNATURE_SIZE]))
+                return version
+            logger.debug("Conditional write of vault '%s' lost a race, retrying", vault_id)
+        raise VaultSaveError("Unable to write vault, too much contention")
+
+    async def acreate(self, vault_id: str) -> ServerSideVault:
+        secret = secrets.token_hex(32)
+        response = await self._request(
+            "PUT",
+            vault_id,
+            sign_data(b"", secret.encode("utf-8")),
+            {"If-None-Match": "*", SECRET_HEADER: secret, VERSION_HEADER: "1"},
+        )
+        if response.status == http.client.PRECONDITION_FAILED:
+            raise VaultExistsError("Unable to create vault, already exists")
+        _check(response, vault_id)
+        created = ServerSideVault(vault_id=vault_id, vault_data=b"", vault_secret=secret, version=1)
+        self.events.publish(vault_id, VaultValidator.of_created(created))
+        return created
+
+    async def aexists(self, vault_id: str) -> bool:
+        response = await self._request("HEAD", vault_id)
+        if response.status == http.client.NOT_FOUND:
+            return False
+        _check(response, vault_id)
+        return True
+
+    async def adelete(self, vault_id: str) -> None:
+        response = await self._request("DELETE", vault_id)
+        if response.status != http.client.NOT_FOUND:
+            _check(response, vault_id)
+        self.events.publish(vault_id, None)
+
+    async def avalidator(self, vault_id: str) -> VaultValidator:
+        return _validator(await self._request("GET", vault_id, headers=VALIDATOR_RANGE), vault_id)
+
+    async def aopen_stream(self, vault_id: str) -> VaultStream:
+        return BytesVaultStream(await self.aread(vault_id))
+
+    async def aopen_upload(self, vault_id: str, max_size: int) -> VaultUpload:
+        """Spooled in memory, then to disk once it gets big, the PUT needs it all in the end anyway"""
+        head = await self._request("HEAD", vault_id)
+        if head.status == http.client.NOT_FOUND:
+            raise VaultReadError("Vault does not exist, cannot write")
+        _check(head, vault_id)
+        spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)  # noqa: SIM115
+        return VaultUpload(vault_id, head.headers[SECRET_HEADER], max_size, spool)
+
+    async def afeed_upload(self, upload: VaultUpload, chunk: bytes) -> None:
+        upload.feed(chunk)
+
+    async def asave_upload(self, upload: VaultUpload, expected_version: int | None = None) -> int:
+        upload.verify()
+        return await self.awrite(upload.vault_id, upload.read(), expected_version)
+
+    async def aexists_many(self, vault_ids: list[str]) -> list[tuple[str, bool | Exception]]:
+        """Concurrent HEADs, as many in flight as the pool has connections"""
+        return await self._gather(vault_ids, self.aexists)
+
+    async def aread_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        return await self._gather(vault_ids, self.aread)
+
+    async def acreate_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        return await self._gather(vault_ids, self.acreate)
+
+    async def alist_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage:
+        raise NotImplementedError
+
+    async def arevisions(self, vault_id: str) -> list[VaultRevision]:
+        raise NotImplementedError
+
+    async def aread_revision(self, vault_id: str, revision: int) -> bytes:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        """Close all pooled connections"""
+        pool, self._pool = self._pool, []
+        for _, writer in pool:
+            writer.close()
+
+    async def _gather[T](
+        self, vault_ids: list[str], fn: Callable[[str], Awaitable[T]]
+    ) -> list[tuple[str, T | Exception]]:
+        semaphore = asyncio.Semaphore(self._pool_size)
+
+        async def one(vault_id: str) -> T | Exception:
+            async with semaphore:
+                try:
+                    return await fn(vault_id)
+                except (VaultReadError, VaultSaveError) as e:
+                    return e
+
+        return list(zip(vault_ids, await asyncio.gather(*(one(vault_id) for vault_id in vault_ids)), strict=True))
+
+    async def _request(
+        self, method: str, vault_id: str, body: bytes | None = None, headers: Mapping[str, str] | None = None
+    ) -> ObjectResponse:
+        """Do one request on a pooled keep-alive connection, reconnecting once if it went stale"""
+        lines = [f"{method} {self._prefix}{quote(vault_id, safe='')} HTTP/1.1", f"Host: {self._host}:{self._port}"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        if self._token:
+            lines.append(f"Authorization: Bearer {self._token}")
+        lines.append(f"Content-Length: {len(body or b'')}")
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+        conn = self._checkout()
+        if conn is not None:
+            try:
+                return await asyncio.wait_for(self._send(conn, method, request), self._timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass  # most likely a pooled connection the server already closed
+            except (OSError, TimeoutError) as e:
+                # a live connection that timed out won't go faster on a fresh one
+                raise VaultSaveError("Unable to reach the object store") from e
+        try:
+            conn = await asyncio.wait_for(
+                asyncio.open_connection(self._host, self._port, ssl=self._ssl or None), self._timeout
+            )
+            return await asyncio.wait_for(self._send(conn, method, request), self._timeout)
+        except (OSError, asyncio.IncompleteReadError, TimeoutError) as e:
+            raise VaultSaveError("Unable to reach the object store") from e
+
+    async def _send(
+        self, conn: tuple[asyncio.StreamReader, asyncio.StreamWriter], method: str, request: bytes
+    ) -> ObjectResponse:
+        reader, writer = conn
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError("connection closed by the object store")
+            status = int(status_line.split()[1])
+            headers = http.client.HTTPMessage()
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip()] = value.strip()
+            if method == "HEAD" or status in (http.client.NO_CONTENT, http.client.NOT_MODIFIED):
+                body = b""
+            elif headers.get("Transfer-Encoding", "").lower() == "chunked":
+                body = await _read_chunked(reader)
+            else:
+                body = await reader.readexactly(int(headers.get("Content-Length", 0)))
+        except BaseException:
+            writer.close()
+            raise
+        if headers.get("Connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._checkin(conn)
+        return ObjectResponse(status, headers, body)
+
+    def _checkout(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter] | None:
+        loop = asyncio.get_running_loop()
+        if self._pool_loop is not loop:
+            # streams belong to the loop that opened them
+            self._pool, self._pool_loop = [], loop
+        return self._pool.pop() if self._pool else None
+
+    def _checkin(self, conn: tuple[asyncio.StreamReader, asyncio.StreamWriter]) -> None:
+        if len(self._pool) < self._pool_size:
+            self._pool.append(conn)
+        else:
+            conn[1].close()
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+    chunks = []
+    while size := int((await reader.readline()).split(b";")[0], 16):
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+    # trailers, then the blank line
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+    return b"".join(chunks)
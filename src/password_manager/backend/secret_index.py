@@ -0,0 +1,55 @@
+import os
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+from password_manager.util.metrics import Counter
+
+
+class _Entry(NamedTuple):
+    secret: str
+    inode: int
+    mtime_ns: int
+
+
+class SecretIndex:
+    """Process-wide cache of vault secrets, keyed by the path of the `.secret` file.
+
+    A vault's secret never changes while it exists, so checking a signature only needs the secret,
+    not the vault blob. Entries load lazily and are dropped on create/delete. Each lookup still stats
+    the file and reloads if the inode or mtime moved, so a vault deleted and recreated by another
+    process is never validated against a stale secret.
+    """
+
+    def __init__(self):
+        self._entries: dict[Path, _Entry] = {}
+        self._lock = threading.Lock()
+        self.hits = Counter("vault_secret_index_hits", "signature checks answered from memory")
+        self.misses = Counter("vault_secret_index_misses", "signature checks that had to read the secret file")
+
+    def get(self, path: Path) -> str:
+        """Return the secret stored at `path`
+
+        :raises: FileNotFoundError if there is no such secret
+        """
+        st = os.stat(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry.inode == st.st_ino and entry.mtime_ns == st.st_mtime_ns:
+            self.hits.inc()
+            return entry.secret
+        self.misses.inc()
+        secret = path.read_text()
+        with self._lock:
+            self._entries[path] = _Entry(secret, st.st_ino, st.st_mtime_ns)
+        return secret
+
+    def invalidate(self, path: Path) -> None:
+        """Forget the secret at `path`"""
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits.value, "misses": self.misses.value}
+
+
+SECRET_INDEX = SecretIndex()
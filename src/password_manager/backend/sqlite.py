@@ -0,0 +1,243 @@
+import logging
+import secrets
+import sqlite3
+import threading
+import time
+from collections.abc import Generator, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from cryptography.exceptions import InvalidSignature
+
+from password_manager.backend.database import DEFAULT_BASE_PATH, ServerSideVault, VaultStorage, VaultValidator
+from password_manager.backend.metadata_index import VaultMetadata, VaultPage, decode_cursor, page_of
+from password_manager.util.crypto import SIGNATURE_SIZE, sign_data, validate_signature
+from password_manager.util.exceptions import (
+    VaultConflictError,
+    VaultExistsError,
+    VaultReadError,
+    VaultSaveError,
+    VaultValidationError,
+)
+
+logger = logging.getLogger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vaults (
+    vault_id TEXT PRIMARY KEY,
+    vault_data BLOB NOT NULL,
+    vault_secret TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID
+"""
+
+# ids per `IN (...)`, well under sqlite's bound parameter limit
+BATCH_SIZE = 500
+
+
+class SqliteStorage(VaultStorage):
+    """Store every vault as a row in one sqlite database.
+
+    The database runs in WAL mode so readers never block the (single) writer, and each thread
+    gets its own connection since sqlite connections can't be shared between threads.
+    """
+
+    def __init__(self, base_path: str = DEFAULT_BASE_PATH, filename: str = "vaults.sqlite3"):
+        self._base = Path(base_path).expanduser()
+        self._base.mkdir(parents=True, exist_ok=True)
+        self._db_path = self._base / filename
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        with self._transaction() as conn:
+            conn.execute(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(vaults)")}
+            # databases from before vaults had versions, or timestamps
+            for column in ("version INTEGER", "created_at REAL", "updated_at REAL"):
+                if column.split()[0] not in columns:
+                    conn.execute(f"ALTER TABLE vaults ADD COLUMN {column} NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS vaults_updated ON vaults (updated_at)")
+
+    def read(self, vault_id: str) -> ServerSideVault:
+        """Return the vault, or raise"""
+        row = (
+            self._conn()
+            .execute("SELECT vault_data, vault_secret, version FROM vaults WHERE vault_id = ?", (vault_id,))
+            .fetchone()
+        )
+        if row is None:
+            logger.info("Vault '%s' was not found", vault_id)
+            raise VaultReadError("Vault does not exist")
+        return ServerSideVault(vault_id=vault_id, vault_data=row[0], vault_secret=row[1], version=row[2])
+
+    def write(self, vault_id: str, data: bytes, expected_version: int | None = None) -> int:
+        """Write the vault, or raise
+
+        The signature is checked outside any transaction, the update itself is a single compare and swap
+        on the secret (and version, if given) so nothing changed underneath us in between.
+        """
+        secret = self.get_secret(vault_id)
+        try:
+            validate_signature(data, secret.encode("utf-8"))
+        except InvalidSignature as e:
+            logger.error("Vault '%s' had an invalid signature when attempting to write", vault_id)
+            raise VaultValidationError("Invalid siganture") from e
+        # fetchall, not fetchone, so the statement finishes and lets go of the write lock
+        rows = (
+            self._conn()
+            .execute(
+                "UPDATE vaults SET vault_data = ?, version = version + 1, updated_at = ?"
+                " WHERE vault_id = ? AND vault_secret = ? AND (? IS NULL OR version = ?) RETURNING version",
+                (data, time.time(), vault_id, secret, expected_version, expected_version),
+            )
+            .fetchall()
+        )
+        if rows:
+            return rows[0][0]
+        # lost the swap, work out why
+        current = self._conn().execute("SELECT version FROM vaults WHERE vault_id = ?", (vault_id,)).fetchone()
+        if current is None:
+            raise VaultReadError("Vault does not exist, cannot write")
+        if expected_version is not None and current[0] != expected_version:
+            raise VaultConflictError(f"Vault is at version {current[0]}, not {expected_version}")
+        raise VaultConflictError("Vault was recreated while saving")
+
+    def create(self, vault_id: str) -> ServerSideVault:
+        """new vault, will generate a new secret"""
+        secret = secrets.token_hex(32)
+        try:
+            with self._transaction() as conn:
+                now = time.time()
+                conn.execute(
+                    "INSERT INTO vaults (vault_id, vault_data, vault_secret, version, created_at, updated_at)"
+                    " VALUES (?, ?, ?, 1, ?, ?)",
+                    # sign 'nothing' so we can validate 'nothing', same as FileStorage
+                    (vault_id, sign_data(b"", secret.encode("utf-8")), secret, now, now),
+                )
+        except sqlite3.IntegrityError as e:
+            raise VaultExistsError("Unable to create vault, already exists") from e
+        return ServerSideVault(vault_id=vault_id, vault_data=b"", vault_secret=secret, version=1)
+
+    def exists(self, vault_id: str) -> bool:
+        """if the vault exists"""
+        return self._conn().execute("SELECT 1 FROM vaults WHERE vault_id = ?", (vault_id,)).fetchone() is not None
+
+    def delete(self, vault_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM vaults WHERE vault_id = ?", (vault_id,))
+
+    def get_secret(self, vault_id: str) -> str:
+        """Just the secret column, the blob stays on disk"""
+        row = self._conn().execute("SELECT vault_secret FROM vaults WHERE vault_id = ?", (vault_id,)).fetchone()
+        if row is None:
+            raise VaultReadError("Vault does not exist")
+        return row[0]
+
+    def validator(self, vault_id: str) -> VaultValidator:
+        """The version column and the first bytes of the blob"""
+        row = (
+            self._conn()
+            .execute(
+                "SELECT version, substr(vault_data, 1, ?) FROM vaults WHERE vault_id = ?", (SIGNATURE_SIZE, vault_id)
+            )
+            .fetchone()
+        )
+        if row is None:
+            raise VaultReadError("Vault does not exist")
+        return VaultValidator(row[0], row[1])
+
+    def exists_many(self, vault_ids: list[str]) -> list[tuple[str, bool | Exception]]:
+        """One query per BATCH_SIZE ids"""
+        found = {row[0] for row in self._select_many("SELECT vault_id FROM vaults WHERE vault_id IN ({})", vault_ids)}
+        return [(vault_id, vault_id in found) for vault_id in vault_ids]
+
+    def read_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        """One query per BATCH_SIZE ids"""
+        found = {
+            row[0]: ServerSideVault(vault_id=row[0], vault_data=row[1], vault_secret=row[2], version=row[3])
+            for row in self._select_many(
+                "SELECT vault_id, vault_data, vault_secret, version FROM vaults WHERE vault_id IN ({})", vault_ids
+            )
+        }
+        return [(vault_id, found.get(vault_id) or VaultReadError("Vault does not exist")) for vault_id in vault_ids]
+
+    def create_many(self, vault_ids: list[str]) -> list[tuple[str, ServerSideVault | Exception]]:
+        """All in one transaction, so one commit for the lot. Ids that already exist are skipped, not fatal"""
+        results: list[tuple[str, ServerSideVault | Exception]] = []
+        with self._transaction() as conn:
+            for vault_id in vault_ids:
+                secret = secrets.token_hex(32)
+                now = time.time()
+                created = conn.execute(
+                    "INSERT INTO vaults (vault_id, vault_data, vault_secret, version, created_at, updated_at)"
+                    " VALUES (?, ?, ?, 1, ?, ?) ON CONFLICT DO NOTHING RETURNING vault_id",
+                    (vault_id, sign_data(b"", secret.encode("utf-8")), secret, now, now),
+                ).fetchall()
+                if created:
+                    results.append(
+                        (vault_id, ServerSideVault(vault_id=vault_id, vault_data=b"", vault_secret=secret, version=1))
+                    )
+                else:
+                    results.append((vault_id, VaultExistsError("Unable to create vault, already exists")))
+        return results
+
+    def list_vaults(
+        self, cursor: str | None = None, limit: int = 100, updated_since: float | None = None
+    ) -> VaultPage:
+        """Keyset paged over the primary key, the blobs themselves are never read"""
+        after = decode_cursor(cursor) if cursor else None
+        rows = self._conn().execute(
+            "SELECT vault_id, length(vault_data), version, created_at, updated_at FROM vaults"
+            " WHERE (? IS NULL OR vault_id > ?) AND (? IS NULL OR updated_at >= ?) ORDER BY vault_id LIMIT ?",
+            (after, after, updated_since, updated_since, limit + 1),
+        )
+        return page_of(
+            [
+                VaultMetadata(vault_id=row[0], size=row[1], version=row[2], created_at=row[3], updated_at=row[4])
+                for row in rows
+            ],
+            limit,
+        )
+
+    def close(self) -> None:
+        """Close every connection we have handed out"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """The connection for the current thread, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit mode, we issue BEGIN/COMMIT ourselves in _transaction
+            # check_same_thread is off only so close() can clean up from any thread
+            conn = sqlite3.connect(self._db_path, isolation_level=None, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _select_many(self, query: str, vault_ids: list[str]) -> Iterator[tuple]:
+        """Run `query` with its `IN ({})` filled in for each BATCH_SIZE slice of the ids"""
+        unique = list(dict.fromkeys(vault_ids))
+        for start in range(0, len(unique), BATCH_SIZE):
+            batch = unique[start : start + BATCH_SIZE]
+            yield from self._conn().execute(query.format(", ".join("?" * len(batch))), batch)
+
+    @contextmanager
+    def _transaction(self) -> Generator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE so the write lock is taken up front, rather than upgraded mid-transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
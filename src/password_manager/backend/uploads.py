@@ -0,0 +1,227 @@
+import functools
+import logging
+import re
+import secrets
+import threading
+import time
+from collections.abc import Generator, Iterator
+from pathlib import Path
+
+import platformdirs
+from filelock import FileLock
+from pydantic import BaseModel
+
+from password_manager.backend.database import STREAM_CHUNK_SIZE
+from password_manager.util import config
+from password_manager.util.exceptions import UploadLimitError, UploadOffsetError, VaultReadError, VaultTooLargeError
+
+logger = logging.getLogger()
+
+DEFAULT_UPLOAD_PATH = str(
+    Path(platformdirs.user_cache_dir(appname="password-jam", appauthor="password-jam")) / "uploads"
+)
+
+_UPLOAD_ID = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+DEFAULT_UPLOAD_MAX_PER_VAULT = 4
+DEFAULT_UPLOAD_MAX_PENDING_BYTES = 1024**3
+
+
+class UploadSession(BaseModel):
+    upload_id: str
+    vault_id: str
+    length: int
+    expected_version: int | None
+    created_at: float
+
+
+class UploadStatus(BaseModel):
+    session: UploadSession
+    offset: int
+    expires_at: float
+
+
+class UploadSessions:
+    """Partially uploaded vaults, so a client on a flaky link can pick up where it dropped off, tus style.
+
+    Each session is `<upload_id>.json` (who it's for and how big it'll be) plus `<upload_id>.part` holding
+    the bytes received so far, whose size is the offset to resume from. Appends check the offset under the
+    session's FileLock, so two connections racing on one session can't interleave. A session expires
+    `ttl` seconds after it last received anything, and a background sweep removes expired ones along
+    with parts whose session file never made it.
+
+    Anyone can start one, so a vault gets at most `max_per_vault` open at a time, and all of them together
+    may only declare `max_pending_bytes`. Those are counted from the session files, so the limits hold
+    across every process sharing the dir.
+    """
+
+    def __init__(
+        self,
+        base_path: str = DEFAULT_UPLOAD_PATH,
+        ttl: float = 24 * 3600,
+        sweep_interval: float = 600.0,
+        max_per_vault: int = DEFAULT_UPLOAD_MAX_PER_VAULT,
+        max_pending_bytes: int = DEFAULT_UPLOAD_MAX_PENDING_BYTES,
+    ):
+        self._base = Path(base_path).expanduser().resolve()
+        self._base.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+        self._max_per_vault = max_per_vault
+        self._max_pending_bytes = max_pending_bytes
+        self._closed = threading.Event()
+        self._sweeper: threading.Thread | None = None
+        if sweep_interval > 0:
+            self._sweeper = threading.Thread(
+                target=self._sweep_loop, args=(sweep_interval,), name="upload-sweeper", daemon=True
+            )
+            self._sweeper.start()
+
+    def create(self, vault_id: str, length: int, expected_version: int | None) -> UploadSession:
+        """Start a session for a `length` byte blob
+
+        :raises: UploadLimitError if the vault already has its fill of open uploads, or there's no room left
+        """
+        session = UploadSession(
+            upload_id=secrets.token_urlsafe(16),
+            vault_id=vault_id,
+            length=length,
+            expected_version=expected_version,
+            created_at=time.time(),
+        )
+        # held while counting up to the new session being there, so racing creates can't both squeeze in
+        with FileLock(self._base / ".create.lock"):
+            live = list(self._live())
+            if sum(other.vault_id == vault_id for other in live) >= self._max_per_vault:
+                raise UploadLimitError(f"Vault already has {self._max_per_vault} uploads open")
+            if sum(other.length for other in live) + length > self._max_pending_bytes:
+                raise UploadLimitError("No room for another upload", out_of_space=True)
+            # the part goes first, a session file without one would look like an upload that lost its data
+            self._path(session.upload_id, ".part").touch(exist_ok=False)
+            self._path(session.upload_id, ".json").write_text(session.model_dump_json())
+        return session
+
+    def status(self, vault_id: str, upload_id: str) -> UploadStatus:
+        """Where the upload is at, or raise VaultReadError for unknown or expired sessions"""
+        session = self._session(vault_id, upload_id)
+        try:
+            st = self._path(upload_id, ".part").stat()
+        except FileNotFoundError as e:
+            raise VaultReadError("Upload does not exist") from e
+        expires_at = st.st_mtime + self._ttl
+        if expires_at < time.time():
+            raise VaultReadError("Upload has expired")
+        return UploadStatus(session=session, offset=st.st_size, expires_at=expires_at)
+
+    def append(self, vault_id: str, upload_id: str, offset: int, chunk: bytes) -> int:
+        """Add `chunk` at `offset`, returning the new offset
+
+        :raises: UploadOffsetError if the upload isn't at `offset`, VaultTooLargeError past the declared length
+        """
+        with self._lock(upload_id):
+            upload = self.status(vault_id, upload_id)
+            if upload.offset != offset:
+                raise UploadOffsetError(f"Upload is at offset {upload.offset}, not {offset}")
+            if offset + len(chunk) > upload.session.length:
+                raise VaultTooLargeError(f"Upload is longer than the {upload.session.length} bytes declared")
+            with Path.open(self._path(upload_id, ".part"), "ab") as f:
+                f.write(chunk)
+        return offset + len(chunk)
+
+    def iter_data(self, vault_id: str, upload_id: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """The bytes received so far, a chunk at a time"""
+        self._session(vault_id, upload_id)
+        with Path.open(self._path(upload_id, ".part"), "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def remove(self, vault_id: str, upload_id: str) -> None:
+        """Drop a session and whatever it received"""
+        self._session(vault_id, upload_id)
+        self._remove(upload_id)
+
+    def sweep(self) -> int:
+        """Remove expired sessions and orphaned parts, returning how many uploads went"""
+        removed = 0
+        now = time.time()
+        for part in self._base.glob("*.part"):
+            upload_id = part.stem
+            try:
+                mtime = part.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            # a part with no session is from a create that died halfway, give it a moment to finish
+            orphaned = not self._path(upload_id, ".json").exists() and mtime < now - 60
+            if mtime < now - self._ttl or orphaned:
+                self._remove(upload_id)
+                removed += 1
+        for stray in self._base.glob("*.json"):
+            if not self._path(stray.stem, ".part").exists():
+                self._remove(stray.stem)
+        return removed
+
+    def close(self) -> None:
+        """Stop the background sweep"""
+        self._closed.set()
+        if self._sweeper:
+            self._sweeper.join()
+
+    def _sweep_loop(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.info("Removed %d expired vault uploads", removed)
+            except Exception as e:
+                logger.error("Vault upload sweep failed: %s", e)
+
+    def _live(self) -> Iterator[UploadSession]:
+        """Every session that hasn't expired, whether or not the sweep got to the rest yet"""
+        expired = time.time() - self._ttl
+        for path in self._base.glob("*.json"):
+            try:
+                session = UploadSession.model_validate_json(path.read_text())
+                if self._path(session.upload_id, ".part").stat().st_mtime >= expired:
+                    yield session
+            except (FileNotFoundError, VaultReadError):
+                continue
+
+    def _session(self, vault_id: str, upload_id: str) -> UploadSession:
+        try:
+            session = UploadSession.model_validate_json(self._path(upload_id, ".json").read_text())
+        except FileNotFoundError as e:
+            raise VaultReadError("Upload does not exist") from e
+        # upload ids are unguessable, but they still only work on the vault they were made for
+        if session.vault_id != vault_id:
+            raise VaultReadError("Upload does not exist")
+        return session
+
+    def _remove(self, upload_id: str) -> None:
+        with self._lock(upload_id):
+            self._path(upload_id, ".json").unlink(missing_ok=True)
+            self._path(upload_id, ".part").unlink(missing_ok=True)
+        self._path(upload_id, ".lock").unlink(missing_ok=True)
+
+    def _lock(self, upload_id: str) -> FileLock:
+        return FileLock(self._path(upload_id, ".lock"))
+
+    def _path(self, upload_id: str, suffix: str) -> Path:
+        """ids come from the url, so only ever our own token alphabet"""
+        if not _UPLOAD_ID.fullmatch(upload_id):
+            raise VaultReadError("Upload does not exist")
+        return self._base / f"{upload_id}{suffix}"
+
+
+@functools.cache
+def _upload_sessions_for(base_path: str, ttl: float, max_per_vault: int, max_pending_bytes: int) -> UploadSessions:
+    return UploadSessions(base_path, ttl=ttl, max_per_vault=max_per_vault, max_pending_bytes=max_pending_bytes)
+
+
+def get_upload_sessions() -> Generator[UploadSessions]:
+    """Resumable upload sessions, kept under `PASSWORD_JAM_UPLOAD_PATH` for `PASSWORD_JAM_UPLOAD_TTL` seconds,
+    limited by `PASSWORD_JAM_UPLOAD_MAX_PER_VAULT` and `PASSWORD_JAM_UPLOAD_MAX_PENDING_BYTES`"""
+    yield _upload_sessions_for(
+        config.get_str("UPLOAD_PATH", DEFAULT_UPLOAD_PATH),
+        config.get_float("UPLOAD_TTL", 24 * 3600),
+        config.get_int("UPLOAD_MAX_PER_VAULT", DEFAULT_UPLOAD_MAX_PER_VAULT),
+        config.get_int("UPLOAD_MAX_PENDING_BYTES", DEFAULT_UPLOAD_MAX_PENDING_BYTES),
+    )
@@ -1,9 +1,10 @@
+import copy
 import pickle
 from datetime import UTC, datetime
 from typing import Any
 from uuid import uuid4
 
-from password_manager.util import crypto
+from password_manager.util import crypto, delta
 
 
 class VaultKeyValue:
@@ -119,11 +120,37 @@ class Vault:
 
 def decrypt_vault(data: bytes, key: crypto.UnlockKey) -> Vault:
     """Given the key, decrypt the bytes into a Vault"""
-    decrypted_bytes = crypto.decrypt_data(data, key)
-    return pickle.loads(decrypted_bytes)  # noqa: S301
+    if not crypto.is_segmented(data):
+        # saved before vaults were encrypted entry by entry
+        decrypted_bytes = crypto.decrypt_data(data, key)
+        return pickle.loads(decrypted_bytes)  # noqa: S301
+    first, *entries = crypto.decrypt_segments(data, key)
+    vault = pickle.loads(first)  # noqa: S301
+    vault.entries = [pickle.loads(entry) for entry in entries]  # noqa: S301
+    return vault
 
 
 def encrypt_vault(vault: Vault, key: crypto.UnlockKey) -> bytes:
-    """Given the key, encrypt the Vault"""
-    decrypted_bytes = pickle.dumps(vault)
-    return crypto.encrypt_data(decrypted_bytes, key)
+    """Given the key, encrypt the Vault
+
+    The vault and each of its entries are pickled and encrypted separately, so after an edit only the
+    bytes of the entries that changed are different, see `vault_delta`.
+    """
+    shell = copy.copy(vault)
+    shell.entries = []
+    return crypto.encrypt_segments([pickle.dumps(shell), *(pickle.dumps(entry) for entry in vault.entries)], key)
+
+
+def vault_delta(base: bytes, new: bytes) -> bytes:
+    """A delta for saving `new` over `base`, both as stored (encrypt_vault output signed with the vault secret)
+
+    Encrypted entries are matched up whole, wherever they moved to.
+    """
+
+    def split(blob: bytes) -> list[tuple[int, int]]:
+        signed = blob[crypto.SIGNATURE_SIZE :]
+        return [
+            (start + crypto.SIGNATURE_SIZE, end + crypto.SIGNATURE_SIZE) for start, end in crypto.segment_spans(signed)
+        ]
+
+    return delta.make_delta(base, new, split)
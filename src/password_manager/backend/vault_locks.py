@@ -0,0 +1,37 @@
+import asyncio
+import contextlib
+import time
+import weakref
+from collections.abc import AsyncIterator
+
+from password_manager.util.metrics import Histogram
+
+
+class VaultLocks:
+    """Per-vault asyncio locks, so coroutines in one process queue up on the loop instead of all polling the FileLock.
+
+    Only whoever holds the vault's asyncio lock goes on to take the FileLock, which still does the
+    cross-process part. Locks live in a weak-value map and disappear once nobody holds or waits on them,
+    so there's no growing dict of every vault ever written. Use from a single event loop.
+    """
+
+    def __init__(self):
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.wait_seconds = Histogram(
+            "vault_lock_wait_seconds", "time spent waiting for another writer to the same vault"
+        )
+
+    @contextlib.asynccontextmanager
+    async def hold(self, vault_id: str) -> AsyncIterator[None]:
+        """Hold the vault's lock for the duration of the block"""
+        lock = self._locks.get(vault_id)
+        if lock is None:
+            # no await between the lookup and the insert, so nobody else can sneak in their own lock
+            lock = self._locks[vault_id] = asyncio.Lock()
+        start = time.perf_counter()
+        async with lock:
+            self.wait_seconds.observe(time.perf_counter() - start)
+            yield
+
+    def __len__(self) -> int:
+        return len(self._locks)
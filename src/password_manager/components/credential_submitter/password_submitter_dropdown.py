@@ -2,15 +2,15 @@ from collections.abc import Callable
 
 from nicegui import ui
 
-from password_manager.components.passcode_factories import ALL_PASSCODE_INPUTS
-from password_manager.types import Component, Passcode, PasscodeInput
+from password_manager.components.passcode_factories import ALL_PASSCODE_INPUTS, PasscodeInputFactory
+from password_manager.types import Component, Passcode
 from password_manager.util.crypto import UnlockKey
 
 
 class PasscodeItem(Component):
     def __init__(
         self,
-        passcode_input: type[PasscodeInput],
+        passcode_input: PasscodeInputFactory,
         on_submit: Callable[[Passcode], None],
         submit_text: str,
         passcode_input_parent: ui.element,
@@ -1,7 +1,7 @@
 from nicegui import ui
 from collections.abc import Callable
-from password_manager.components.passcode_factories import ALL_PASSCODE_INPUTS
-from password_manager.types import Component, Passcode, PasscodeInput
+from password_manager.components.passcode_factories import ALL_PASSCODE_INPUTS, PasscodeInputFactory
+from password_manager.types import Component, Passcode
 
 
 PASSWORD_SECTION_LABEL = "Password"
@@ -24,7 +24,7 @@ class PasswordSubmitterWide(Component):
             for password_input in ALL_PASSCODE_INPUTS:
                 self.__make_tab_content(password_input)
 
-    def __make_tab_content(self, password_input: type[PasscodeInput]) -> None:
+    def __make_tab_content(self, password_input: PasscodeInputFactory) -> None:
         with ui.tab_panel(password_input.get_name()):
             password_input(self.set_passcode, self.submit_text)
 
@@ -4,12 +4,12 @@ import pickle
 from re import U
 from typing import Callable
 
-from nicegui import app, ui
+from nicegui import app, background_tasks, ui
 from nicegui.events import GenericEventArguments
 import platformdirs
 
 from password_manager.backend import vault
-from password_manager.backend.database import VaultStorage
+from password_manager.backend.async_storage import AsyncVaultStorage
 from password_manager.components.credential_submitter.credential_submitter import CredentialSubmitter
 from password_manager.components.credential_submitter.password_submitter_dropdown import (
     PasswordSubmitterDropdown,
@@ -19,6 +19,7 @@ from password_manager.components.passcode_factories import ALL_PASSCODE_INPUTS
 from password_manager.types import Passcode, PasscodeInput
 from password_manager.util import crypto
 from password_manager.util.crypto import SimpleUnlockKey, UnlockKey
+from password_manager.util.exceptions import VaultConflictError
 
 
 logger = logging.Logger("pages", level=logging.DEBUG)
@@ -30,9 +31,9 @@ def protected(func: Callable) -> Callable:
     return func
 
 
-def load_vault_page(storage: VaultStorage) -> None:
+def load_vault_page(storage: AsyncVaultStorage) -> None:
     async def try_load() -> None:
-        if storage.exists(str(vault_id.value)):
+        if await storage.aexists(str(vault_id.value)):
             app.storage.user["vault_id"] = str(vault_id.value)
             ui.navigate.to("/unlock")
         else:
@@ -55,7 +56,7 @@ def load_vault_page(storage: VaultStorage) -> None:
             ui.button("Login", on_click=try_load).props("outline").bind_enabled(globals(), "curr_input")
 
 
-def create_vault_page(storage: VaultStorage) -> None:
+def create_vault_page(storage: AsyncVaultStorage) -> None:
     registration_info = {"vault_id": "", "unlock_key": None}
     if app.storage.user.get("vault_id", None) != None:
         app.storage.user["is_registering"] = False
@@ -63,14 +64,14 @@ def create_vault_page(storage: VaultStorage) -> None:
 
     async def try_create() -> None:
         vid = str(registration_info["vault_id"]).strip()
-        if storage.exists(vid):
+        if await storage.aexists(vid):
             ui.notify("Vault already exists", color="negative")
         elif registration_info.get("unlock_key", None) is None:
             ui.notify("Please set a passcode", color="negative")
         else:
             try:
                 # todo: move this out
-                ssv = storage.create(vid)
+                ssv = await storage.acreate(vid)
                 # just make a new vault with the given secret...
                 new_vault = vault.Vault()
                 new_vault.vault_secret = ssv.vault_secret
@@ -82,14 +83,14 @@ def create_vault_page(storage: VaultStorage) -> None:
                 vault.decrypt_vault(encrypted_vault, key)  # will throw if we failed somewhere
 
                 double_signed_vault = crypto.sign_data(encrypted_vault, new_vault.vault_secret.encode("utf-8"))
-                storage.write(vid, double_signed_vault)
+                await storage.awrite(vid, double_signed_vault, expected_version=ssv.version)
                 # this makes our custom routing in SubPages break
                 # app.storage.user["vault_id"] = vid
                 # app.storage.user["vault_secret"] = ssv.vault_secret
                 ui.navigate.to("/")
             except Exception as e:
                 logging.getLogger().debug(e)
-                storage.delete(vid)
+                await storage.adelete(vid)
                 ui.notify(f"Failed to create {e}", color="negative")
 
     def on_passcode_set(p: Passcode) -> None:
@@ -99,7 +100,7 @@ def create_vault_page(storage: VaultStorage) -> None:
     with ui.stepper().props("vertical").classes("absolute-center items-center") as stepper:
 
         async def stepper_next_if_valid_vid() -> None:
-            if storage.exists(registration_info["vault_id"]):
+            if await storage.aexists(registration_info["vault_id"]):
                 ui.notify("Vault already exists", color="negative")
             else:
                 stepper.next()
@@ -151,8 +152,17 @@ def clear_vault_session() -> None:
     ui.navigate.to("/load")
 
 
-def unlock_page(storage: VaultStorage) -> None:
-    def temp_submit_passcode_check(p: Passcode) -> None:  # type: ignore
+def unlock_page(storage: AsyncVaultStorage) -> None:
+    def temp_submit_passcode_check(p: Passcode) -> None:
+        # passcode inputs call us synchronously, from all sorts of places, so do the storage work in a task
+        background_tasks.create(try_unlock(p), name="unlock vault")
+
+    async def try_unlock(p: Passcode) -> None:
+        # make sure notify/navigate land on this page
+        with unlock_column:
+            await _try_unlock(p)
+
+    async def _try_unlock(p: Passcode) -> None:  # type: ignore
         with open(
             platformdirs.user_cache_path(appname="password-jam", appauthor="password-jam") / "passcode",
             "wb",
@@ -167,7 +177,7 @@ def unlock_page(storage: VaultStorage) -> None:
         if not vault_id:
             ui.notify("No vault ID set, please load a vault first", color="negative")
             return
-        ssv = storage.read(vault_id)
+        ssv = await storage.aread(vault_id)
         if not ssv:
             ui.notify("Vault does not exist", color="negative")
             return
@@ -182,6 +192,8 @@ def unlock_page(storage: VaultStorage) -> None:
             return
         ui.notify("Vault unlocked successfully", color="positive")
         app.storage.user["vault_secret"] = decrypted_vault.vault_secret
+        # saves only go through on top of the version we're looking at
+        app.storage.user["vault_version"] = ssv.version
         # THIS FAILS -- need to figure out the data binding stuff for objects
         # in particular, this is the thing that throws TypeError: Type is not JSON serializable: Vault, like, three times
         # without tracing back to this line
@@ -197,12 +209,12 @@ def unlock_page(storage: VaultStorage) -> None:
         logging.getLogger().debug("here 2")
         ui.navigate.to("/")
 
-    with ui.column().classes("absolute-center items-center"):
+    with ui.column().classes("absolute-center items-center") as unlock_column:
         CredentialSubmitter(temp_submit_passcode_check)
 
 
 @protected
-def home_page(storage: VaultStorage) -> None:
+async def home_page(storage: AsyncVaultStorage) -> None:
     # terrible terrible hack so i can start working on vault rendering
     # just load the decrypted vault from disk
     logging.getLogger().debug("got to home page")
@@ -216,7 +228,7 @@ def home_page(storage: VaultStorage) -> None:
     except FileNotFoundError:
         try:
             vault_id = app.storage.user["vault_id"]
-            ssv = storage.read(vault_id)
+            ssv = await storage.aread(vault_id)
             with open(
                 platformdirs.user_cache_path(appname="password-jam", appauthor="password-jam") / "passcode",
                 "rb",
@@ -228,6 +240,7 @@ def home_page(storage: VaultStorage) -> None:
             key = SimpleUnlockKey()
             key.seed(p)
             my_vault = vault.decrypt_vault(unsigned_encrypted_vault, key)
+            app.storage.user["vault_version"] = ssv.version
             logging.getLogger().debug("successfully restored from passcode in storage")
             # TODO whoops realized this whole hack (passcode and literally_just_the_decrypted_vault)
             # could have probably been done properly by just base64 encoding and putting it into nicegui user sstorage.
@@ -248,7 +261,7 @@ def home_page(storage: VaultStorage) -> None:
 
     vault_contents = ui.column().classes("absolute-center items-center")
 
-    def save_my_vault_to_storage() -> None:
+    async def save_my_vault_to_storage() -> None:
         key = crypto.SimpleUnlockKey()
 
         with open(
@@ -259,13 +272,21 @@ def home_page(storage: VaultStorage) -> None:
 
         encrypted_vault = vault.encrypt_vault(my_vault, key)
         double_signed_vault = crypto.sign_data(encrypted_vault, my_vault.vault_secret.encode("utf-8"))
-        storage.write(app.storage.user["vault_id"], double_signed_vault)
+        try:
+            app.storage.user["vault_version"] = await storage.awrite(
+                app.storage.user["vault_id"],
+                double_signed_vault,
+                expected_version=app.storage.user.get("vault_version"),
+            )
+        except VaultConflictError:
+            # another session saved first, don't clobber it
+            ui.notify("Vault was changed somewhere else, unlock it again to see the changes", color="negative")
 
     def render_entry(entry: vault.VaultEntry) -> None:
         with vault_contents:
             with ui.row() as row:
 
-                def delete_entry() -> None:
+                async def delete_entry() -> None:
                     row.delete()
 
                     for i, arbitrary_entry in enumerate(my_vault.entries):
@@ -273,7 +294,7 @@ def home_page(storage: VaultStorage) -> None:
                             break
                     my_vault.entries.pop(i)
 
-                    save_my_vault_to_storage()
+                    await save_my_vault_to_storage()
 
                 ui.label(f"{entry.key_values[0].key}: {entry.key_values[0].value}")
                 ui.button(icon="delete", on_click=delete_entry).props("flat size=sm padding=xs")
@@ -281,7 +302,7 @@ def home_page(storage: VaultStorage) -> None:
                     "flat size=sm padding=xs"
                 )
 
-    def add_entry_helper(label: str, content: str) -> None:
+    async def add_entry_helper(label: str, content: str) -> None:
         """
         Add an entry to the vault by
         - adding it to the representation in RAM
@@ -296,7 +317,7 @@ def home_page(storage: VaultStorage) -> None:
 
         render_entry(entry)
 
-        save_my_vault_to_storage()
+        await save_my_vault_to_storage()
 
     with vault_contents:
         ui.link("lock vault", "/logout")
@@ -308,10 +329,10 @@ def home_page(storage: VaultStorage) -> None:
         ui_entrylabel = ui.input("label")
         ui_entrycontent = ui.input("content")
 
-    def add_entry_to_vault() -> None:
+    async def add_entry_to_vault() -> None:
         # we need this blank function to be here because we want to do this trick where
         # we refer to ui_entrylabel and such in the args. there's a better way i'm sure but i'm tired.
-        add_entry_helper(ui_entrylabel.value, ui_entrycontent.value)
+        await add_entry_helper(ui_entrylabel.value, ui_entrycontent.value)
 
     with vault_contents:
         ui.button("new entry", on_click=add_entry_to_vault)
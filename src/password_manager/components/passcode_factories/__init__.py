@@ -1,27 +1,49 @@
 """Functionality for generating passcode inputs.
 
 We expose the type `PasscodeInputFactory` that defines a function used to generate
-passcode inputs. All other public members in this module are functions of this type.
+passcode inputs. `ALL_PASSCODE_INPUTS` holds one for each input we have.
+
+Inputs pull in all sorts (requests, leaflet, codemirror, the snake engine), so each one's module is
+only imported once one is actually spawned, not when the list of them is shown.
 """
 
-from password_manager.components.passcode_factories.anagram import AnagramLock
-from password_manager.components.passcode_factories.binary import BinaryInput
-from password_manager.components.passcode_factories.guesser import GuesserLock
-from password_manager.components.passcode_factories.longvideo import LongVideoLock
-from password_manager.components.passcode_factories.map import MapLock
-from password_manager.components.passcode_factories.text import TextInput
-from password_manager.components.passcode_factories.typst import TypstInput
-from password_manager.components.passcode_factories.snake import SnakeInput
-from password_manager.types import PasscodeInput
-
-ALL_PASSCODE_INPUTS: list[type[PasscodeInput]] = [
-    AnagramLock,
-    BinaryInput,
-    GuesserLock,
-    LongVideoLock,
-    MapLock,
-    TextInput,
-    TypstInput,
-    SnakeInput,
+import importlib
+from collections.abc import Callable
+
+from password_manager.types import Passcode, PasscodeInput
+
+
+class PasscodeInputFactory:
+    """Stands in for a PasscodeInput subclass: has its `get_name()` and spawns one when called"""
+
+    def __init__(self, name: str, module: str, class_name: str):
+        self._name = name
+        self._module = module
+        self._class_name = class_name
+
+    def get_name(self) -> str:
+        return self._name
+
+    def load(self) -> type[PasscodeInput]:
+        """The PasscodeInput subclass itself, imported on first use"""
+        module = importlib.import_module(f"{__name__}.{self._module}")
+        return getattr(module, self._class_name)
+
+    def __call__(self, on_submit: Callable[[Passcode], None], submit_text: str) -> PasscodeInput:
+        return self.load()(on_submit, submit_text)
+
+    def __repr__(self) -> str:
+        return f"PasscodeInputFactory({self._name!r})"
+
+
+ALL_PASSCODE_INPUTS: list[PasscodeInputFactory] = [
+    PasscodeInputFactory("Anagram", "anagram", "AnagramLock"),
+    PasscodeInputFactory("Binary", "binary", "BinaryInput"),
+    PasscodeInputFactory("Guesser", "guesser", "GuesserLock"),
+    PasscodeInputFactory("Long Video", "longvideo", "LongVideoLock"),
+    PasscodeInputFactory("Map", "map", "MapLock"),
+    PasscodeInputFactory("Text", "text", "TextInput"),
+    PasscodeInputFactory("Typst", "typst", "TypstInput"),
+    PasscodeInputFactory("Snake", "snake", "SnakeInput"),
 ]
 """All factories with an identifying name."""
@@ -0,0 +1,26 @@
+"""Runtime configuration.
+
+Everything is read from `PASSWORD_JAM_*` environment variables, so a deployment can be tuned
+without touching code. e.g. `PASSWORD_JAM_STORAGE=sqlite uv run src/main.py`
+"""
+
+import os
+
+PREFIX = "PASSWORD_JAM_"
+
+
+def get_str(name: str, default: str) -> str:
+    """Get a string setting, `name` is without the prefix"""
+    return os.environ.get(PREFIX + name, default)
+
+
+def get_int(name: str, default: int) -> int:
+    """Get an integer setting, `name` is without the prefix"""
+    value = os.environ.get(PREFIX + name)
+    return default if value is None or value == "" else int(value)
+
+
+def get_float(name: str, default: float) -> float:
+    """Get a float setting, `name` is without the prefix"""
+    value = os.environ.get(PREFIX + name)
+    return default if value is None or value == "" else float(value)
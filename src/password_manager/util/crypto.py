@@ -1,12 +1,19 @@
+import functools
 import hashlib
+import inspect
 import os
+import struct
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Callable
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.hmac import HMAC
 
+from password_manager.util.metrics import BYTE_BUCKETS, REGISTRY
+
 
 class UnlockKey(ABC):
     """Abstract base class that defines what an unlock key is."""
@@ -39,6 +46,32 @@ class SimpleUnlockKey(UnlockKey):
         return self.__h.digest()
 
 
+def _measured[**P, R](payload_size: Callable[..., int]) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Record how long the function takes and, with `payload_size` of its first argument, how much it got"""
+
+    def decorate(fn: Callable[P, R]) -> Callable[P, R]:
+        seconds = REGISTRY.histogram("crypto_seconds", "time spent encrypting and decrypting", op=fn.__name__)
+        sizes = REGISTRY.histogram(
+            "crypto_payload_bytes", "size of what was encrypted or decrypted", buckets=BYTE_BUCKETS, op=fn.__name__
+        )
+
+        payload = next(iter(inspect.signature(fn).parameters))
+
+        @functools.wraps(fn)
+        def measured(*args: P.args, **kwargs: P.kwargs) -> R:
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                seconds.observe(time.perf_counter() - start)
+                sizes.observe(payload_size(args[0] if args else kwargs[payload]))
+
+        return measured
+
+    return decorate
+
+
+@_measured(len)
 def encrypt_data(data: bytes, key: UnlockKey) -> bytes:
     """Encrypt and sign data using key.
 
@@ -54,6 +87,7 @@ def encrypt_data(data: bytes, key: UnlockKey) -> bytes:
     return sign_data(encrypted, k2)
 
 
+@_measured(len)
 def decrypt_data(data: bytes, key: UnlockKey) -> bytes:
     """Validate signature and decrypt data using key.
 
@@ -83,6 +117,9 @@ def aes_decrypt(iv: bytes, data: bytes, key: bytes) -> bytes:
     return decryptor.update(data) + decryptor.finalize()
 
 
+SIGNATURE_SIZE = 32  # sha256 hmac
+
+
 def sign_data(data: bytes, key: bytes) -> bytes:
     """sha256 hmac, returns [signature][data]"""
     h = HMAC(key, hashes.SHA256(), backend=default_backend())
@@ -103,3 +140,100 @@ def validate_signature(data: bytes, key: bytes) -> bytes:
     # should raise if invalid
     h.verify(data[:32])
     return data[32:]
+
+
+class SignatureVerifier:
+    """validate_signature for a [signature][data] blob that arrives in pieces, without holding on to it"""
+
+    def __init__(self, key: bytes) -> None:
+        self._h = HMAC(key, hashes.SHA256(), backend=default_backend())
+        self.signature = b""
+
+    def update(self, chunk: bytes) -> None:
+        """Feed the next piece of the blob"""
+        if len(self.signature) < SIGNATURE_SIZE:
+            needed = SIGNATURE_SIZE - len(self.signature)
+            self.signature += chunk[:needed]
+            chunk = chunk[needed:]
+        self._h.update(chunk)
+
+    def verify(self) -> None:
+        """
+        Check the signature once everything has been fed in
+
+        :raises: cryptography.exceptions.InvalidSignature
+        """
+        self._h.verify(self.signature)
+
+
+SEGMENTED_MAGIC = b"PJSEGS\x00\x01"
+_SEGMENT_LENGTH = struct.Struct(">I")
+_IV_SIZE = 16
+
+
+@_measured(lambda segments: sum(map(len, segments)))
+def encrypt_segments(segments: list[bytes], key: UnlockKey) -> bytes:
+    """Encrypt and sign a list of segments, so a segment that didn't change encrypts to the same bytes.
+
+    The result will be [signature][magic]([length][iv][data])*. Each iv is an hmac of the segment's
+    plaintext (a synthetic iv, like SIV mode), so an edit only changes the bytes of the segments it
+    touched and deltas between saves stay small. The price is that equal segments are visibly equal.
+    """
+    k1 = key.generate_key()
+    if len(k1) < 32:
+        raise ValueError("we require at least 256 bits for a key")
+    k2 = k1[: len(k1) // 2]  # we use this part to sign
+    k3 = k1[len(k1) // 2 :]
+    iv_key = sign_data(b"segment iv", k2)[:SIGNATURE_SIZE]
+    parts = [SEGMENTED_MAGIC]
+    for segment in segments:
+        iv = sign_data(segment, iv_key)[:_IV_SIZE]
+        parts.append(_SEGMENT_LENGTH.pack(len(segment)) + iv + aes_encrypt(iv, segment, k3))
+    return sign_data(b"".join(parts), k2)
+
+
+@_measured(len)
+def decrypt_segments(data: bytes, key: UnlockKey) -> list[bytes]:
+    """Validate signature and decrypt what encrypt_segments made
+
+    :raises: cryptography.exceptions.InvalidSignature, ValueError if it isn't segmented
+    """
+    k1 = key.generate_key()
+    if len(k1) < 32:
+        raise ValueError("we require at least 256 bits for a key")
+    k2 = k1[: len(k1) // 2]  # we use this part to sign
+    k3 = k1[len(k1) // 2 :]
+    data = validate_signature(data, k2)
+    if not data.startswith(SEGMENTED_MAGIC):
+        raise ValueError("not segmented data")
+    segments = []
+    for start, end in _frames(data, len(SEGMENTED_MAGIC)):
+        iv = data[start + _SEGMENT_LENGTH.size : start + _SEGMENT_LENGTH.size + _IV_SIZE]
+        segments.append(aes_decrypt(iv, data[start + _SEGMENT_LENGTH.size + _IV_SIZE : end], k3))
+    return segments
+
+
+def is_segmented(data: bytes) -> bool:
+    """Did encrypt_segments make this, rather than encrypt_data"""
+    return data[SIGNATURE_SIZE : SIGNATURE_SIZE + len(SEGMENTED_MAGIC)] == SEGMENTED_MAGIC
+
+
+def segment_spans(data: bytes) -> list[tuple[int, int]]:
+    """[start, end) of each encrypted segment in encrypt_segments output, without needing the key"""
+    if not is_segmented(data):
+        return []
+    return _frames(data, SIGNATURE_SIZE + len(SEGMENTED_MAGIC))
+
+
+def _frames(data: bytes, pos: int) -> list[tuple[int, int]]:
+    spans = []
+    while pos < len(data):
+        if pos + _SEGMENT_LENGTH.size > len(data):
+            raise ValueError("truncated segment")
+        (length,) = _SEGMENT_LENGTH.unpack_from(data, pos)
+        end = pos + _SEGMENT_LENGTH.size + _IV_SIZE + length
+        if end > len(data):
+            raise ValueError("truncated segment")
+        spans.append((pos, end))
+        pos = end
+    return spans
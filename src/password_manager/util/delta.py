@@ -0,0 +1,102 @@
+"""Binary deltas between two versions of a vault blob.
+
+A delta is `DELTA_MAGIC` followed by ops, each either
+    b"C" [offset u64][length u64]   copy that many bytes of the base, from offset
+    b"I" [length u64][bytes]        insert these bytes
+which, run in order, write out the new blob.
+"""
+
+import hashlib
+import struct
+from collections.abc import Callable, Iterable, Iterator
+
+from password_manager.util.exceptions import VaultDeltaError
+
+DELTA_MAGIC = b"PJDELTA\x01"
+DELTA_MEDIA_TYPE = "application/vnd.password-jam.delta"
+
+_COPY = struct.Struct(">cQQ")
+_INSERT = struct.Struct(">cQ")
+
+
+def fixed_blocks(data: bytes, block_size: int = 4096) -> Iterable[tuple[int, int]]:
+    """Split into fixed size blocks, only any good when edits don't shift what follows them"""
+    return ((pos, min(pos + block_size, len(data))) for pos in range(0, len(data), block_size))
+
+
+def make_delta(base: bytes, new: bytes, split: Callable[[bytes], Iterable[tuple[int, int]]] = fixed_blocks) -> bytes:
+    """A delta turning `base` into `new`
+
+    Both are cut into pieces with `split`, pieces of `new` that also appear in `base` are copied and
+    everything else is inserted. Gaps between pieces are inserted too.
+    """
+    index: dict[bytes, int] = {}
+    for start, end in split(base):
+        index.setdefault(hashlib.blake2b(base[start:end], digest_size=16).digest(), start)
+
+    ops: list[bytes] = [DELTA_MAGIC]
+    copy: tuple[int, int] | None = None  # pending (offset, length), so runs of neighbouring pieces merge
+    insert = bytearray()
+
+    def flush() -> None:
+        nonlocal copy
+        if copy is not None:
+            ops.append(_COPY.pack(b"C", *copy))
+            copy = None
+        if insert:
+            ops.append(_INSERT.pack(b"I", len(insert)) + insert)
+            insert.clear()
+
+    pos = 0
+    for start, end in [*split(new), (len(new), len(new))]:
+        if start > pos:
+            if copy is not None:
+                flush()
+            insert += new[pos:start]
+        piece = new[start:end]
+        offset = index.get(hashlib.blake2b(piece, digest_size=16).digest()) if piece else None
+        if offset is not None and base[offset : offset + len(piece)] == piece:
+            if copy is not None and copy[0] + copy[1] == offset:
+                copy = (copy[0], copy[1] + len(piece))
+            else:
+                flush()
+                copy = (offset, len(piece))
+        elif piece:
+            if copy is not None:
+                flush()
+            insert += piece
+        pos = max(pos, end)
+    flush()
+    return b"".join(ops)
+
+
+def apply_delta(delta: bytes, base_size: int, read_base: Callable[[int, int], Iterable[bytes]]) -> Iterator[bytes]:
+    """The new blob, a chunk at a time. `read_base(start, end)` gives the base's bytes in [start, end)
+
+    :raises: VaultDeltaError if the delta is malformed or reaches outside the base
+    """
+    if not delta.startswith(DELTA_MAGIC):
+        raise VaultDeltaError("Not a vault delta")
+    view = memoryview(delta)
+    pos = len(DELTA_MAGIC)
+    while pos < len(delta):
+        op = delta[pos : pos + 1]
+        if op == b"C":
+            if pos + _COPY.size > len(delta):
+                raise VaultDeltaError("Truncated copy")
+            _, offset, length = _COPY.unpack_from(delta, pos)
+            pos += _COPY.size
+            if offset + length > base_size:
+                raise VaultDeltaError("Copy reaches past the end of the base")
+            yield from read_base(offset, offset + length)
+        elif op == b"I":
+            if pos + _INSERT.size > len(delta):
+                raise VaultDeltaError("Truncated insert")
+            _, length = _INSERT.unpack_from(delta, pos)
+            pos += _INSERT.size
+            if pos + length > len(delta):
+                raise VaultDeltaError("Truncated insert")
+            yield bytes(view[pos : pos + length])
+            pos += length
+        else:
+            raise VaultDeltaError(f"Unknown delta op {op!r}")
@@ -2,9 +2,50 @@ class VaultReadError(Exception):
     """Failure to read a vault."""
 
 
+class InvalidVaultIdError(ValueError):
+    """A vault id the backend can't store a vault under, like one that would escape its directory."""
+
+
 class VaultSaveError(Exception):
     """Failure to save a vault."""
 
 
+class VaultExistsError(VaultSaveError):
+    """A vault of that id is already there, so it can't be created."""
+
+
 class VaultValidationError(Exception):
     """Signature related issue."""
+
+
+class VaultConflictError(Exception):
+    """The vault changed since the version the writer based its save on."""
+
+
+class VaultTooLargeError(Exception):
+    """The vault being saved is over the size limit."""
+
+
+class UploadOffsetError(Exception):
+    """A resumed upload sent data for an offset it isn't at."""
+
+
+class UploadLimitError(Exception):
+    """Starting another resumable upload would go over the limits on them."""
+
+    def __init__(self, message: str, out_of_space: bool = False):
+        super().__init__(message)
+        self.out_of_space = out_of_space  # all uploads together, rather than this vault having too many open
+
+
+class VaultDeltaError(Exception):
+    """A delta that can't be applied to the vault it was sent for."""
+
+
+class RequestRejectedError(Exception):
+    """Admission control turned a request away, it can try again after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float, overloaded: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.overloaded = overloaded  # the whole server is busy, rather than this client or vault being too busy
@@ -0,0 +1,251 @@
+"""Cheap in-process instrumentation.
+
+Every metric registers itself with `REGISTRY` when made, which renders them all in the OpenMetrics text
+format for `/api/metrics`. Metrics made by the same name and labels (a cache per storage backend, say) are
+added up into one series. Metrics that aren't some object's own, like the per-operation storage timings,
+come from `REGISTRY.counter(...)` and friends, which hand out the same one for the same name and labels.
+"""
+
+import bisect
+import math
+import threading
+import weakref
+from collections.abc import Iterable
+
+# seconds, from "didn't wait at all" up to "something is badly stuck"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# bytes, from a freshly made vault up to well past any sane one
+BYTE_BUCKETS = tuple(float(4**power) for power in range(5, 15))
+
+
+class Counter:
+    """A monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str = "",
+        labels: dict[str, str] | None = None,
+        registry: "Registry | None" = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels or {}
+        self._value = 0
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def inc(self, amount: int = 1) -> None:
+        """Add to the count"""
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Gauge:
+    """A value that goes up and down, like how many requests are in flight"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str = "",
+        labels: dict[str, str] | None = None,
+        registry: "Registry | None" = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels or {}
+        self._value = 0
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Histogram:
+    """Counts observations into cumulative `le` buckets, prometheus style"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str = "",
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        labels: dict[str, str] | None = None,
+        registry: "Registry | None" = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        # per bucket rather than cumulative, so an observation touches one slot. The last one is +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def observe(self, value: float) -> None:
+        """Record one observation"""
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._count += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """(upper bound, observations <= bound) pairs, ending with +Inf"""
+        with self._lock:
+            counts = list(self._counts)
+        result = []
+        total = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts, strict=True):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """Rough quantile, the upper bound of the bucket the q-th observation lands in"""
+        target = q * self._count
+        for bound, count in self.cumulative():
+            if count >= target:
+                return bound
+        return float("inf")
+
+
+type Metric = Counter | Gauge | Histogram
+
+
+class Registry:
+    """Every metric made in this process, for rendering in the OpenMetrics text format.
+
+    Metrics belonging to an object are only held weakly and go when it does.
+    """
+
+    def __init__(self):
+        self._metrics: weakref.WeakSet[Metric] = weakref.WeakSet()
+        self._families: dict[str, tuple[str, tuple[float, ...] | None]] = {}  # name -> (kind, buckets)
+        self._shared: dict[tuple[str, tuple[tuple[str, str], ...]], Metric] = {}
+        self._lock = threading.RLock()
+
+    def register(self, metric: Metric) -> None:
+        """Include a metric, one of an existing name must be of the same kind (and buckets)"""
+        family = (metric.kind, getattr(metric, "buckets", None))
+        with self._lock:
+            if self._families.setdefault(metric.name, family) != family:
+                raise ValueError(
+                    f"Metric '{metric.name}' already exists as a different {self._families[metric.name][0]}"
+                )
+            self._metrics.add(metric)
+
+    def counter(self, name: str, documentation: str = "", **labels: str) -> Counter:
+        """The process wide counter with this name and labels"""
+        return self._shared_metric(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str = "", **labels: str) -> Gauge:
+        """The process wide gauge with this name and labels"""
+        return self._shared_metric(Gauge, name, documentation, labels)
+
+    def histogram(
+        self, name: str, documentation: str = "", buckets: tuple[float, ...] = DEFAULT_BUCKETS, **labels: str
+    ) -> Histogram:
+        """The process wide histogram with this name and labels"""
+        return self._shared_metric(Histogram, name, documentation, labels, buckets=buckets)
+
+    def _shared_metric[M: Metric](
+        self, cls: type[M], name: str, documentation: str, labels: dict[str, str], **kwargs: tuple[float, ...]
+    ) -> M:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._shared.get(key)
+            if metric is None:
+                metric = self._shared[key] = cls(name, documentation, labels=labels, registry=self, **kwargs)
+        if not isinstance(metric, cls):
+            raise ValueError(f"Metric '{name}' already exists as a {metric.kind}")
+        return metric
+
+    def exposition(self) -> str:
+        """Everything, in the OpenMetrics text format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        families: dict[str, list[Metric]] = {}
+        for metric in metrics:
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name in sorted(families):
+            members = families[name]
+            lines.append(f"# TYPE {name} {members[0].kind}")
+            if documentation := next((m.documentation for m in members if m.documentation), ""):
+                lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.extend(_samples(name, members))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _samples(name: str, members: list[Metric]) -> Iterable[str]:
+    """A family's sample lines, adding up the metrics that have the same labels"""
+    by_labels: dict[tuple[tuple[str, str], ...], list[Metric]] = {}
+    for metric in members:
+        by_labels.setdefault(tuple(sorted(metric.labels.items())), []).append(metric)
+    for labels, same in sorted(by_labels.items()):
+        first = same[0]
+        if isinstance(first, Histogram):
+            buckets = [0] * (len(first.buckets) + 1)
+            total = 0.0
+            for histogram in same:
+                total += histogram.sum
+                for i, (_, count) in enumerate(histogram.cumulative()):
+                    buckets[i] += count
+            for bound, count in zip((*first.buckets, float("inf")), buckets, strict=True):
+                yield f"{name}_bucket{_labels((*labels, ('le', _number(bound))))} {count}"
+            yield f"{name}_count{_labels(labels)} {buckets[-1]}"
+            yield f"{name}_sum{_labels(labels)} {_number(total)}"
+        else:
+            suffix = "_total" if first.kind == "counter" else ""
+            yield f"{name}{suffix}{_labels(labels)} {sum(metric.value for metric in same)}"
+
+
+def _labels(labels: Iterable[tuple[str, str]]) -> str:
+    rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{{{rendered}}}" if rendered else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+"""All of this process's metrics"""
@@ -0,0 +1,97 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from password_manager.app.admission import AdmissionControl, RateLimiter
+from password_manager.util.exceptions import RequestRejectedError
+from password_manager.util.metrics import Registry
+
+
+class TestRateLimiter(TestCase):
+    def test_bucket(self):
+        limiter = RateLimiter(rate=10, burst=3)
+        with patch("time.monotonic", return_value=100.0):
+            self.assertEqual([limiter.acquire("a") for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(limiter.acquire("a"), 0.1)
+            # everyone has their own bucket
+            self.assertEqual(limiter.acquire("b"), 0)
+        with patch("time.monotonic", return_value=100.2):
+            self.assertEqual(limiter.acquire("a"), 0)
+
+    def test_forgets_old_keys(self):
+        limiter = RateLimiter(rate=1, burst=1, max_keys=2)
+        for key in "abc":
+            limiter.acquire(key)
+        self.assertEqual(list(limiter._buckets), ["b", "c"])
+
+    def test_refund(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        with patch("time.monotonic", return_value=100.0):
+            limiter.acquire("a")
+            limiter.refund("a")
+            limiter.refund("a")
+            self.assertEqual([limiter.acquire("a") for _ in range(2)], [0, 0])
+            self.assertEqual(limiter.acquire("a"), 1)
+
+
+class TestAdmissionControl(TestCase):
+    def test_vault_queue(self):
+        admission = AdmissionControl(vault_queue=2)
+        with admission.admit("vault", "client"), admission.admit("vault", "client"):
+            with self.assertRaises(RequestRejectedError) as e:
+                with admission.admit("vault", "client"):
+                    pass
+            self.assertFalse(e.exception.overloaded)
+            # other vaults don't care
+            with admission.admit("other", "client"):
+                self.assertEqual(admission.in_flight.value, 3)
+        self.assertEqual((admission.in_flight.value, admission._per_vault), (0, {}))
+        self.assertEqual(admission.rejected["vault_queue"].value, 1)
+
+    def test_rejections_share_a_metric(self):
+        registry = Registry()
+        with patch("password_manager.util.metrics.REGISTRY", registry):
+            admission = AdmissionControl(vault_queue=1)
+        with admission.admit("vault", "client"), self.assertRaises(RequestRejectedError):
+            with admission.admit("vault", "client"):
+                pass
+        lines = registry.exposition().splitlines()
+        self.assertIn("# TYPE admission_rejected counter", lines)
+        self.assertIn('admission_rejected_total{reason="vault_queue"} 1', lines)
+        self.assertIn('admission_rejected_total{reason="overloaded"} 0', lines)
+
+    def test_max_in_flight(self):
+        admission = AdmissionControl(max_in_flight=1)
+        with admission.admit(None, "client"):
+            with self.assertRaises(RequestRejectedError) as e:
+                with admission.admit("vault", "client"):
+                    pass
+        self.assertTrue(e.exception.overloaded)
+        with admission.admit("vault", "client"):
+            pass
+
+    def test_rate_limits(self):
+        admission = AdmissionControl(client_rate=0.5, client_burst=1)
+        with admission.admit("vault", "client"):
+            pass
+        with self.assertRaises(RequestRejectedError) as e:
+            with admission.admit("vault", "client"):
+                pass
+        self.assertEqual(e.exception.retry_after, 2)
+        with admission.admit("vault", "another client"):
+            pass
+        self.assertEqual(admission.admitted.value, 2)
+
+    def test_rejected_requests_keep_their_token(self):
+        admission = AdmissionControl(vault_queue=1, client_rate=0.5, client_burst=2, vault_rate=0.5, vault_burst=1)
+        with admission.admit("vault", "client"):
+            # turned away for the busy vault, again and again, without using up the client's second token
+            for _ in range(3):
+                with self.assertRaises(RequestRejectedError), admission.admit("vault", "client"):
+                    pass
+        # nor by the vault's own rate limit
+        with self.assertRaises(RequestRejectedError), admission.admit("vault", "client"):
+            pass
+        self.assertEqual(admission.rejected["vault_rate"].value, 1)
+        with admission.admit("other", "client"):
+            pass
+        self.assertEqual(admission.admitted.value, 2)
@@ -1,10 +1,21 @@
+import base64
+import json
+import os
+import secrets
+import tempfile
+import time
+from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 from fastapi.testclient import TestClient
 
 import main
+from password_manager.app import server
+from password_manager.app.admission import AdmissionControl, get_admission
 from password_manager.backend import vault
-from password_manager.backend.database import get_vault_storage
-from password_manager.util import crypto
+from password_manager.backend.async_storage import ThreadedStorage, get_async_vault_storage
+from password_manager.backend.database import FileStorage, get_vault_storage
+from password_manager.util import crypto, delta
 
 class TestAPI(TestCase):
     def setUp(self):
@@ -15,12 +26,71 @@ class TestAPI(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {'status':'ok'})
 
+    def test_metrics(self):
+        self.client.get('/api/vaults/non-existant-vault')
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('application/openmetrics-text'))
+        lines = response.text.splitlines()
+        self.assertEqual(lines[-1], '# EOF')
+        self.assertIn('# TYPE vault_storage_seconds histogram', lines)
+        self.assertTrue(any(line.startswith('vault_storage_errors_total{error="VaultReadError",op="open_stream"}') for line in lines))
+
+    def test_reserved_id(self):
+        self.assertEqual(self.client.get('/api/vaults/some-vault.revs').status_code, 400)
+        self.assertEqual(self.client.post('/api/vaults/some-vault.secret').status_code, 400)
+        self.assertEqual(self.client.get('/api/vaults/.index.sqlite3').status_code, 400)
+
+    def test_storage_secret_is_not_a_vault(self):
+        # the generated secret lands in the default vault dir, so it must stay unreachable through the API
+        tmp = tempfile.TemporaryDirectory()
+        name = Path(server.DEFAULT_SECRET_PATH).name
+        main.fastapi_app.dependency_overrides[get_async_vault_storage] = lambda: ThreadedStorage(FileStorage(tmp.name))
+        try:
+            with patch.dict(os.environ, {'PASSWORD_JAM_STORAGE_SECRET_PATH': str(Path(tmp.name, name))}):
+                os.environ.pop('PASSWORD_JAM_STORAGE_SECRET', None)
+                secret = server.storage_secret()
+            for method, path in (
+                ('GET', f'/api/vaults/{name}'),
+                ('PATCH', f'/api/vaults/{name}'),
+                ('POST', f'/api/vaults/{name}'),
+                ('GET', f'/api/vaults/{name}/revisions'),
+                ('POST', f'/api/vaults/{name}/uploads'),
+            ):
+                response = self.client.request(method, path, headers={'If-Match': '*', 'Upload-Length': '1'})
+                self.assertEqual(response.status_code, 400, path)
+                self.assertNotIn(secret, response.text)
+            response = self.client.post('/api/vaults:batchGet', json={'vault_ids': [name]})
+            self.assertEqual(json.loads(response.text)['status'], 400)
+            self.assertNotIn(secret, response.text)
+        finally:
+            main.fastapi_app.dependency_overrides.pop(get_async_vault_storage)
+            tmp.cleanup()
+
+    def test_create_race(self):
+        # both creates got past the exists check, the one that loses the race still gets a 409
+        tmp = tempfile.TemporaryDirectory()
+        threaded = ThreadedStorage(FileStorage(tmp.name))
+        main.fastapi_app.dependency_overrides[get_async_vault_storage] = lambda: threaded
+        try:
+            threaded.sync.create('raced-vault')
+
+            async def not_yet(vault_id):
+                return False
+
+            with patch.object(threaded, 'aexists', not_yet):
+                response = self.client.post('/api/vaults/raced-vault')
+            self.assertEqual(response.status_code, 409)
+        finally:
+            main.fastapi_app.dependency_overrides.pop(get_async_vault_storage)
+            tmp.cleanup()
+
     def test_bad_read(self):
         response = self.client.get('/api/vaults/non-existant-vault')
         self.assertEqual(response.status_code, 404)
 
     def test_bad_write(self):
-        response = self.client.patch('/api/vaults/non-existant-vault', content=b'blabla')
+        response = self.client.patch('/api/vaults/non-existant-vault', content=b'blabla', headers={'If-Match': '*'})
         self.assertEqual(response.status_code, 404)
 
     def test_create_then_manage(self):
@@ -32,6 +102,7 @@ class TestAPI(TestCase):
             # create it...
             response = self.client.post('/api/vaults/test-vault')
             self.assertEqual(response.status_code, 201)
+            etag = response.headers['ETag']
             body = response.json()
             self.assertIsNotNone(body)
             self.assertTrue(body.get('vault_id'), 'test-vault')
@@ -47,6 +118,7 @@ class TestAPI(TestCase):
             # validate we can read it now....
             response = self.client.get('/api/vaults/test-vault')
             self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['ETag'], etag)
             # we want to be sure we have no secret in our response...
             self.assertFalse(secret in response.text)
 
@@ -58,11 +130,20 @@ class TestAPI(TestCase):
 
             encrypted = vault.encrypt_vault(v, key)
             double_signed_vault = crypto.sign_data(encrypted, v.vault_secret.encode('utf-8'))
-            response = self.client.patch('/api/vaults/test-vault', content=double_signed_vault)
+            response = self.client.patch('/api/vaults/test-vault', content=double_signed_vault, headers={'If-Match': etag})
             self.assertEqual(response.status_code, 200)
+            new_etag = response.headers['ETag']
+            self.assertNotEqual(new_etag, etag)
+
+            # saving on top of a version we never saw is a conflict...
+            response = self.client.patch('/api/vaults/test-vault', content=double_signed_vault, headers={'If-Match': etag})
+            self.assertEqual(response.status_code, 412)
+            # ...and not saying what we saw at all isn't allowed
+            response = self.client.patch('/api/vaults/test-vault', content=double_signed_vault)
+            self.assertEqual(response.status_code, 428)
 
             # now try it with a bad key
-            response = self.client.patch('/api/vaults/test-vault', content=encrypted)
+            response = self.client.patch('/api/vaults/test-vault', content=encrypted, headers={'If-Match': new_etag})
             self.assertEqual(response.status_code, 401)
 
         finally:
@@ -72,3 +153,272 @@ class TestAPI(TestCase):
                 (base / "test-vault.secret").unlink()
             except:
                 pass
+
+    def test_revisions(self):
+        # history is opt-in, so this gets a store of its own that keeps some
+        tmp = tempfile.TemporaryDirectory()
+        storage = FileStorage(tmp.name, history=3, compact_interval=0)
+        threaded = ThreadedStorage(storage)
+        main.fastapi_app.dependency_overrides[get_async_vault_storage] = lambda: threaded
+        vault_id = f"test-revisions-{secrets.token_hex(4)}"
+        try:
+            secret = self.client.post(f'/api/vaults/{vault_id}').json()['vault_secret'].encode('utf-8')
+            saved = crypto.sign_data(b'saved', secret)
+            response = self.client.patch(f'/api/vaults/{vault_id}', content=saved, headers={'If-Match': '*'})
+            self.assertEqual(response.status_code, 200)
+
+            response = self.client.get(f'/api/vaults/{vault_id}/revisions')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([r['revision'] for r in response.json()], [1, 2])
+
+            # restoring is fetching an old revision and saving it back
+            response = self.client.get(f'/api/vaults/{vault_id}/revisions/1')
+            self.assertEqual(response.content, crypto.sign_data(b'', secret))
+            response = self.client.patch(f'/api/vaults/{vault_id}', content=response.content, headers={'If-Match': '*'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(f'/api/vaults/{vault_id}').content, crypto.sign_data(b'', secret))
+
+            self.assertEqual(self.client.get(f'/api/vaults/{vault_id}/revisions/9').status_code, 404)
+            self.assertEqual(self.client.get('/api/vaults/non-existant-vault/revisions').status_code, 404)
+        finally:
+            del main.fastapi_app.dependency_overrides[get_async_vault_storage]
+            threaded.close()
+            storage.close()
+            tmp.cleanup()
+
+    def test_conditional_get(self):
+        storage = next(get_vault_storage())
+        vault_id = f"test-conditional-{secrets.token_hex(4)}"
+        try:
+            self.client.post(f'/api/vaults/{vault_id}')
+            response = self.client.get(f'/api/vaults/{vault_id}')
+            etag = response.headers['ETag']
+
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response.headers['ETag'], etag)
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'If-None-Match': f'"0-nope", W/{etag}'})
+            self.assertEqual(response.status_code, 304)
+
+            # a stale etag gets the full vault again
+            secret = storage.get_secret(vault_id).encode('utf-8')
+            self.client.patch(f'/api/vaults/{vault_id}', content=crypto.sign_data(b'new', secret), headers={'If-Match': etag})
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, crypto.sign_data(b'new', secret))
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+            # and a deleted then recreated vault doesn't match the old one's etag, even at the same version
+            storage.delete(vault_id)
+            self.client.post(f'/api/vaults/{vault_id}')
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+
+            self.assertEqual(self.client.get('/api/vaults/non-existant-vault', headers={'If-None-Match': etag}).status_code, 404)
+        finally:
+            storage.delete(vault_id)
+
+    def test_range(self):
+        storage = next(get_vault_storage())
+        vault_id = f"test-range-{secrets.token_hex(4)}"
+        try:
+            self.client.post(f'/api/vaults/{vault_id}')
+            secret = storage.get_secret(vault_id).encode('utf-8')
+            data = crypto.sign_data(bytes(range(256)) * 10, secret)
+            self.client.patch(f'/api/vaults/{vault_id}', content=data, headers={'If-Match': '*'})
+
+            response = self.client.get(f'/api/vaults/{vault_id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, data)
+            self.assertEqual(response.headers['Content-Length'], str(len(data)))
+            self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+            etag = response.headers['ETag']
+
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'Range': 'bytes=100-199'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.content, data[100:200])
+            self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(data)}')
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'Range': 'bytes=-10', 'If-Range': etag})
+            self.assertEqual((response.status_code, response.content), (206, data[-10:]))
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'Range': f'bytes={len(data) - 5}-'})
+            self.assertEqual((response.status_code, response.content), (206, data[-5:]))
+
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'Range': f'bytes={len(data)}-'})
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response.headers['Content-Range'], f'bytes */{len(data)}')
+
+            # resuming against a vault that changed since gets the whole thing
+            response = self.client.get(f'/api/vaults/{vault_id}', headers={'Range': 'bytes=100-', 'If-Range': '"0-stale"'})
+            self.assertEqual((response.status_code, response.content), (200, data))
+        finally:
+            storage.delete(vault_id)
+
+    def test_upload_limits(self):
+        storage = next(get_vault_storage())
+        vault_id = f"test-upload-{secrets.token_hex(4)}"
+        try:
+            self.client.post(f'/api/vaults/{vault_id}')
+            secret = storage.get_secret(vault_id).encode('utf-8')
+            with patch.dict('os.environ', {'PASSWORD_JAM_MAX_VAULT_BYTES': '1000'}):
+                response = self.client.patch(f'/api/vaults/{vault_id}', content=crypto.sign_data(b'x' * 2000, secret), headers={'If-Match': '*'})
+                self.assertEqual(response.status_code, 413)
+                # no Content-Length to go on, it gets cut off as it streams in instead
+                chunks = iter([crypto.sign_data(b'x' * 2000, secret)[i:i + 100] for i in range(0, 2032, 100)])
+                response = self.client.patch(f'/api/vaults/{vault_id}', content=chunks, headers={'If-Match': '*'})
+                self.assertEqual(response.status_code, 413)
+                response = self.client.patch(f'/api/vaults/{vault_id}', content=crypto.sign_data(b'x' * 500, secret), headers={'If-Match': '*'})
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(storage.read(vault_id).vault_data, crypto.sign_data(b'x' * 500, secret))
+        finally:
+            storage.delete(vault_id)
+
+    def test_resumable_upload(self):
+        storage = next(get_vault_storage())
+        vault_id = f"test-resumable-{secrets.token_hex(4)}"
+        try:
+            etag = self.client.post(f'/api/vaults/{vault_id}').headers['ETag']
+            secret = storage.get_secret(vault_id).encode('utf-8')
+            data = crypto.sign_data(os.urandom(5000), secret)
+
+            response = self.client.post(f'/api/vaults/{vault_id}/uploads', headers={'Upload-Length': str(len(data)), 'If-Match': etag})
+            self.assertEqual(response.status_code, 201)
+            location = response.headers['Location']
+            response = self.client.put(location, content=data[:2000], headers={'Upload-Offset': '0'})
+            self.assertEqual((response.status_code, response.headers['Upload-Offset']), (204, '2000'))
+
+            # the connection "dropped", so the client asks where it got to and resends from there
+            response = self.client.head(location)
+            self.assertEqual(response.headers['Upload-Offset'], '2000')
+            self.assertEqual(self.client.put(location, content=data[:2000], headers={'Upload-Offset': '0'}).status_code, 409)
+            self.assertEqual(self.client.post(f'{location}/finalize').status_code, 409)
+            self.client.put(location, content=data[2000:], headers={'Upload-Offset': '2000'})
+
+            response = self.client.post(f'{location}/finalize')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            self.assertEqual(self.client.get(f'/api/vaults/{vault_id}').content, data)
+            self.assertEqual(self.client.head(location).status_code, 404)
+
+            # still signature checked at the end
+            response = self.client.post(f'/api/vaults/{vault_id}/uploads', headers={'Upload-Length': '100', 'If-Match': '*'})
+            location = response.headers['Location']
+            self.client.put(location, content=crypto.sign_data(b'x' * 68, b'not the secret'), headers={'Upload-Offset': '0'})
+            self.assertEqual(self.client.post(f'{location}/finalize').status_code, 401)
+            self.assertEqual(self.client.get(f'/api/vaults/{vault_id}').content, data)
+
+            self.assertEqual(self.client.post('/api/vaults/non-existant-vault/uploads', headers={'Upload-Length': '100', 'If-Match': '*'}).status_code, 404)
+        finally:
+            storage.delete(vault_id)
+
+    def test_upload_session_limits(self):
+        storage = next(get_vault_storage())
+        vault_id = f"test-upload-limits-{secrets.token_hex(4)}"
+        tmp = tempfile.TemporaryDirectory()
+        limits = {'PASSWORD_JAM_UPLOAD_PATH': tmp.name, 'PASSWORD_JAM_UPLOAD_MAX_PER_VAULT': '2', 'PASSWORD_JAM_UPLOAD_MAX_PENDING_BYTES': '1000'}
+        try:
+            self.client.post(f'/api/vaults/{vault_id}')
+            with patch.dict('os.environ', limits):
+                start = lambda length: self.client.post(f'/api/vaults/{vault_id}/uploads', headers={'Upload-Length': str(length), 'If-Match': '*'})
+                self.assertEqual(start(600).status_code, 201)
+                self.assertEqual(start(600).status_code, 507)
+                self.assertEqual(start(100).status_code, 201)
+                self.assertEqual(start(100).status_code, 429)
+        finally:
+            storage.delete(vault_id)
+            tmp.cleanup()
+
+    def test_delta_save(self):
+        storage = next(get_vault_storage())
+        vault_id = f"test-delta-{secrets.token_hex(4)}"
+        try:
+            self.client.post(f'/api/vaults/{vault_id}')
+            secret = storage.get_secret(vault_id).encode('utf-8')
+            base = crypto.sign_data(os.urandom(20_000), secret)
+            etag = self.client.patch(f'/api/vaults/{vault_id}', content=base, headers={'If-Match': '*'}).headers['ETag']
+
+            new = crypto.sign_data(base[32:10_000] + b'an edit' + base[10_000:], secret)
+            patch = delta.make_delta(base, new)
+            headers = {'If-Match': etag, 'Content-Type': delta.DELTA_MEDIA_TYPE}
+            response = self.client.patch(f'/api/vaults/{vault_id}', content=patch, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(f'/api/vaults/{vault_id}').content, new)
+
+            # the base has moved on now
+            self.assertEqual(self.client.patch(f'/api/vaults/{vault_id}', content=patch, headers=headers).status_code, 412)
+            headers['If-Match'] = response.headers['ETag']
+            self.assertEqual(self.client.patch(f'/api/vaults/{vault_id}', content=b'garbage', headers=headers).status_code, 400)
+            # a delta that makes something not signed with the vault secret
+            bad = delta.make_delta(new, crypto.sign_data(b'whatever', b'not the secret'))
+            self.assertEqual(self.client.patch(f'/api/vaults/{vault_id}', content=bad, headers=headers).status_code, 401)
+            self.assertEqual(self.client.get(f'/api/vaults/{vault_id}').content, new)
+        finally:
+            storage.delete(vault_id)
+
+    def test_batches(self):
+        storage = next(get_vault_storage())
+        vault_ids = [f"test-batch-{secrets.token_hex(4)}" for _ in range(3)]
+        try:
+            storage.create(vault_ids[0])
+            response = self.client.post('/api/vaults:batchCreate', json={'vault_ids': vault_ids})
+            self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+            created = [json.loads(line) for line in response.text.splitlines()]
+            self.assertEqual([item['status'] for item in created], [409, 201, 201])
+            self.assertEqual(created[1]['etag'], self.client.get(f'/api/vaults/{vault_ids[1]}').headers['ETag'])
+
+            response = self.client.post('/api/vaults:batchExists', json={'vault_ids': [vault_ids[1], 'non-existant-vault']})
+            self.assertEqual([json.loads(line) for line in response.text.splitlines()], [
+                {'vault_id': vault_ids[1], 'status': 200, 'exists': True},
+                {'vault_id': 'non-existant-vault', 'status': 200, 'exists': False},
+            ])
+
+            response = self.client.post('/api/vaults:batchGet', json={'vault_ids': [vault_ids[2], 'non-existant-vault']})
+            got = [json.loads(line) for line in response.text.splitlines()]
+            self.assertEqual(base64.b64decode(got[0]['vault_data']), storage.read(vault_ids[2]).vault_data)
+            self.assertEqual(got[1]['status'], 404)
+        finally:
+            for vault_id in vault_ids:
+                storage.delete(vault_id)
+
+    def test_list_vaults(self):
+        storage = next(get_vault_storage())
+        since = time.time()
+        vault_ids = sorted(f"test-list-{secrets.token_hex(4)}" for _ in range(3))
+        try:
+            for vault_id in vault_ids:
+                storage.create(vault_id)
+            # walk the pages, other tests' vaults may turn up too
+            seen, cursor = [], None
+            while True:
+                params = {'limit': 1, 'updated_since': since} | ({'cursor': cursor} if cursor else {})
+                response = self.client.get('/api/vaults', params=params)
+                self.assertEqual(response.status_code, 200)
+                page = response.json()
+                seen += [item['vault_id'] for item in page['vaults']]
+                if not (cursor := page['next_cursor']):
+                    break
+            self.assertEqual([vault_id for vault_id in seen if vault_id in vault_ids], vault_ids)
+
+            self.assertEqual(self.client.get('/api/vaults', params={'cursor': '!'}).status_code, 400)
+            self.assertEqual(self.client.get('/api/vaults', params={'limit': 0}).status_code, 422)
+        finally:
+            for vault_id in vault_ids:
+                storage.delete(vault_id)
+
+    def test_events_for_missing_vault(self):
+        response = self.client.get('/api/vaults/non-existant-vault/events')
+        self.assertEqual(response.status_code, 404)
+
+    def test_admission(self):
+        admission = AdmissionControl(vault_rate=1, vault_burst=1)
+        main.fastapi_app.dependency_overrides[get_admission] = lambda: admission
+        try:
+            self.assertEqual(self.client.get('/api/vaults/non-existant-vault').status_code, 404)
+            response = self.client.get('/api/vaults/non-existant-vault')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            # only that vault is limited, and nothing is left holding a slot
+            self.assertEqual(self.client.get('/api/vaults/another-non-existant-vault').status_code, 404)
+            self.assertEqual(admission.in_flight.value, 0)
+        finally:
+            main.fastapi_app.dependency_overrides.clear()
@@ -34,3 +34,26 @@ class TestCrypto(TestCase):
         encrypted_data = crypto.encrypt_data(b'plaintext', key)
         with self.assertRaises(Exception):
             crypto.decrypt_data(encrypted_data, bad_key)
+
+    def test_segments(self):
+        key = crypto.SimpleUnlockKey()
+        key.seed(b'some insecure test key')
+
+        segments = [b'first', b'second', b'third' * 100]
+        encrypted = crypto.encrypt_segments(segments, key)
+        assert crypto.is_segmented(encrypted)
+        assert b'second' not in encrypted
+        assert crypto.decrypt_segments(encrypted, key) == segments
+
+        # segments that didn't change encrypt to the same bytes, the changed one doesn't
+        again = crypto.encrypt_segments([b'first', b'2nd', b'third' * 100], key)
+        spans, again_spans = crypto.segment_spans(encrypted), crypto.segment_spans(again)
+        assert len(spans) == 3
+        pieces = [encrypted[a:b] for a, b in spans]
+        again_pieces = [again[a:b] for a, b in again_spans]
+        assert pieces[0] == again_pieces[0] and pieces[2] == again_pieces[2]
+        assert pieces[1] != again_pieces[1]
+
+        with self.assertRaises(InvalidSignature):
+            crypto.decrypt_segments(encrypted[:-1] + b'x', key)
+        assert not crypto.is_segmented(crypto.encrypt_data(b'plaintext', key))
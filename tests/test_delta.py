@@ -0,0 +1,32 @@
+import os
+from unittest import TestCase
+
+from password_manager.util.delta import DELTA_MAGIC, apply_delta, make_delta
+from password_manager.util.exceptions import VaultDeltaError
+
+
+def apply(patch: bytes, base: bytes) -> bytes:
+    return b"".join(apply_delta(patch, len(base), lambda start, end: [base[start:end]]))
+
+
+class TestDelta(TestCase):
+    def test_round_trip(self):
+        base = os.urandom(20_000)
+        for new in (base, base[:8192] + b"changed" + base[8192:], os.urandom(100) + base, b"", base[:5000]):
+            self.assertEqual(apply(make_delta(base, new), base), new)
+
+    def test_copies_unchanged_blocks(self):
+        base = os.urandom(40_960)
+        new = base[:4096] + os.urandom(4096) + base[8192:]
+        patch = make_delta(base, new)
+        # one block inserted, the rest copied in two runs
+        self.assertLess(len(patch), 4096 + 100)
+        self.assertEqual(apply(patch, base), new)
+
+    def test_bad_deltas(self):
+        for patch in (b"not a delta", DELTA_MAGIC + b"X", DELTA_MAGIC + b"I\x00", DELTA_MAGIC + b"I" + (100).to_bytes(8) + b"short"):
+            with self.assertRaises(VaultDeltaError):
+                apply(patch, b"base")
+        # and no reaching outside the base
+        with self.assertRaises(VaultDeltaError):
+            apply(DELTA_MAGIC + b"C" + (2).to_bytes(8) + (10).to_bytes(8), b"base")
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import tempfile
+import threading
+from unittest import IsolatedAsyncioTestCase
+
+from password_manager.app.api import _etag, _vault_changes
+from password_manager.backend.async_storage import ThreadedStorage
+from password_manager.backend.database import FileStorage, VaultValidator
+from password_manager.backend.events import VaultEvent, VaultEvents
+from password_manager.util import crypto
+
+
+class TestVaultEvents(IsolatedAsyncioTestCase):
+    async def test_fan_out(self):
+        events = VaultEvents()
+        with events.subscribe("vault") as first, events.subscribe("vault") as second, events.subscribe("other") as other:
+            self.assertEqual(events.subscribers, 3)
+            events.publish("vault", VaultValidator(2, b"sig"))
+            self.assertEqual(await first.get(), VaultEvent("vault", VaultValidator(2, b"sig")))
+            self.assertEqual(await second.get(), VaultEvent("vault", VaultValidator(2, b"sig")))
+            with self.assertRaises(TimeoutError):
+                await asyncio.wait_for(other.get(), 0.01)
+        # and nothing is left behind for vaults nobody listens to any more
+        self.assertEqual((events.subscribers, events._subscribers), (0, {}))
+
+    async def test_slow_listeners_only_get_the_latest(self):
+        events = VaultEvents()
+        with events.subscribe("vault") as subscription:
+            for version in range(2, 12):
+                events.publish("vault", VaultValidator(version, b"sig"))
+            self.assertEqual((await subscription.get()).validator.version, 11)
+            self.assertEqual(events.coalesced.value, 9)
+
+    async def test_publish_from_another_thread(self):
+        events = VaultEvents()
+        with events.subscribe("vault") as subscription:
+            thread = threading.Thread(target=events.publish, args=("vault", None))
+            thread.start()
+            self.assertEqual(await asyncio.wait_for(subscription.get(), 1), VaultEvent("vault", None))
+            thread.join()
+
+    async def test_poll_is_shared(self):
+        events = VaultEvents()
+        checks = []
+
+        async def check():
+            checks.append(True)
+            await asyncio.sleep(0.01)
+            return VaultValidator(len(checks), b"sig")
+
+        with events.subscribe("vault"):
+            results = await asyncio.gather(*(events.poll("vault", check, 60) for _ in range(50)))
+            self.assertEqual((len(checks), set(results)), (1, {VaultValidator(1, b"sig")}))
+            self.assertEqual((await events.poll("vault", check, 0)).version, 2)
+        self.assertEqual(events._polls, {})
+
+
+class TestVaultChanges(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.storage = ThreadedStorage(FileStorage(self._tmp.name), max_workers=2)
+
+    def tearDown(self):
+        self.storage.close()
+        self._tmp.cleanup()
+
+    async def test_changes(self):
+        secret = (await self.storage.acreate("vault")).vault_secret.encode("utf-8")
+        changes = _vault_changes(self.storage, "vault", None, heartbeat=0.05)
+        try:
+            # where it's at when we connect
+            self.assertIn('"version": 1', await anext(changes))
+            data = crypto.sign_data(b"data", secret)
+            await self.storage.awrite("vault", data)
+            self.assertEqual(
+                await anext(changes),
+                f"id: {_etag(VaultValidator(2, data[:32]))}\nevent: write\n"
+                f"data: {json.dumps({'vault_id': 'vault', 'version': 2, 'etag': _etag(VaultValidator(2, data[:32]))})}\n\n",
+            )
+            self.assertEqual(await anext(changes), ": ping\n\n")
+            # a write that never went through our storage shows up on the next heartbeat
+            self.storage.sync.write("vault", crypto.sign_data(b"elsewhere", secret))
+            self.assertIn('"version": 3', await anext(changes))
+            await self.storage.adelete("vault")
+            self.assertTrue((await anext(changes)).startswith("event: delete\n"))
+        finally:
+            await changes.aclose()
+        self.assertEqual(self.storage.events.subscribers, 0)
+
+    async def test_heartbeats_check_once_per_vault(self):
+        await self.storage.acreate("vault")
+        streams = [_vault_changes(self.storage, "vault", None, heartbeat=0.05) for _ in range(20)]
+        try:
+            for changes in streams:
+                self.assertIn('"version": 1', await anext(changes))
+            checks = []
+            validator = self.storage.avalidator
+
+            async def counting_validator(vault_id):
+                checks.append(vault_id)
+                return await validator(vault_id)
+
+            self.storage.avalidator = counting_validator
+            pings = await asyncio.gather(*(anext(changes) for changes in streams))
+            self.assertEqual(pings, [": ping\n\n"] * 20)
+            self.assertEqual(checks, ["vault"])
+        finally:
+            for changes in streams:
+                await changes.aclose()
+
+    async def test_resume_from_last_event_id(self):
+        await self.storage.acreate("vault")
+        etag = _etag(await self.storage.avalidator("vault"))
+        changes = _vault_changes(self.storage, "vault", etag, heartbeat=0.05)
+        try:
+            # already up to date, so nothing but heartbeats
+            self.assertEqual(await anext(changes), ": ping\n\n")
+        finally:
+            await changes.aclose()
@@ -0,0 +1,39 @@
+import asyncio
+import inspect
+from unittest import IsolatedAsyncioTestCase
+
+from password_manager.app.frontend import timed_builder
+from password_manager.util.metrics import REGISTRY
+
+
+class TestTimedBuilder(IsolatedAsyncioTestCase):
+    async def test_async_builder(self):
+        histogram = REGISTRY.histogram("page_render_seconds", route="/test-async")
+        before = (histogram.count, histogram.sum)
+
+        async def page(storage: object) -> str:
+            await asyncio.sleep(0.05)
+            return "built"
+
+        timed = timed_builder(page, "/test-async")
+        coroutine = timed(storage=None)
+        # nicegui only schedules it, nothing is recorded until the page is actually built
+        self.assertEqual(histogram.count, before[0])
+        self.assertEqual(await coroutine, "built")
+        self.assertEqual(histogram.count, before[0] + 1)
+        self.assertGreaterEqual(histogram.sum - before[1], 0.05)
+
+    def test_sync_builder_keeps_signature(self):
+        histogram = REGISTRY.histogram("page_render_seconds", route="/test-sync")
+        before = histogram.count
+
+        def page(storage: object) -> None:
+            pass
+
+        page._is_protected = True
+        timed = timed_builder(page, "/test-sync")
+        timed(storage=None)
+        self.assertEqual(histogram.count, before + 1)
+        # nicegui picks the builder's arguments from its signature, and we look for `_is_protected`
+        self.assertEqual(list(inspect.signature(timed).parameters), ["storage"])
+        self.assertTrue(timed._is_protected)
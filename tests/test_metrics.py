@@ -0,0 +1,68 @@
+from unittest import TestCase
+
+from password_manager.util.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(TestCase):
+    def test_counter(self):
+        counter = Counter("things")
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(counter.value, 3)
+
+    def test_histogram(self):
+        histogram = Histogram("waits", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 6.05)
+        self.assertEqual(histogram.cumulative(), [(0.1, 1), (1.0, 3), (float("inf"), 4)])
+        self.assertEqual(histogram.quantile(0.5), 1.0)
+        self.assertEqual(histogram.quantile(0.99), float("inf"))
+
+    def test_shared(self):
+        registry = Registry()
+        counter = registry.counter("calls", "calls made", op="read")
+        self.assertIs(registry.counter("calls", op="read"), counter)
+        self.assertIsNot(registry.counter("calls", op="write"), counter)
+        with self.assertRaises(ValueError):
+            registry.histogram("calls", op="read")
+
+    def test_exposition(self):
+        registry = Registry()
+        registry.counter("calls", "calls made", op="read").inc(2)
+        registry.gauge("in_flight").inc()
+        histogram = registry.histogram("waits", 'how "long"', buckets=(0.1, 1.0))
+        histogram.observe(0.5)
+        self.assertEqual(
+            registry.exposition().splitlines(),
+            [
+                "# TYPE calls counter",
+                "# HELP calls calls made",
+                'calls_total{op="read"} 2',
+                "# TYPE in_flight gauge",
+                "in_flight 1",
+                "# TYPE waits histogram",
+                '# HELP waits how \\"long\\"',
+                'waits_bucket{le="0.1"} 0',
+                'waits_bucket{le="1.0"} 1',
+                'waits_bucket{le="+Inf"} 1',
+                "waits_count 1",
+                "waits_sum 0.5",
+                "# EOF",
+            ],
+        )
+
+    def test_adds_up_same_labels(self):
+        # a cache per backend, say, is one series
+        registry = Registry()
+        first, second = Counter("hits", registry=registry), Counter("hits", registry=registry)
+        first.inc()
+        second.inc(2)
+        self.assertIn("hits_total 3", registry.exposition().splitlines())
+
+    def test_forgets_dropped_metrics(self):
+        registry = Registry()
+        Gauge("temporary", registry=registry)
+        self.assertNotIn("temporary", registry.exposition())
+
@@ -0,0 +1,19 @@
+import sys
+from unittest import TestCase
+
+from password_manager.components.passcode_factories import ALL_PASSCODE_INPUTS
+from password_manager.types import PasscodeInput
+
+
+class TestPasscodeFactories(TestCase):
+    def test_names_match_the_inputs(self):
+        for factory in ALL_PASSCODE_INPUTS:
+            passcode_input = factory.load()
+            self.assertTrue(issubclass(passcode_input, PasscodeInput))
+            self.assertEqual(passcode_input.get_name(), factory.get_name())
+
+    def test_inputs_load_lazily(self):
+        sys.modules.pop("password_manager.components.passcode_factories.snake", None)
+        names = [factory.get_name() for factory in ALL_PASSCODE_INPUTS]
+        self.assertIn("Snake", names)
+        self.assertNotIn("password_manager.components.passcode_factories.snake", sys.modules)
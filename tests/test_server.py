@@ -0,0 +1,77 @@
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from password_manager.app import server
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmp.name, "storage_secret")
+        self.env = patch.dict(os.environ, {"PASSWORD_JAM_STORAGE_SECRET_PATH": str(self.path)})
+        self.env.start()
+        os.environ.pop("PASSWORD_JAM_STORAGE_SECRET", None)
+
+    def tearDown(self):
+        self.env.stop()
+        self._tmp.cleanup()
+
+    def test_storage_secret_is_kept(self):
+        secret = server.storage_secret()
+        self.assertEqual(server.storage_secret(), secret)
+        self.assertEqual(stat.S_IMODE(self.path.stat().st_mode), 0o600)
+        with patch.dict(os.environ, {"PASSWORD_JAM_STORAGE_SECRET": "configured"}):
+            self.assertEqual(server.storage_secret(), "configured")
+
+    def test_old_secret_moves_out_of_the_vault_dir(self):
+        legacy = Path(self._tmp.name, "storage_secret")
+        legacy.write_text("from before")
+        default = Path(self._tmp.name, ".storage_secret")
+        with (
+            patch.object(server, "DEFAULT_SECRET_PATH", str(default)),
+            patch.object(server, "_LEGACY_SECRET_PATH", legacy),
+            patch.dict(os.environ),
+        ):
+            os.environ.pop("PASSWORD_JAM_STORAGE_SECRET_PATH")
+            self.assertEqual(server.storage_secret(), "from before")
+        self.assertFalse(legacy.exists())
+        self.assertEqual(default.read_text(), "from before")
+
+    def test_workers_starting_at_once_agree(self):
+        secrets = []
+        threads = [threading.Thread(target=lambda: secrets.append(server.storage_secret())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(secrets)), 1)
+
+    def test_production_server(self):
+        with patch("uvicorn.run") as run:
+            server.main(["--workers", "3"])
+        self.assertEqual(run.call_args.kwargs["workers"], 3)
+        self.assertNotIn("reload", run.call_args.kwargs)
+        # the workers get the secret the parent settled on
+        self.assertEqual(os.environ["PASSWORD_JAM_STORAGE_SECRET"], self.path.read_text())
+
+        with patch("uvicorn.run") as run, patch.dict(os.environ, {"PASSWORD_JAM_STORAGE": "log"}):
+            with self.assertRaises(SystemExit):
+                server.main(["--workers", "2"])
+        run.assert_not_called()
+
+    def test_api_only_never_loads_the_ui(self):
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, api_main; print(sorted(m for m in sys.modules if m.startswith(('nicegui', 'password_manager.components'))))"],
+            cwd=Path(__file__).resolve().parent.parent / "src",
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.strip(), "[]")
@@ -0,0 +1,896 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from password_manager.backend import vault
+from password_manager.backend.async_storage import AsyncVaultStorage, ThreadedStorage
+from password_manager.backend.cache import CachedStorage
+from password_manager.backend.database import FileStorage, VaultStorage, VaultValidator
+from password_manager.backend.durability import GroupCommitter, _Pending
+from password_manager.backend.fake_object_server import FakeObjectServer, _Handler
+from password_manager.backend.instrumented import InstrumentedStorage
+from password_manager.backend.logstore import LogStorage
+from password_manager.backend.migrate_layout import flat_vault_ids, migrate_to_sharded
+from password_manager.backend.objectstore import AsyncObjectStorage, ObjectStorage
+from password_manager.backend.secret_index import SECRET_INDEX
+from password_manager.backend.sqlite import SqliteStorage
+from password_manager.util import crypto
+from password_manager.util.metrics import REGISTRY
+from password_manager.util.exceptions import (
+    InvalidVaultIdError,
+    VaultConflictError,
+    VaultExistsError,
+    VaultReadError,
+    VaultSaveError,
+    VaultTooLargeError,
+    VaultValidationError,
+)
+
+
+class StorageContract:
+    """Behaviour every VaultStorage has to share, subclass with a TestCase and a make_storage"""
+
+    def make_storage(self, base_path: str) -> VaultStorage:
+        raise NotImplementedError
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.storage = self.make_storage(self._tmp.name)
+
+    def tearDown(self):
+        close = getattr(self.storage, "close", None)
+        if close:
+            close()
+        self._tmp.cleanup()
+
+    def test_create_read_write_delete(self):
+        self.assertFalse(self.storage.exists("vault"))
+        created = self.storage.create("vault")
+        self.assertEqual(len(created.vault_secret), 64)
+        self.assertTrue(self.storage.exists("vault"))
+
+        # a fresh vault holds a signed 'nothing'
+        fresh = self.storage.read("vault")
+        self.assertEqual(crypto.validate_signature(fresh.vault_data, created.vault_secret.encode("utf-8")), b"")
+
+        data = crypto.sign_data(b"some encrypted vault", created.vault_secret.encode("utf-8"))
+        self.storage.write("vault", data)
+        self.assertEqual(self.storage.read("vault").vault_data, data)
+
+        self.storage.delete("vault")
+        self.assertFalse(self.storage.exists("vault"))
+        with self.assertRaises(VaultReadError):
+            self.storage.read("vault")
+
+    def test_sidecar_names(self):
+        # an id naming another vault's secret, lock or history is either refused or just another vault
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        data = crypto.sign_data(b"some encrypted vault", secret)
+        self.storage.write("vault", data)
+        for suffix in (".secret", ".lock", ".revs"):
+            vault_id = f"vault{suffix}"
+            with self.subTest(vault_id):
+                self._refused_or_separate(vault_id)
+        self.assertEqual(self.storage.read("vault").vault_data, data)
+
+    def test_dotfile_names(self):
+        # where FileStorage keeps its index, shards and temp files
+        self.storage.create("vault")
+        for vault_id in (".index.sqlite3", ".index.sqlite3-wal", ".index.sqlite3-shm", ".shards"):
+            with self.subTest(vault_id):
+                self._refused_or_separate(vault_id)
+        self.assertEqual([vault.vault_id for vault in self._listed()], ["vault"])
+
+    def test_stray_files(self):
+        # whatever else sits in the dir, like the generated storage secret or another backend's database
+        Path(self._tmp.name, "storage_secret").write_bytes(b"not a vault")
+        stray = [p.name for p in Path(self._tmp.name).iterdir() if p.is_file() and not p.name.startswith(".")]
+        for vault_id in stray:
+            with self.subTest(vault_id):
+                self.assertFalse(self.storage.exists(vault_id))
+                self.assertIsNone(self.storage.fingerprint(vault_id))
+                for op in (self.storage.read, self.storage.validator, self.storage.open_stream):
+                    with self.assertRaises(VaultReadError):
+                        op(vault_id)
+        self.assertEqual(Path(self._tmp.name, "storage_secret").read_bytes(), b"not a vault")
+
+    def _listed(self) -> list:
+        try:
+            return self.storage.list_vaults().vaults
+        except NotImplementedError:
+            self.skipTest("backend can't list vaults")
+
+    def _refused_or_separate(self, vault_id: str) -> None:
+        try:
+            exists = self.storage.exists(vault_id)
+        except ValueError:
+            for op in (self.storage.read, self.storage.create, self.storage.delete, self.storage.revisions):
+                with self.assertRaises(ValueError):
+                    op(vault_id)
+            return
+        self.assertFalse(exists)
+        with self.assertRaises(VaultReadError):
+            self.storage.read(vault_id)
+        self.storage.create(vault_id)
+        self.storage.delete(vault_id)
+        self.assertFalse(self.storage.exists(vault_id))
+
+    def test_bad_signature(self):
+        self.storage.create("vault")
+        with self.assertRaises(VaultValidationError):
+            self.storage.write("vault", crypto.sign_data(b"data", b"not the secret"))
+
+    def test_missing(self):
+        with self.assertRaises(VaultReadError):
+            self.storage.read("missing")
+        with self.assertRaises(VaultReadError):
+            self.storage.write("missing", b"data")
+
+    def test_get_secret(self):
+        created = self.storage.create("vault")
+        self.assertEqual(self.storage.get_secret("vault"), created.vault_secret)
+        with self.assertRaises(VaultReadError):
+            self.storage.get_secret("missing")
+
+    def test_create_twice(self):
+        self.storage.create("vault")
+        with self.assertRaises(VaultExistsError):
+            self.storage.create("vault")
+
+    def test_versions(self):
+        created = self.storage.create("vault")
+        secret = created.vault_secret.encode("utf-8")
+        self.assertEqual(created.version, 1)
+        self.assertEqual(self.storage.read("vault").version, 1)
+        self.assertEqual(self.storage.write("vault", crypto.sign_data(b"one", secret), expected_version=1), 2)
+        self.assertEqual(self.storage.write("vault", crypto.sign_data(b"two", secret)), 3)
+
+        # a save based on version 2 lost to the one that made 3
+        with self.assertRaises(VaultConflictError):
+            self.storage.write("vault", crypto.sign_data(b"stale", secret), expected_version=2)
+        vault = self.storage.read("vault")
+        self.assertEqual((vault.version, vault.vault_data), (3, crypto.sign_data(b"two", secret)))
+
+    def test_validator(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        self.assertEqual(self.storage.validator("vault"), (1, crypto.sign_data(b"", secret)[:32]))
+        data = crypto.sign_data(b"data", secret)
+        self.storage.write("vault", data)
+        self.assertEqual(self.storage.validator("vault"), VaultValidator.of(self.storage.read("vault")))
+        self.assertEqual(self.storage.validator("vault"), (2, data[:32]))
+        with self.assertRaises(VaultReadError):
+            self.storage.validator("missing")
+
+    def test_open_stream(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        data = crypto.sign_data(bytes(range(256)) * 40, secret)
+        self.storage.write("vault", data)
+        stream = self.storage.open_stream("vault")
+        try:
+            self.assertEqual((stream.size, stream.validator), (len(data), (2, data[:32])))
+            self.assertEqual(b"".join(stream.iter_range(chunk_size=1000)), data)
+            self.assertEqual(b"".join(stream.iter_range(100, 3000, chunk_size=7)), data[100:3000])
+            self.assertEqual(b"".join(stream.iter_range(len(data) - 5)), data[-5:])
+        finally:
+            stream.close()
+        with self.assertRaises(VaultReadError):
+            self.storage.open_stream("missing")
+
+    def test_batches(self):
+        created = dict(self.storage.create_many(["a", "b", "a"]))
+        self.assertEqual(created["b"].version, 1)
+        self.assertIsInstance(dict(self.storage.create_many(["a"]))["a"], VaultSaveError)
+        secret = created["b"].vault_secret.encode("utf-8")
+        self.storage.write("b", crypto.sign_data(b"data", secret))
+
+        self.assertEqual(self.storage.exists_many(["a", "missing", "b"]), [("a", True), ("missing", False), ("b", True)])
+        results = self.storage.read_many(["b", "missing", "a", "b"])
+        self.assertEqual([vault_id for vault_id, _ in results], ["b", "missing", "a", "b"])
+        self.assertEqual(results[0][1].vault_data, crypto.sign_data(b"data", secret))
+        self.assertIsInstance(results[1][1], VaultReadError)
+        self.assertEqual(results[2][1].version, 1)
+
+    def test_list_vaults(self):
+        try:
+            self.storage.list_vaults()
+        except NotImplementedError:
+            self.skipTest("backend can't list vaults")
+        for vault_id in ["c", "a", "d", "b"]:
+            self.storage.create(vault_id)
+        since = time.time()
+        secret = self.storage.get_secret("b").encode("utf-8")
+        self.assertEqual(self.storage.write("b", crypto.sign_data(b"data", secret)), 2)
+        self.storage.delete("d")
+
+        first = self.storage.list_vaults(limit=2)
+        self.assertEqual([vault.vault_id for vault in first.vaults], ["a", "b"])
+        self.assertEqual((first.vaults[1].version, first.vaults[1].size), (2, 36))
+        self.assertGreaterEqual(first.vaults[1].updated_at, since)
+        self.assertLessEqual(first.vaults[1].created_at, since)
+        rest = self.storage.list_vaults(first.next_cursor, limit=2)
+        self.assertEqual(([vault.vault_id for vault in rest.vaults], rest.next_cursor), (["c"], None))
+
+        updated = self.storage.list_vaults(updated_since=since)
+        self.assertEqual([vault.vault_id for vault in updated.vaults], ["b"])
+        with self.assertRaises(ValueError):
+            self.storage.list_vaults("not a cursor")
+
+    def _upload(self, vault_id: str, data: bytes, max_size: int = 1024 * 1024, expected_version: int | None = None) -> int:
+        upload = self.storage.open_upload(vault_id, max_size)
+        try:
+            for pos in range(0, len(data), 1000):
+                upload.feed(data[pos : pos + 1000])
+            return self.storage.save_upload(upload, expected_version)
+        finally:
+            upload.close()
+
+    def test_upload(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        data = crypto.sign_data(os.urandom(10_000), secret)
+        self.assertEqual(self._upload("vault", data, expected_version=1), 2)
+        self.assertEqual(self.storage.read("vault").vault_data, data)
+        self.assertEqual(self.storage.validator("vault"), (2, data[:32]))
+        with self.assertRaises(VaultConflictError):
+            self._upload("vault", data, expected_version=1)
+
+        # nothing gets replaced by a bad or oversized upload
+        with self.assertRaises(VaultValidationError):
+            self._upload("vault", crypto.sign_data(os.urandom(10_000), b"not the secret"))
+        with self.assertRaises(VaultValidationError):
+            self._upload("vault", data[:20])
+        with self.assertRaises(VaultTooLargeError):
+            self._upload("vault", data, max_size=5000)
+        self.assertEqual(self.storage.read("vault").vault_data, data)
+        with self.assertRaises(VaultReadError):
+            self.storage.open_upload("missing", 1000)
+
+    def test_concurrent_conditional_writes(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        outcomes = []
+
+        def writer(i: int) -> None:
+            try:
+                outcomes.append(self.storage.write("vault", crypto.sign_data(bytes([i]), secret), expected_version=1))
+            except VaultConflictError:
+                outcomes.append("conflict")
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # exactly one of them gets to build on version 1
+        self.assertEqual(sorted(outcomes, key=str), [2] + ["conflict"] * 7)
+        self.assertEqual(self.storage.read("vault").version, 2)
+
+
+class TestFileStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return FileStorage(base_path)
+
+    def test_shares_a_dir_with_sqlite(self):
+        # both backends default to the same dir, the sqlite database isn't a vault to stream out
+        SqliteStorage(self._tmp.name).create("vault")
+        self.assertFalse(self.storage.exists("vaults.sqlite3"))
+        with self.assertRaises(VaultReadError):
+            self.storage.open_stream("vaults.sqlite3")
+        with self.assertRaises(VaultSaveError):
+            self.storage.create("vaults.sqlite3")
+
+    def test_reserved_ids(self):
+        for vault_id in ("vault.secret", "vault.lock", "vault.revs", ".index.sqlite3", ".index.sqlite3-wal", ".x"):
+            with self.subTest(vault_id), self.assertRaises(InvalidVaultIdError):
+                self.storage.exists(vault_id)
+
+    def test_readers_never_see_partial_writes(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        blobs = [crypto.sign_data(bytes([i]) * 256 * 1024, secret) for i in range(4)]
+        stop = threading.Event()
+
+        def writer():
+            while not stop.is_set():
+                for blob in blobs:
+                    self.storage.write("vault", blob)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            for _ in range(200):
+                self.assertIn(self.storage.read("vault").vault_data, blobs + [crypto.sign_data(b"", secret)])
+        finally:
+            stop.set()
+            thread.join()
+        # and no temp files were left lying around
+        self.assertEqual(list(Path(self._tmp.name).glob("*.tmp")), [])
+
+    def test_upload_leaves_no_temp_files(self):
+        self.test_upload()
+        self.assertEqual(list(Path(self._tmp.name).glob(".*.tmp")), [])
+
+    def test_secret_index(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        data = crypto.sign_data(b"data", secret)
+        self.storage.write("vault", data)
+        before = SECRET_INDEX.stats()
+        for _ in range(10):
+            self.storage.write("vault", data)
+        after = SECRET_INDEX.stats()
+        # once to check the signature, once more under the lock to catch the vault being recreated
+        self.assertEqual(after["hits"] - before["hits"], 20)
+        self.assertEqual(after["misses"], before["misses"])
+
+    def test_blobs_from_before_versions(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        Path(self._tmp.name, "vault").write_bytes(crypto.sign_data(b"old", secret))
+        self.assertEqual(self.storage.read("vault").version, 0)
+        self.assertEqual(self.storage.read("vault").vault_data, crypto.sign_data(b"old", secret))
+        self.assertEqual(self.storage.write("vault", crypto.sign_data(b"new", secret), expected_version=0), 1)
+
+    def test_stream_survives_writes(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        old = crypto.sign_data(b"old" * 1000, secret)
+        self.storage.write("vault", old)
+        stream = self.storage.open_stream("vault")
+        try:
+            self.storage.write("vault", crypto.sign_data(b"new", secret))
+            # the open fd still points at the blob we started serving
+            self.assertEqual(b"".join(stream.iter_range(chunk_size=100)), old)
+        finally:
+            stream.close()
+
+    def test_reindex(self):
+        self.storage.create("a")
+        self.storage.create("b")
+        self.storage.close()
+        Path(self._tmp.name, ".index.sqlite3").unlink()
+        for suffix in ("-wal", "-shm"):
+            Path(self._tmp.name, f".index.sqlite3{suffix}").unlink(missing_ok=True)
+        # a missing index gets rebuilt from the blobs on startup
+        self.storage = self.make_storage(self._tmp.name)
+        self.assertEqual([vault.vault_id for vault in self.storage.list_vaults().vaults], ["a", "b"])
+
+    def test_secret_index_sees_other_processes(self):
+        self.storage.create("vault")
+        self.storage.get_secret("vault")
+        # another process deleting and recreating the vault, behind our back
+        Path(self._tmp.name, "vault.secret").unlink()
+        Path(self._tmp.name, "vault").unlink()
+        Path(self._tmp.name, "vault.secret").write_text("a brand new secret")
+        Path(self._tmp.name, "vault").write_bytes(b"")
+        self.assertEqual(self.storage.get_secret("vault"), "a brand new secret")
+
+
+class TestGroupCommitFileStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return FileStorage(base_path, durability="group-commit")
+
+    def test_concurrent_writers_share_batches(self):
+        blobs = {}
+        for i in range(8):
+            secret = self.storage.create(f"vault-{i}").vault_secret.encode("utf-8")
+            blobs[f"vault-{i}"] = crypto.sign_data(bytes([i]) * 1024, secret)
+        flushed = []
+        flush = GroupCommitter._flush
+
+        def counting_flush(batch: list) -> None:
+            flushed.append(len(batch))
+            flush(batch)
+
+        with patch.object(GroupCommitter, "_flush", staticmethod(counting_flush)):
+            threads = [threading.Thread(target=self.storage.write, args=item) for item in blobs.items()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sum(flushed), 8)
+        for vault_id, blob in blobs.items():
+            self.assertEqual(self.storage.read(vault_id).vault_data, blob)
+
+    def test_batch_failure_reaches_every_writer(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        blob = crypto.sign_data(b"new", secret)
+        with (
+            patch("password_manager.backend.durability.fsync_path", side_effect=OSError("disk on fire")),
+            self.assertRaises(OSError),
+        ):
+            self.storage.write("vault", blob)
+        self.assertEqual(self.storage.read("vault").vault_data, crypto.sign_data(b"", secret))
+        self.assertEqual([p.name for p in Path(self._tmp.name).iterdir() if p.suffix == ".tmp"], [])
+
+    def test_batch_failure_stays_with_its_writer(self):
+        base = Path(self._tmp.name)
+        batch = []
+        for i in range(3):
+            (base / f"new-{i}").write_bytes(b"new")
+            (base / f"target-{i}").write_bytes(b"old")
+            batch.append(_Pending(base / f"new-{i}", base / f"target-{i}"))
+        replace = os.replace
+        calls = []
+
+        def second_fails(src: Path, dst: Path) -> None:
+            calls.append(dst)
+            if len(calls) == 2:
+                raise OSError("disk on fire")
+            replace(src, dst)
+
+        with patch("password_manager.backend.durability.os.replace", second_fails):
+            GroupCommitter._flush(batch)
+        self.assertIsNone(batch[0].error)
+        self.assertIsInstance(batch[1].error, OSError)
+        self.assertIsNone(batch[2].error)
+        self.assertEqual([(base / f"target-{i}").read_bytes() for i in range(3)], [b"new", b"old", b"new"])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            FileStorage(self._tmp.name, durability="sometimes")
+
+
+class TestFileStorageHistory(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return FileStorage(base_path, layout="sharded", history=3, compact_interval=0)
+
+    def save(self, count: int) -> tuple[bytes, list[bytes]]:
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        blobs = [crypto.sign_data(b"", secret)]
+        for i in range(count):
+            blobs.append(crypto.sign_data(bytes([i]) * 64, secret))
+            self.storage.write("vault", blobs[-1])
+        return secret, blobs
+
+    def test_keeps_revisions(self):
+        _, blobs = self.save(2)
+        revisions = self.storage.revisions("vault")
+        self.assertEqual([r.revision for r in revisions], [1, 2, 3])
+        self.assertEqual([r.size for r in revisions], [len(b) for b in blobs])
+        for revision, blob in zip(revisions, blobs, strict=True):
+            self.assertEqual(self.storage.read_revision("vault", revision.revision), blob)
+        with self.assertRaises(VaultReadError):
+            self.storage.read_revision("vault", 4)
+        with self.assertRaises(VaultReadError):
+            self.storage.revisions("missing")
+
+    def test_revisions_share_the_blob(self):
+        self.save(1)
+        blob = self.storage._get_path("vault")
+        self.assertEqual(blob.stat().st_nlink, 2)
+        self.assertTrue(blob.samefile(self.storage._get_path("vault", ".revs") / f"{2:010d}"))
+
+    def test_older_revisions_are_deltas(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        key = crypto.SimpleUnlockKey()
+        key.seed(b"some insecure test key")
+        v = vault.Vault()
+        for i in range(200):
+            entry = vault.VaultEntry(f"site-{i}")
+            entry.add_key_value(vault.VaultKeyValue("password", f"password-{i}" * 8))
+            v.entries.append(entry)
+        blobs = []
+        for i in range(3):
+            v.entries[i].key_values[0].value = f"changed {i}"
+            blobs.append(crypto.sign_data(vault.encrypt_vault(v, key), secret))
+            self.storage.write("vault", blobs[-1])
+
+        revs = self.storage._get_path("vault", ".revs")
+        self.assertEqual(sorted(path.name for path in revs.iterdir()), [f"{1:010d}", f"{2:010d}.delta", f"{3:010d}.delta", f"{4:010d}"])
+        # a changed entry's worth, not another copy of the vault
+        self.assertLess((revs / f"{2:010d}.delta").stat().st_size, len(blobs[0]) // 10)
+        self.assertEqual([r.size for r in self.storage.revisions("vault")][1:], [len(blob) for blob in blobs])
+        for revision, blob in enumerate(blobs, start=2):
+            self.assertEqual(self.storage.read_revision("vault", revision), blob)
+
+        self.storage.write("vault", blobs[0])
+        self.assertEqual(self.storage.compact(), 2)
+        self.assertEqual([r.revision for r in self.storage.revisions("vault")], [3, 4, 5])
+        self.assertEqual(self.storage.read_revision("vault", 3), blobs[1])
+
+    def test_compact_by_count(self):
+        _, blobs = self.save(5)
+        self.assertEqual(self.storage.compact(), 3)
+        self.assertEqual([r.revision for r in self.storage.revisions("vault")], [4, 5, 6])
+        # numbering carries on past what was pruned
+        self.storage.write("vault", blobs[0])
+        self.assertEqual(self.storage.revisions("vault")[-1].revision, 7)
+        self.assertEqual(self.storage.read("vault").vault_data, blobs[0])
+
+    def test_compact_by_age_keeps_newest(self):
+        self.save(2)
+        self.storage = FileStorage(self._tmp.name, layout="sharded", history=3, history_max_age=60, compact_interval=0)
+        revs = self.storage._get_path("vault", ".revs")
+        for path in revs.iterdir():
+            os.utime(path, (time.time() - 3600, time.time() - 3600))
+        self.assertEqual(self.storage.compact(), 2)
+        self.assertEqual([r.revision for r in self.storage.revisions("vault")], [3])
+
+    def test_delete_drops_history(self):
+        self.save(1)
+        self.storage.delete("vault")
+        self.assertFalse(self.storage._get_path("vault", ".revs").exists())
+        self.storage.create("vault")
+        self.assertEqual([r.revision for r in self.storage.revisions("vault")], [1])
+
+    def test_migration_brings_history(self):
+        flat = FileStorage(self._tmp.name, history=3, compact_interval=0)
+        secret = flat.create("vault").vault_secret.encode("utf-8")
+        flat.write("vault", crypto.sign_data(b"data", secret))
+        migrate_to_sharded(self._tmp.name)
+        self.assertEqual(self.storage.read_revision("vault", 2), crypto.sign_data(b"data", secret))
+
+    def test_no_history_by_default(self):
+        storage = FileStorage(self._tmp.name)
+        storage.create("plain")
+        self.assertEqual(storage.revisions("plain"), [])
+        self.assertFalse(storage._get_path("plain", ".revs").exists())
+
+
+class TestShardedFileStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return FileStorage(base_path, layout="sharded")
+
+    def test_fan_out(self):
+        self.storage.create("vault")
+        path = self.storage._get_path("vault")
+        self.assertEqual(len(path.relative_to(self.storage._base).parts), 4)
+        self.assertFalse(Path(self._tmp.name, "vault").exists())
+
+    def test_traversal(self):
+        for vault_id in ("../vault", "../../../vault", "../../ab/vault", "/etc/passwd"):
+            with self.assertRaises(ValueError):
+                self.storage.exists(vault_id)
+
+    def test_online_migration(self):
+        flat = FileStorage(self._tmp.name)
+        written = {}
+        for i in range(20):
+            secret = flat.create(f"vault-{i}").vault_secret.encode("utf-8")
+            written[f"vault-{i}"] = crypto.sign_data(f"vault {i}".encode(), secret)
+            flat.write(f"vault-{i}", written[f"vault-{i}"])
+
+        # the sharded store serves flat vaults before they've moved...
+        self.assertEqual(self.storage.read("vault-0").vault_data, written["vault-0"])
+
+        # ...and while they're moving
+        errors = []
+        stop = threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                for vault_id, data in written.items():
+                    if self.storage.read(vault_id).vault_data != data:
+                        errors.append(vault_id)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        try:
+            self.assertEqual(migrate_to_sharded(self._tmp.name), 20)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(list(flat_vault_ids(self.storage)), [])
+        for vault_id, data in written.items():
+            self.assertEqual(self.storage.read(vault_id).vault_data, data)
+            self.storage.write(vault_id, data)
+        # running it again is a no-op
+        self.assertEqual(migrate_to_sharded(self._tmp.name), 0)
+
+
+class TestSqliteStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return SqliteStorage(base_path)
+
+    def test_wal(self):
+        self.assertEqual(self.storage._conn().execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_adds_version_column(self):
+        self.storage.close()
+        db = sqlite3.connect(Path(self._tmp.name, "old.sqlite3"))
+        db.execute("CREATE TABLE vaults (vault_id TEXT PRIMARY KEY, vault_data BLOB NOT NULL, vault_secret TEXT NOT NULL)")
+        db.execute("INSERT INTO vaults VALUES ('vault', x'', 'secret')")
+        db.commit()
+        db.close()
+        self.storage = SqliteStorage(self._tmp.name, filename="old.sqlite3")
+        self.assertEqual(self.storage.read("vault").version, 0)
+
+
+class TestLogStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return LogStorage(base_path, max_segment_bytes=1024, merge_interval=0)
+
+    def _fill(self) -> dict[str, bytes]:
+        written = {}
+        for i in range(10):
+            secret = self.storage.create(f"vault-{i}").vault_secret.encode("utf-8")
+            for j in range(5):
+                written[f"vault-{i}"] = crypto.sign_data(f"version {j}".encode() * 20, secret)
+                self.storage.write(f"vault-{i}", written[f"vault-{i}"])
+        self.storage.delete("vault-0")
+        del written["vault-0"]
+        return written
+
+    def test_reopen_from_hints(self):
+        written = self._fill()
+        self.storage.close()
+        self.storage = self.make_storage(self._tmp.name)
+        self.assertFalse(self.storage.exists("vault-0"))
+        for vault_id, data in written.items():
+            self.assertEqual(self.storage.read(vault_id).vault_data, data)
+
+    def test_merge_reclaims_space(self):
+        written = self._fill()
+        log_dir = self.storage._base
+        before = sum(p.stat().st_size for p in log_dir.glob("*.data"))
+        self.storage.merge()
+        after = sum(p.stat().st_size for p in log_dir.glob("*.data"))
+        self.assertLess(after, before)
+        for vault_id, data in written.items():
+            self.assertEqual(self.storage.read(vault_id).vault_data, data)
+
+        # and it all survives a restart
+        self.storage.close()
+        self.storage = self.make_storage(self._tmp.name)
+        self.assertFalse(self.storage.exists("vault-0"))
+        for vault_id, data in written.items():
+            self.assertEqual(self.storage.read(vault_id).vault_data, data)
+
+    def test_torn_write(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        self.storage.close()
+        with open(max(self.storage._base.glob("*.data")), "ab") as f:
+            f.write(b"\x00\x01half a record")
+        self.storage = self.make_storage(self._tmp.name)
+        self.storage.write("vault", crypto.sign_data(b"still works", secret))
+        self.assertEqual(self.storage.read("vault").vault_data[32:], b"still works")
+
+
+class TestObjectStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        self.server = FakeObjectServer().start()
+        return ObjectStorage(self.server.url, bucket="test")
+
+    def tearDown(self):
+        super().tearDown()
+        self.server.stop()
+
+    def test_lost_race_retries(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        real_request = self.storage._request
+        raced = []
+
+        def racing_request(method, vault_id, body=None, headers=None):
+            # sneak a write in between the HEAD and the conditional PUT, once
+            if method == "PUT" and not raced:
+                raced.append(True)
+                real_request("PUT", vault_id, crypto.sign_data(b"other", secret), {"x-amz-meta-vault-secret": "x"})
+            return real_request(method, vault_id, body, headers)
+
+        self.storage._request = racing_request
+        data = crypto.sign_data(b"mine", secret)
+        # the other writer replaced the secret, so our retry must now refuse the signature
+        with self.assertRaises(VaultValidationError):
+            self.storage.write("vault", data)
+        self.assertEqual(raced, [True])
+
+    def test_timeout_on_pooled_connection(self):
+        self.storage.create("vault")
+        self.storage._timeout = 0.05
+        self.storage._pool.queue[0].sock.settimeout(0.05)  # the pooled one was made with the old timeout
+        get = _Handler.do_GET
+
+        def slow_get(handler: _Handler) -> None:
+            time.sleep(0.3)
+            get(handler)
+
+        with patch.object(_Handler, "do_GET", slow_get), self.assertRaises(VaultSaveError):
+            self.storage.read("vault")
+
+
+class TestCachedStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return CachedStorage(FileStorage(base_path), max_bytes=4096, ttl=60)
+
+    def test_hits(self):
+        self.storage.create("vault")
+        self.assertTrue(self.storage.exists("vault"))
+        first = self.storage.read("vault")
+        self.assertIs(self.storage.read("vault"), first)
+        self.assertEqual(self.storage.stats()["hits"], 1)
+        self.assertEqual(self.storage.stats()["hit_ratio"], 0.5)
+
+    def test_sees_other_process_writes(self):
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        self.storage.read("vault")
+        # a second FileStorage on the same dir stands in for another worker
+        data = crypto.sign_data(b"written elsewhere", secret)
+        FileStorage(self._tmp.name).write("vault", data)
+        self.assertEqual(self.storage.read("vault").vault_data, data)
+
+    def test_evicts_by_bytes(self):
+        for i in range(10):
+            secret = self.storage.create(f"vault-{i}").vault_secret.encode("utf-8")
+            self.storage.write(f"vault-{i}", crypto.sign_data(b"x" * 1000, secret))
+            self.storage.read(f"vault-{i}")
+        stats = self.storage.stats()
+        self.assertLessEqual(stats["bytes"], 4096)
+        self.assertGreater(stats["evictions"], 0)
+        # the most recent one is still there
+        self.storage.read("vault-9")
+        self.assertEqual(self.storage.stats()["hits"], 1)
+
+    def test_ttl(self):
+        self.storage = CachedStorage(self.storage.inner, ttl=0)
+        self.storage.create("vault")
+        self.storage.read("vault")
+        self.storage.read("vault")
+        self.assertEqual(self.storage.stats()["hits"], 0)
+
+
+class TestInstrumentedStorage(StorageContract, TestCase):
+    def make_storage(self, base_path: str) -> VaultStorage:
+        return InstrumentedStorage(FileStorage(base_path))
+
+    def test_records(self):
+        reads = REGISTRY.histogram("vault_storage_seconds", op="read")
+        sizes = REGISTRY.histogram("vault_storage_bytes", op="write")
+        missing = REGISTRY.counter("vault_storage_errors", op="read", error="VaultReadError")
+        before = (reads.count, sizes.sum, missing.value)
+
+        secret = self.storage.create("vault").vault_secret.encode("utf-8")
+        self.storage.write("vault", crypto.sign_data(b"x" * 100, secret))
+        self.storage.read("vault")
+        with self.assertRaises(VaultReadError):
+            self.storage.read("missing")
+
+        self.assertEqual(reads.count - before[0], 2)
+        self.assertEqual(sizes.sum - before[1], 100 + crypto.SIGNATURE_SIZE)
+        self.assertEqual(missing.value - before[2], 1)
+
+    def test_passes_through_extras(self):
+        self.assertEqual(self.storage._base, self.storage.inner._base)
+
+
+class AsyncStorageContract:
+    """The same flow, through the async interface"""
+
+    def make_storage(self, base_path: str) -> AsyncVaultStorage:
+        raise NotImplementedError
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.storage = self.make_storage(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    async def test_create_read_write_delete(self):
+        self.assertFalse(await self.storage.aexists("vault"))
+        created = await self.storage.acreate("vault")
+        self.assertTrue(await self.storage.aexists("vault"))
+
+        data = crypto.sign_data(b"some encrypted vault", created.vault_secret.encode("utf-8"))
+        await self.storage.awrite("vault", data)
+        self.assertEqual((await self.storage.aread("vault")).vault_data, data)
+        with self.assertRaises(VaultValidationError):
+            await self.storage.awrite("vault", crypto.sign_data(b"data", b"not the secret"))
+        with self.assertRaises(VaultExistsError):
+            await self.storage.acreate("vault")
+        with self.assertRaises(VaultConflictError):
+            await self.storage.awrite("vault", data, expected_version=1)
+        self.assertEqual(await self.storage.awrite("vault", data, expected_version=2), 3)
+        self.assertEqual(await self.storage.avalidator("vault"), (3, data[:32]))
+
+        upload = await self.storage.aopen_upload("vault", 1024)
+        try:
+            await self.storage.afeed_upload(upload, data[:10])
+            await self.storage.afeed_upload(upload, data[10:])
+            self.assertEqual(await self.storage.asave_upload(upload, expected_version=3), 4)
+        finally:
+            upload.close()
+        self.assertEqual((await self.storage.aread("vault")).vault_data, data)
+
+        await self.storage.adelete("vault")
+        self.assertFalse(await self.storage.aexists("vault"))
+        with self.assertRaises(VaultReadError):
+            await self.storage.aread("vault")
+
+    async def test_batches(self):
+        created = dict(await self.storage.acreate_many(["a", "b"]))
+        self.assertEqual(created["a"].version, 1)
+        self.assertEqual(await self.storage.aexists_many(["a", "missing"]), [("a", True), ("missing", False)])
+        results = dict(await self.storage.aread_many(["b", "missing"]))
+        self.assertEqual(results["b"].vault_secret, created["b"].vault_secret)
+        self.assertIsInstance(results["missing"], VaultReadError)
+
+    async def test_list_vaults(self):
+        try:
+            await self.storage.alist_vaults()
+        except NotImplementedError:
+            self.skipTest("backend can't list vaults")
+        await self.storage.acreate_many(["b", "a"])
+        page = await self.storage.alist_vaults(limit=1)
+        self.assertEqual([vault.vault_id for vault in page.vaults], ["a"])
+        page = await self.storage.alist_vaults(page.next_cursor)
+        self.assertEqual(([vault.vault_id for vault in page.vaults], page.next_cursor), (["b"], None))
+
+    async def test_publishes_changes(self):
+        with self.storage.events.subscribe("vault") as subscription:
+            secret = (await self.storage.acreate("vault")).vault_secret.encode("utf-8")
+            self.assertEqual((await subscription.get()).validator, await self.storage.avalidator("vault"))
+            data = crypto.sign_data(b"data", secret)
+            await self.storage.awrite("vault", data)
+            self.assertEqual((await subscription.get()).validator, (2, data[:32]))
+            await self.storage.adelete("vault")
+            self.assertIsNone((await subscription.get()).validator)
+
+    async def test_concurrent_writers(self):
+        secret = (await self.storage.acreate("vault")).vault_secret.encode("utf-8")
+        blobs = [crypto.sign_data(bytes([i]) * 100, secret) for i in range(20)]
+        versions = await asyncio.gather(*(self.storage.awrite("vault", blob) for blob in blobs))
+        self.assertEqual(sorted(versions), list(range(2, 22)))
+        self.assertIn((await self.storage.aread("vault")).vault_data, blobs)
+
+
+class TestThreadedStorage(AsyncStorageContract, IsolatedAsyncioTestCase):
+    def make_storage(self, base_path: str) -> AsyncVaultStorage:
+        return ThreadedStorage(FileStorage(base_path), max_workers=4)
+
+    async def test_writers_queue_per_vault(self):
+        secret = (await self.storage.acreate("vault")).vault_secret.encode("utf-8")
+        await self.storage.acreate("other")
+        in_flight = 0
+        most_in_flight = 0
+        write = self.storage.sync.write
+
+        def counting_write(vault_id: str, data: bytes, expected_version: int | None) -> int:
+            nonlocal in_flight, most_in_flight
+            in_flight += 1
+            most_in_flight = max(most_in_flight, in_flight)
+            try:
+                return write(vault_id, data, expected_version)
+            finally:
+                in_flight -= 1
+
+        self.storage.sync.write = counting_write
+        blobs = [crypto.sign_data(bytes([i]) * 100, secret) for i in range(10)]
+        await asyncio.gather(*(self.storage.awrite("vault", blob) for blob in blobs))
+        # only ever one thread inside the FileLock dance for the same vault
+        self.assertEqual(most_in_flight, 1)
+        self.assertEqual(self.storage.locks.wait_seconds.count, 12)
+        # nobody holds them any more, so they're gone
+        self.assertEqual(len(self.storage.locks), 0)
+
+
+class TestAsyncObjectStorage(AsyncStorageContract, IsolatedAsyncioTestCase):
+    def make_storage(self, base_path: str) -> AsyncVaultStorage:
+        self.server = FakeObjectServer().start()
+        return AsyncObjectStorage(self.server.url, bucket="test")
+
+    async def asyncTearDown(self):
+        await self.storage.aclose()
+
+    def tearDown(self):
+        super().tearDown()
+        self.server.stop()
+
+    async def test_shares_objects_with_sync_client(self):
+        created = await self.storage.acreate("vault")
+        sync = ObjectStorage(self.server.url, bucket="test")
+        self.assertEqual(sync.read("vault").vault_secret, created.vault_secret)
+
+    async def test_timeout_on_pooled_connection(self):
+        await self.storage.acreate("vault")
+        self.assertEqual(len(self.storage._pool), 1)
+        self.storage._timeout = 0.05
+        get = _Handler.do_GET
+
+        def slow_get(handler: _Handler) -> None:
+            time.sleep(0.3)
+            get(handler)
+
+        with patch.object(_Handler, "do_GET", slow_get), self.assertRaises(VaultSaveError):
+            await self.storage.aread("vault")
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from password_manager.backend.uploads import UploadSessions
+from password_manager.util.exceptions import UploadLimitError, UploadOffsetError, VaultReadError, VaultTooLargeError
+
+
+class TestUploadSessions(TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.sessions = UploadSessions(self._tmp.name, ttl=60, sweep_interval=0)
+
+    def tearDown(self):
+        self.sessions.close()
+        self._tmp.cleanup()
+
+    def test_resume(self):
+        session = self.sessions.create("vault", 10, expected_version=3)
+        self.assertEqual(self.sessions.status("vault", session.upload_id).offset, 0)
+        self.assertEqual(self.sessions.append("vault", session.upload_id, 0, b"hello"), 5)
+
+        # a retry of a chunk that already made it is refused, and says where to pick up from
+        with self.assertRaises(UploadOffsetError):
+            self.sessions.append("vault", session.upload_id, 0, b"hello")
+        upload = self.sessions.status("vault", session.upload_id)
+        self.assertEqual((upload.offset, upload.session.expected_version), (5, 3))
+        with self.assertRaises(VaultTooLargeError):
+            self.sessions.append("vault", session.upload_id, 5, b"too much data")
+
+        self.sessions.append("vault", session.upload_id, 5, b"world")
+        self.assertEqual(b"".join(self.sessions.iter_data("vault", session.upload_id, chunk_size=3)), b"helloworld")
+        self.sessions.remove("vault", session.upload_id)
+        with self.assertRaises(VaultReadError):
+            self.sessions.status("vault", session.upload_id)
+        self.assertEqual(self._left(), [])
+
+    def test_sessions_belong_to_their_vault(self):
+        session = self.sessions.create("vault", 10, expected_version=None)
+        with self.assertRaises(VaultReadError):
+            self.sessions.append("other-vault", session.upload_id, 0, b"data")
+        with self.assertRaises(VaultReadError):
+            self.sessions.status("vault", "../../etc/passwd")
+
+    def test_sweep(self):
+        stale = self.sessions.create("vault", 10, expected_version=None)
+        fresh = self.sessions.create("vault", 10, expected_version=None)
+        old = time.time() - 120
+        os.utime(Path(self._tmp.name, f"{stale.upload_id}.part"), (old, old))
+        # and the leftovers of a create that died before writing its session
+        Path(self._tmp.name, "orphaned-upload-id-xx.part").touch()
+        os.utime(Path(self._tmp.name, "orphaned-upload-id-xx.part"), (old, old))
+
+        with self.assertRaises(VaultReadError):
+            self.sessions.status("vault", stale.upload_id)
+        self.assertEqual(self.sessions.sweep(), 2)
+        self.assertEqual(
+            self._left(),
+            [f"{fresh.upload_id}.json", f"{fresh.upload_id}.part"],
+        )
+
+    def test_uploads_per_vault(self):
+        sessions = UploadSessions(self._tmp.name, ttl=60, sweep_interval=0, max_per_vault=2)
+        first = sessions.create("vault", 10, expected_version=None)
+        sessions.create("vault", 10, expected_version=None)
+        with self.assertRaises(UploadLimitError) as raised:
+            sessions.create("vault", 10, expected_version=None)
+        self.assertFalse(raised.exception.out_of_space)
+        # other vaults have their own allowance, and one finishing frees a slot
+        sessions.create("other-vault", 10, expected_version=None)
+        sessions.remove("vault", first.upload_id)
+        sessions.create("vault", 10, expected_version=None)
+
+    def test_pending_bytes(self):
+        sessions = UploadSessions(self._tmp.name, ttl=60, sweep_interval=0, max_pending_bytes=100)
+        stale = sessions.create("vault", 60, expected_version=None)
+        with self.assertRaises(UploadLimitError) as raised:
+            sessions.create("other-vault", 50, expected_version=None)
+        self.assertTrue(raised.exception.out_of_space)
+        sessions.create("other-vault", 40, expected_version=None)
+        # expired uploads don't count, even before the sweep has removed them
+        old = time.time() - 120
+        os.utime(Path(self._tmp.name, f"{stale.upload_id}.part"), (old, old))
+        sessions.create("other-vault", 50, expected_version=None)
+
+    def _left(self) -> list[str]:
+        """What sessions left behind, leaving out the lock creates share"""
+        return sorted(p.name for p in Path(self._tmp.name).iterdir() if not p.name.startswith("."))
@@ -1,8 +1,9 @@
+import pickle
 from unittest import TestCase
 from cryptography.exceptions import InvalidSignature
 
 from password_manager.backend import vault
-from password_manager.util import crypto
+from password_manager.util import crypto, delta
 
 class TestVault(TestCase):
     def test_basic(self):
@@ -41,3 +42,28 @@ class TestVault(TestCase):
       self.assertEqual(test_entry, decrypted_entry)
       decrypted_kv = decrypted_entry.get_key_value("myKey")
       self.assertEqual(decrypted_kv.value, "myValue")
+
+    def test_vaults_from_before_segments(self):
+      key = crypto.SimpleUnlockKey()
+      key.seed(b'some insecure test key')
+      v = vault.Vault()
+      v.new_entry("test entry", "myKey", "myValue")
+      old_style = crypto.encrypt_data(pickle.dumps(v), key)
+      self.assertEqual(vault.decrypt_vault(old_style, key).get_entry("test entry").key_values[0].value, "myValue")
+
+    def test_delta(self):
+      key = crypto.SimpleUnlockKey()
+      key.seed(b'some insecure test key')
+      v = vault.Vault()
+      for i in range(100):
+          v.new_entry(f"entry {i}", "myKey", "some value" * 10)
+      base = crypto.sign_data(vault.encrypt_vault(v, key), b'vault secret')
+
+      v.delete_entry(v.entries[10])
+      v.new_entry("new entry", "myKey", "myValue")
+      new = crypto.sign_data(vault.encrypt_vault(v, key), b'vault secret')
+
+      patch = vault.vault_delta(base, new)
+      # just the signatures and the new entry go over, not the whole vault again
+      self.assertLess(len(patch), len(new) // 20)
+      self.assertEqual(b"".join(delta.apply_delta(patch, len(base), lambda start, end: [base[start:end]])), new)